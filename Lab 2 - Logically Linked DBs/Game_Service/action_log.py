@@ -0,0 +1,244 @@
+"""Keeping games' maps in the DB, so they survive a replica going down
+
+Every action the tick engine applies is appended to game_actions, and every
+so often a snapshot of the whole map goes to game_snapshots, replacing the
+last one and the logged actions it already includes. A game is rebuilt from
+its snapshot, then the actions logged after it are replayed tick by tick.
+"""
+import time
+import logging
+import threading
+
+import psycopg2
+from prometheus_client import Counter, Histogram
+
+import queries
+import actions
+import protocol
+from map_state import MapState
+
+
+logger = logging.getLogger(__name__)
+
+flush_actions = Histogram("game_service_log_flush_actions", "Actions written to the game log in one commit",
+    buckets = (1, 10, 100, 1000, 10000))
+flush_duration = Histogram("game_service_log_flush_seconds", "Time taken to write one batch of the game log")
+snapshots_saved = Counter("game_service_log_snapshots", "Game map snapshots written")
+games_restored = Counter("game_service_log_games_restored", "Game maps rebuilt from their snapshot and log")
+
+# How long actions wait to be written, at most, unless FLUSH_SIZE of them pile up first.
+# All waiting actions, of every game, are written with a single commit
+FLUSH_INTERVAL = 0.05 # seconds
+FLUSH_SIZE = 5000
+# A game's map is snapshotted once this many of its ticks changed it, or this long after
+# the first change since the last snapshot, whichever comes first
+SNAPSHOT_TICKS = 600
+SNAPSHOT_INTERVAL = 30 # seconds
+RETRY_DELAY = 2 # seconds
+
+
+class ActionLog:
+    """Applied actions waiting for a LogWriter, and what each game needs a snapshot for
+
+    Every logged action gets the next of its game's sequence numbers, which
+    snapshots use to tell which actions they already include.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._forgotten = set()
+        # Game ID -> [seq of the last snapshot, ticks logged since, when the first of those was]
+        # Games missing from here haven't been snapshotted by this replica yet
+        self._snapshots = {}
+        self.wake = threading.Event()
+
+    def record(self, game_id, state, tick, applied):
+        """Queues the actions a tick applied, called with the game's lock held"""
+        rows = []
+        for player_id, action in applied:
+            state.log_seq += 1
+            rows.append((game_id, state.log_seq, tick, player_id, action))
+
+        with self._lock:
+            self._pending.extend(rows)
+            snapshot = self._snapshots.get(game_id)
+            if snapshot is not None:
+                if snapshot[1] == 0:
+                    snapshot[2] = time.monotonic()
+                snapshot[1] += 1
+            if len(self._pending) >= FLUSH_SIZE:
+                self.wake.set()
+
+    def forget(self, game_id):
+        """Drops the game's waiting actions, and has its log and snapshot deleted"""
+        with self._lock:
+            self._forgotten.add(game_id)
+            self._snapshots.pop(game_id, None)
+        self.wake.set()
+
+    def take(self):
+        """Hands the waiting actions and forgotten games over for writing"""
+        with self._lock:
+            rows, forgotten = self._pending, self._forgotten
+            self._pending, self._forgotten = [], set()
+        if forgotten:
+            rows = [row for row in rows if row[0] not in forgotten]
+        return rows, forgotten
+
+    def put_back(self, rows, forgotten):
+        """Returns what take() handed over after failing to write it"""
+        with self._lock:
+            self._pending[:0] = rows
+            self._forgotten |= forgotten
+
+    def resnapshot(self, game_id):
+        """Has the game snapshotted on the writer's next round, whatever changed since the last one"""
+        with self._lock:
+            self._snapshots.pop(game_id, None)
+        self.wake.set()
+
+    def settled(self, game_ids):
+        """Whether every action was written and the games were snapshotted since resnapshot()"""
+        with self._lock:
+            return not self._pending and all(game_id in self._snapshots for game_id in game_ids)
+
+    def saved(self, game_id, seq):
+        """Whether the game's last snapshot includes every action up to `seq`"""
+        snapshot = self._snapshots.get(game_id)
+        return snapshot is not None and snapshot[0] >= seq
+
+    def release(self, game_id):
+        """Stops keeping track of a game no longer in memory, it gets snapshotted again if it comes back"""
+        with self._lock:
+            self._snapshots.pop(game_id, None)
+
+    def snapshot_due(self, game_id, state, now):
+        snapshot = self._snapshots.get(game_id)
+        if snapshot is None:
+            return True
+        seq, ticks, since = snapshot
+        return state.log_seq > seq and (ticks >= SNAPSHOT_TICKS or now - since >= SNAPSHOT_INTERVAL)
+
+    def snapshot_saved(self, game_id, seq):
+        with self._lock:
+            self._snapshots[game_id] = [seq, 0, 0]
+
+
+class LogWriter(threading.Thread):
+    """Writes an ActionLog to the DB and snapshots the maps of the games it's logging
+
+    Actions are written in batches with one commit each, rather than one per
+    tick or per game. Snapshots are too, each along with the deletion of the
+    actions it includes.
+    """
+    def __init__(self, dsn, log, maps):
+        super().__init__(daemon = True)
+        self.dsn = dsn
+        self.log = log
+        self.maps = maps
+
+    def run(self):
+        while True:
+            try:
+                self._write()
+            except psycopg2.Error as e:
+                logger.info(f"Lost the game log connection, retrying: {e}")
+                time.sleep(RETRY_DELAY)
+
+    def _write(self):
+        conn = psycopg2.connect(self.dsn)
+        try:
+            with conn.cursor() as cursor:
+                while True:
+                    self.log.wake.wait(FLUSH_INTERVAL)
+                    self.log.wake.clear()
+                    self.flush(conn, cursor)
+                    self.snapshot(conn, cursor)
+        finally:
+            conn.close()
+
+    def flush(self, conn, cursor):
+        """Writes every waiting action in one transaction"""
+        rows, forgotten = self.log.take()
+        if not rows and not forgotten:
+            return
+        start = time.perf_counter()
+        try:
+            if rows:
+                # One array per column, tuples would be sent as records
+                columns = [list(column) for column in zip(*rows)]
+                columns[4] = [protocol.encode_binary(action) for action in columns[4]]
+                cursor.execute(queries.LOG_ACTIONS, columns)
+            for game_id in forgotten:
+                cursor.execute(queries.FORGET_GAME, {"game": game_id})
+            conn.commit()
+        except psycopg2.Error:
+            self.log.put_back(rows, forgotten)
+            raise
+        flush_actions.observe(len(rows))
+        flush_duration.observe(time.perf_counter() - start)
+
+    def snapshot(self, conn, cursor):
+        """Snapshots every game that's due one and compacts its log, all in one commit"""
+        now = time.monotonic()
+        saved = []
+        for game_id, state in self.maps.items():
+            if not self.log.snapshot_due(game_id, state, now):
+                continue
+            with state.lock:
+                data = state.dump()
+                seq = state.log_seq
+            # Actions up to seq still waiting to be written end up behind the snapshot,
+            # they're skipped on replay and deleted by the next one
+            cursor.execute(queries.SAVE_SNAPSHOT, {"game": game_id, "seq": seq, "players": state.players, "state": data})
+            cursor.execute(queries.COMPACT_ACTIONS, (game_id, seq))
+            saved.append((game_id, seq))
+        if not saved:
+            return
+        conn.commit()
+        for game_id, seq in saved:
+            self.log.snapshot_saved(game_id, seq)
+        snapshots_saved.inc(len(saved))
+
+
+def replay(state, rows):
+    """Applies logged (seq, tick, player ID, action frame) rows, in the same batches as they were
+
+    The engine applies each tick's player actions as one batch, then each game
+    event of the tick as a batch of its own (see tick_engine.py), so events
+    never share a batch. Trades go last in a batch, sharing one with the year
+    end would pay them after it rather than before.
+    """
+    batch = []
+    batch_tick = None
+    for seq, tick, player_id, frame in rows:
+        if batch and (tick != batch_tick or player_id == actions.GAME or batch[-1][0] == actions.GAME):
+            actions.apply_batch(state, batch)
+            state.commit()
+            batch = []
+        batch_tick = tick
+        batch.append((player_id, protocol.decode_binary(frame)))
+        state.log_seq = seq
+    if batch:
+        actions.apply_batch(state, batch)
+        state.commit()
+
+
+def restore(snapshot, rows):
+    """Rebuilds a game's map from its (seq, players, state) snapshot and the rows of GET_LOGGED_ACTIONS after it"""
+    seq, players, data = snapshot
+    state = MapState.load(players, bytes(data))
+    state.log_seq = seq
+    replay(state, rows)
+    games_restored.inc()
+    return state
+
+
+def load(cursor, game_id):
+    """Rebuilds a game's map from its snapshot and log, None if it was never saved"""
+    cursor.execute(queries.GET_SNAPSHOT, (game_id,))
+    snapshot = cursor.fetchone()
+    if snapshot is None:
+        return None
+    cursor.execute(queries.GET_LOGGED_ACTIONS, (game_id, snapshot[0]))
+    return restore(snapshot, cursor.fetchall())
@@ -0,0 +1,126 @@
+"""Player actions sent over the websocket, see the README for their fields"""
+import units
+import trade
+import combat
+import diplomacy
+import pathfinding
+
+
+# Sent by the game itself, never by players: at the end of each game-year,
+# and every time units with orders take a step and battles are fought
+YEAR_END = 0
+MARCH = 8
+# Player ID the game's own events are sent as, no user has it
+GAME = -1
+
+POLICY = 1
+UPGRADE = 2
+DIPLOMACY = 3
+TRADE = 4
+UNITS = 5
+CHAT = 6
+MOVE = 7
+
+
+def apply_policy(state, nation, action):
+    state.policy[nation] = action["policyID"]
+    state.nation_changed(nation)
+    return True
+
+
+def apply_upgrade(state, nation, action):
+    province = action["provinceID"] - 1
+    # Only the province's owner can build in it
+    if not 0 <= province < len(state.owner) or state.owner[province] != nation:
+        return False
+    state.upgrade[province] = action["upgradeID"]
+    state.province_changed(province)
+    return True
+
+
+def apply_diplomacy(state, nation, action):
+    other = state.nation_of.get(action["targetPlayer"])
+    if other is None:
+        return False
+    return diplomacy.propose(state, nation, other, action["diploID"])
+
+
+def apply_units(state, nation, action):
+    return units.raise_units(state, nation, action["unitTypes"], action["unitIDs"])
+
+
+def apply_move(state, nation, action):
+    return units.order_units(state, nation, action["unitIDs"], action["provinceIDs"])
+
+
+def march(state, nation, action):
+    moved = units.march(state, pathfinding.default_finder())
+    battles, taken = combat.resolve(state)
+    return moved + battles + taken > 0
+
+
+def end_year(state, nation, action):
+    trade.end_year(state)
+    return True
+
+
+def relay(state, nation, action):
+    # No effect on the map yet, the other players only need to hear about it
+    return True
+
+
+HANDLERS = {
+    POLICY: apply_policy,
+    UPGRADE: apply_upgrade,
+    DIPLOMACY: apply_diplomacy,
+    UNITS: apply_units,
+    CHAT: relay,
+    MOVE: apply_move
+}
+
+# Actions applied all at once after the rest of the tick's,
+# handlers take a list of (nation, action) and return whether each took effect
+BATCHED = {
+    TRADE: trade.apply_trades
+}
+
+EVENTS = {
+    YEAR_END: end_year,
+    MARCH: march
+}
+
+
+def apply_batch(state, batch):
+    """Applies a tick's (player ID, action) entries in order, returns the ones that took effect
+
+    Actions from players outside the game, or ones they aren't allowed to take, are dropped.
+    """
+    taken = [False] * len(batch)
+    batched = {}
+    for i, (player_id, action) in enumerate(batch):
+        action_id = action["actionID"]
+        if player_id == GAME:
+            nation, handler = None, EVENTS.get(action_id)
+        else:
+            nation, handler = state.nation_of.get(player_id), HANDLERS.get(action_id)
+            if nation is None:
+                continue
+            if action_id in BATCHED:
+                batched.setdefault(action_id, []).append((i, nation, action))
+                continue
+        if handler is None:
+            continue
+        try:
+            taken[i] = bool(handler(state, nation, action))
+        except (TypeError, ValueError, OverflowError):
+            # A field of the wrong type
+            continue
+
+    for action_id, entries in batched.items():
+        try:
+            results = BATCHED[action_id](state, [(nation, action) for i, nation, action in entries])
+        except (TypeError, ValueError, OverflowError):
+            continue
+        for (i, nation, action), took in zip(entries, results):
+            taken[i] = took
+    return [entry for entry, took in zip(batch, taken) if took]
@@ -0,0 +1,913 @@
+"""Benchmarks for the Game Service
+
+Run with `python bench.py [name ...]`, all of them run if no name is given.
+The DB benchmarks write to DATABASE_URL, so point it at a scratch database.
+The world map is compiled into world.map on first use if it's missing.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from concurrent import futures
+
+import grpc
+import numpy as np
+import psycopg2
+import jsonschema
+
+import db
+import main
+import queries
+import rooms
+import actions
+import trade
+import units
+import combat
+import diplomacy
+import handoff
+import hibernation
+import action_log
+import protocol
+import map_state
+import placement
+import world_map
+import pathfinding
+import tick_engine
+import statements
+import response_cache
+import game_routes_pb2 as pb2
+import game_routes_pb2_grpc as pb2_grpc
+
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def setup_db():
+    main.logger = logging.getLogger("main")
+    dsn = os.getenv('DATABASE_URL')
+    with db.single_cursor(dsn) as cursor:
+        main.check_db_tables(cursor)
+    main.pool = db.ConnectionPool(dsn, main.MAX_WORKERS)
+
+
+@benchmark
+def lobby_contention(threads = 64, capacity = 16):
+    """Many players join then leave the same lobby at once, capacity must hold throughout"""
+    setup_db()
+    service = main.GameService()
+
+    with main.pool.cursor() as cursor:
+        cursor.execute(queries.MAKE_LOBBY, {"name": "contention", "max": capacity, "user": 0})
+        lobby_id = cursor.fetchone()[0]
+
+    overfilled = []
+    stop = threading.Event()
+
+    def watch():
+        while not stop.is_set():
+            lobby = service.getLobby(pb2.LobbyID(lobbyID = lobby_id), None)
+            if lobby.currMembers > lobby.maxMembers:
+                overfilled.append(lobby.currMembers)
+
+    def run(method, user_id, results):
+        request = pb2.HybridID(lobbyID = lobby_id, userID = user_id)
+        results[user_id] = getattr(service, method)(request, None).status
+
+    def hammer(method):
+        results = {}
+        workers = [threading.Thread(target = run, args = (method, i, results)) for i in range(1, threads + 1)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        print(f"{method}: {threads} calls in {elapsed * 1000:.1f}ms")
+        return results
+
+    watcher = threading.Thread(target = watch)
+    watcher.start()
+    joins = hammer("joinLobby")
+    lobby = service.getLobby(pb2.LobbyID(lobbyID = lobby_id), None)
+
+    # The creator (user 0) leaves too, so the lobby should be gone afterwards
+    leaves = hammer("leaveLobby")
+    service.leaveLobby(pb2.HybridID(lobbyID = lobby_id, userID = 0), None)
+    stop.set()
+    watcher.join()
+
+    joined = [user for user, status in joins.items() if status == 200]
+    assert not overfilled, f"Lobby overfilled: {overfilled}"
+    assert lobby.currMembers == len(joined) + 1, (lobby.currMembers, len(joined))
+    assert lobby.currMembers <= capacity
+    assert sorted(lobby.players) == sorted(joined + [0])
+    assert all(status == 200 for status in leaves.values())
+    assert service.getLobby(pb2.LobbyID(lobbyID = lobby_id), None).status == 404
+    print(f"{len(joined)} of {threads} joins accepted, capacity {capacity} never exceeded")
+
+    main.pool.close()
+
+
+
+@benchmark
+def serialized_responses(sizes = (10, 1000, 50000), rounds = 20):
+    """Building and serializing lobby lists vs serving them from the response cache"""
+    cache = response_cache.ResponseCache(max_entries = 16)
+    for size in sizes:
+        rows = [(i, f"lobby{i}", i % 8, 8) for i in range(1, size + 1)]
+        request_bytes = pb2.LobbyQuery(pageSize = size).SerializeToString()
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            data = main.lobby_list(rows, size).SerializeToString()
+        built = (time.perf_counter() - start) / rounds
+
+        cache.put("getLobbies", request_bytes, 1, data)
+        start = time.perf_counter()
+        for i in range(rounds):
+            cache.get("getLobbies", request_bytes, 1)
+        cached = (time.perf_counter() - start) / rounds
+
+        print(f"{size} lobbies ({len(data)} bytes): built in {built * 1000:.3f}ms, "
+              f"cached in {cached * 1000:.4f}ms, {built / cached:.0f}x faster")
+
+
+@benchmark
+def prepared_statements(lobby_count = 1000, rounds = 2000):
+    """Per-query latency of the hot queries sent as SQL text vs run as prepared statements"""
+    setup_db()
+    with main.pool.cursor() as cursor:
+        lobby_ids = []
+        for i in range(lobby_count):
+            cursor.execute(queries.MAKE_LOBBY, {"name": f"prepared{i}", "max": 8, "user": 0})
+            lobby_ids.append(cursor.fetchone()[0])
+
+        cases = [
+            ("get_lobby", lambda i: (queries.GET_LOBBY, (lobby_ids[i % lobby_count],))),
+            ("get_lobbies", lambda i: (queries.GET_LOBBIES, {"after": lobby_ids[i % lobby_count], "prefix": "", "limit": 50})),
+            ("get_free_lobbies", lambda i: (queries.GET_FREE_LOBBIES, {"after": lobby_ids[i % lobby_count], "prefix": "prep", "limit": 50})),
+            # Alternating, so every join is undone by the next leave
+            ("join/leave_lobby", lambda i: (queries.LEAVE_LOBBY if i % 2 else queries.JOIN_LOBBY,
+                                           {"lobby": lobby_ids[i // 2 % lobby_count], "user": 1}))
+        ]
+        for name, case in cases:
+            start = time.perf_counter()
+            for i in range(rounds):
+                cursor.execute(*case(i))
+                cursor.fetchall()
+            plain = (time.perf_counter() - start) / rounds
+
+            start = time.perf_counter()
+            for i in range(rounds):
+                statements.execute(cursor, *case(i))
+                cursor.fetchall()
+            prepared = (time.perf_counter() - start) / rounds
+
+            print(f"{name}: {plain * 1e6:.0f}us as text, {prepared * 1e6:.0f}us prepared, "
+                  f"{(1 - prepared / plain) * 100:.0f}% less")
+
+        cursor.execute("DELETE FROM lobby_tbl WHERE id = ANY(%s)", (lobby_ids,))
+    main.pool.close()
+
+
+@benchmark
+def game_summaries(games = 1000, provinces = 400):
+    """Building endGame's MapData for many games at once, vectorized vs one province at a time"""
+    rng = np.random.default_rng(0)
+    maps = map_state.GameMaps()
+    for game_id in range(games):
+        players = list(range(rng.integers(5, 21)))
+        state = maps.get_or_create(game_id, players)
+        # Mid-game, most provinces have been taken by someone
+        state.owner[:] = rng.integers(map_state.NO_OWNER, len(players), size = provinces)
+
+    def by_province(state):
+        population = [0] * len(state.players)
+        held = [[] for player in state.players]
+        for province, owner in enumerate(state.owner.tolist()):
+            if owner != map_state.NO_OWNER:
+                population[owner] += int(state.population[province])
+                held[owner].append(province + 1)
+        return [pb2.PlayerData(population = total, provinceIDs = ids) for total, ids in zip(population, held)]
+
+    for name, build in (("one province at a time", by_province), ("vectorized", main.nation_data)):
+        start = time.perf_counter()
+        for game_id in range(games):
+            pb2.MapData(status = 200, nations = build(maps.get(game_id))).SerializeToString()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {games} games in {elapsed * 1000:.1f}ms, {elapsed / games * 1e6:.0f}us per game")
+
+    state = maps.get(0)
+    assert [nation.provinceIDs for nation in by_province(state)] == [nation.provinceIDs for nation in main.nation_data(state)]
+    assert [nation.population for nation in by_province(state)] == [nation.population for nation in main.nation_data(state)]
+
+
+@benchmark
+def tick_fairness(games = 500, players = 8, flood = 5000):
+    """Ticks over many games while one of them floods its queue, the others must still be served every tick"""
+    maps = map_state.GameMaps()
+    for game_id in range(games):
+        maps.get_or_create(game_id, range(players))
+
+    applied_at = {}
+    def publish(game_id, tick, applied):
+        for entry in applied:
+            applied_at.setdefault(game_id, []).append(tick)
+
+    engine = tick_engine.TickEngine(maps, publish)
+    accepted = sum(engine.submit(0, 0, {"actionID": actions.POLICY, "policyID": i}) for i in range(flood))
+
+    durations = []
+    for tick in range(1, 6):
+        for game_id in range(1, games):
+            for player in range(players):
+                engine.submit(game_id, player, {"actionID": actions.POLICY, "policyID": tick})
+        start = time.perf_counter()
+        engine.step()
+        durations.append(time.perf_counter() - start)
+
+    # Every quiet game had all of its actions applied in the tick they were sent for
+    for game_id in range(1, games):
+        assert applied_at[game_id] == [tick for tick in range(1, 6) for player in range(players)]
+        assert maps.get(game_id).policy.tolist() == [5] * players
+    print(f"Flooding game: {accepted} of {flood} actions queued, {len(applied_at[0])} applied over 5 ticks")
+    print(f"{games} games, {(games - 1) * players} actions per tick: "
+          f"{min(durations) * 1000:.1f}ms to {max(durations) * 1000:.1f}ms per tick "
+          f"(budget {1000 / tick_engine.TICK_RATE:.0f}ms)")
+
+
+@benchmark
+def action_decoding(count = 100000):
+    """Websocket actions decoded per second, as JSON and as binary frames"""
+    rng = np.random.default_rng(0)
+    samples = [
+        {"actionID": actions.POLICY, "policyID": 3},
+        {"actionID": actions.UPGRADE, "provinceID": 120, "upgradeID": 2},
+        {"actionID": actions.DIPLOMACY, "targetPlayer": 17, "diploID": 1},
+        {"actionID": actions.TRADE, "targetPlayer": 17, "tradeSendItems": [1, 2, 3], "tradeSendQty": [10, 20, 30],
+            "tradeGetItems": [4], "tradeGetQty": [15], "yearlyRate": True},
+        {"actionID": actions.UNITS, "unitTypes": [1] * 8, "unitIDs": list(range(100, 108))},
+        {"actionID": actions.CHAT, "targetPlayer": 17, "messageBody": "Nice weather for an invasion"}
+    ]
+    picks = rng.integers(len(samples), size = count)
+    texts = [json.dumps(samples[i]) for i in picks]
+    frames = [protocol.encode_binary(samples[i]) for i in picks]
+
+    def validate_each_time(message):
+        # What jsonschema.validate costs without compiled validators
+        action = json.loads(message)
+        jsonschema.validate(action, protocol.SCHEMAS[action["actionID"]])
+        return action
+
+    runs = (
+        ("JSON, schema checked per call", validate_each_time, texts[:count // 100]),
+        ("JSON, compiled validators", protocol.decode, texts),
+        ("binary", protocol.decode, frames)
+    )
+    for name, decode, messages in runs:
+        start = time.perf_counter()
+        for message in messages:
+            assert decode(message) is not None
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(messages) / elapsed:,.0f} messages/s, {elapsed / len(messages) * 1e6:.2f}us each")
+
+
+@benchmark
+def room_fanout(members = 200, ticks = 1000):
+    """Broadcasting ticks to a full room while one client has stopped reading"""
+    class FakeSocket:
+        def __init__(self, stalled = False):
+            self.stalled = stalled
+            self.received = 0
+            self.close_code = None
+
+        async def send(self, message):
+            if self.stalled:
+                await asyncio.Event().wait()
+            self.received += 1
+
+        async def close(self, code, reason):
+            self.close_code = code
+
+    async def run():
+        game_rooms = rooms.Rooms()
+        sockets = [FakeSocket() for i in range(members - 1)] + [FakeSocket(stalled = True)]
+        connections = [rooms.Connection(socket, i) for i, socket in enumerate(sockets)]
+        for connection in connections:
+            game_rooms.join(1, connection)
+
+        entries = [{"player": i, "actionID": actions.POLICY, "policyID": i} for i in range(8)]
+        broadcasting = 0
+        start = time.perf_counter()
+        for tick in range(ticks):
+            broadcast_start = time.perf_counter()
+            game_rooms.broadcast(1, main.tick_message(tick, entries))
+            broadcasting += time.perf_counter() - broadcast_start
+            # Writers get to run between ticks
+            await asyncio.sleep(0)
+        while any(socket.received < ticks for socket in sockets[:-1]):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+
+        assert sockets[-1].close_code == rooms.SLOW_CLOSE_CODE
+        assert sockets[-1].received == 0
+        for connection in connections:
+            connection.close()
+        print(f"{ticks} ticks to {members} clients: {broadcasting / ticks * 1e6:.0f}us per broadcast, "
+              f"{ticks * (members - 1) / elapsed:,.0f} messages delivered/s, the stalled client got disconnected")
+
+    asyncio.run(run())
+
+
+@benchmark
+def action_replay(ticks = 2000, players = 8, game_id = 2**31 - 1):
+    """Logs a game's actions through group commits, then rebuilds it from its snapshot and log"""
+    setup_db()
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+    cursor.execute(queries.FORGET_GAME, {"game": game_id})
+    conn.commit()
+
+    maps = map_state.GameMaps()
+    log = action_log.ActionLog()
+    writer = action_log.LogWriter(None, log, maps)
+    engine = tick_engine.TickEngine(maps, lambda *args: None, log)
+    live = maps.get_or_create(game_id, range(players))
+    # The game's first snapshot, everything after it gets replayed
+    writer.snapshot(conn, cursor)
+
+    rng = np.random.default_rng(0)
+    capitals = {nation: int(np.flatnonzero(live.owner == nation)[0]) + 1 for nation in range(players)}
+    types = live.stock.shape[1]
+
+    def send(player, item, qty, yearly = False, target = None):
+        target = (player + 1) % players if target is None else target
+        return {"actionID": actions.TRADE, "targetPlayer": target, "yearlyRate": yearly,
+            "tradeSendItems": [item], "tradeSendQty": [qty], "tradeGetItems": [], "tradeGetQty": []}
+    # Yearly trades only paid for out of savings, which one-off trades to the last player spend
+    # in the tick the year ends: replays must end the year after those, like it was live
+    income = live.nation_resources()
+    sink = players - 1
+    for player in range(sink):
+        engine.submit(game_id, player, send(player, 0, int(income[player, 0]) + 1, yearly = True))
+    writing = 0
+    for tick in range(1, ticks + 1):
+        for player in range(players):
+            roll = rng.random()
+            if tick % tick_engine.TICKS_PER_YEAR == 0 and player != sink:
+                engine.submit(game_id, player, send(player, 0, max(int(live.stock[player, 0]), 1), target = sink))
+            elif roll < 0.4:
+                engine.submit(game_id, player, {"actionID": actions.POLICY, "policyID": int(rng.integers(1, 100))})
+            elif roll < 0.8:
+                engine.submit(game_id, player, {"actionID": actions.UPGRADE, "provinceID": capitals[player],
+                    "upgradeID": int(rng.integers(1, 100))})
+            else:
+                engine.submit(game_id, player, send(player, int(rng.integers(1, types)), int(rng.integers(1, 40))))
+        engine.step()
+        # The writer wakes up about every other tick
+        if tick % 2 == 0:
+            start = time.perf_counter()
+            writer.flush(conn, cursor)
+            writing += time.perf_counter() - start
+    logged = live.log_seq
+    print(f"{logged} actions logged over {ticks} ticks: {logged / writing:,.0f} actions/s written, "
+          f"{writing / (ticks / 2) * 1000:.2f}ms per group commit")
+
+    start = time.perf_counter()
+    cursor.execute(queries.GET_SNAPSHOT, (game_id,))
+    seq, saved_players, data = cursor.fetchone()
+    cursor.execute(queries.GET_LOGGED_ACTIONS, (game_id, seq))
+    rows = cursor.fetchall()
+    fetched = time.perf_counter()
+    restored = map_state.MapState.load(saved_players, bytes(data))
+    action_log.replay(restored, rows)
+    replayed = time.perf_counter()
+    for name in map_state.MapState.SAVED:
+        assert np.array_equal(getattr(restored, name), getattr(live, name))
+    assert restored.log_seq == live.log_seq
+    print(f"Recovery: {(fetched - start) * 1000:.0f}ms to fetch {len(rows)} actions, "
+          f"{(replayed - fetched) * 1000:.0f}ms to replay them, {len(rows) / (replayed - fetched):,.0f} actions/s")
+
+    # Well past SNAPSHOT_TICKS, so the next snapshot compacts the whole log away
+    writer.snapshot(conn, cursor)
+    cursor.execute(queries.GET_LOGGED_ACTIONS, (game_id, 0))
+    assert cursor.fetchall() == []
+    cursor.execute(queries.FORGET_GAME, {"game": game_id})
+    conn.commit()
+    conn.close()
+    main.pool.close()
+
+
+@benchmark
+def ring_rebalance(games = 100000, replicas = 4):
+    """How evenly the placement ring spreads games, and how many move when a replica joins or leaves"""
+    hosts = [f"game-service-{i}" for i in range(replicas + 1)]
+    before = placement.HashRing({host: placement.tokens_for(host) for host in hosts[:-1]})
+    after = placement.HashRing({host: placement.tokens_for(host) for host in hosts})
+
+    start = time.perf_counter()
+    owners = [before.owner(game_id) for game_id in range(games)]
+    elapsed = time.perf_counter() - start
+    moved_owners = [after.owner(game_id) for game_id in range(games)]
+
+    counts = [owners.count(host) for host in hosts[:-1]]
+    moved = sum(old != new for old, new in zip(owners, moved_owners))
+    # Games only ever move to the new replica
+    assert all(old == new or new == hosts[-1] for old, new in zip(owners, moved_owners))
+    print(f"{replicas} replicas: {min(counts) / games:.1%} to {max(counts) / games:.1%} of games each, "
+          f"{elapsed / games * 1e6:.1f}us per lookup")
+    print(f"Adding a replica moves {moved / games:.1%} of games (ideal {1 / (replicas + 1):.1%}), "
+          f"removing it moves them back")
+
+
+@benchmark
+def game_handoff(games = 200, players = 8, queued = 16, port = 7199):
+    """Drains games to another replica over gRPC, players must see each game paused for under a second"""
+    target_maps = map_state.GameMaps()
+    target_ring = placement.HashRing()
+    target_engine = tick_engine.TickEngine(target_maps, lambda *args: None)
+
+    class Target(pb2_grpc.GameRoutesServicer):
+        def migrateGame(self, request, context):
+            handoff.adopt(request, target_maps, target_ring, target_engine, "target")
+            return pb2.Status(status = 200)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers = main.MAX_WORKERS))
+    pb2_grpc.add_GameRoutesServicer_to_server(Target(), server)
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    threading.Thread(target = asyncio.run, args = (target_engine.run(),), daemon = True).start()
+    stub = pb2_grpc.GameRoutesStub(grpc.insecure_channel(f"127.0.0.1:{port}"))
+
+    class FakeSocket:
+        def __init__(self):
+            self.close_code = None
+            self.close_reason = None
+
+        async def send(self, message):
+            pass
+
+        async def close(self, code, reason):
+            self.close_code, self.close_reason = code, reason
+
+    async def run():
+        maps = map_state.GameMaps()
+        engine = tick_engine.TickEngine(maps, lambda *args: None)
+        game_rooms = rooms.Rooms()
+        ring = placement.HashRing()
+        sockets = []
+        for game_id in range(games):
+            maps.get_or_create(game_id, range(players))
+            for player in range(players):
+                engine.submit(game_id, player, {"actionID": actions.POLICY, "policyID": player})
+                socket = FakeSocket()
+                sockets.append(socket)
+                game_rooms.join(game_id, rooms.Connection(socket, player))
+        engine.step()
+        # Actions still waiting for a tick when the drain starts, they go along with their game
+        for game_id in range(games):
+            for i in range(queued):
+                engine.submit(game_id, i % players, {"actionID": actions.POLICY, "policyID": 100 + i})
+
+        slots = asyncio.Semaphore(handoff.DRAIN_CONCURRENCY)
+        pauses = []
+        async def one(game_id, state):
+            async with slots:
+                start = time.perf_counter()
+                handed_over = await handoff.hand_over(game_id, state, "target", stub, engine, game_rooms, ring)
+                pauses.append(time.perf_counter() - start)
+                return handed_over
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(game_id, state) for game_id, state in maps.items()))
+        elapsed = time.perf_counter() - start
+        assert all(results)
+        assert all(socket.close_code == placement.MISPLACED_CLOSE_CODE and socket.close_reason == "target" for socket in sockets)
+        assert all(ring.owner(game_id) == "target" and not engine.submit(game_id, 0, {}) for game_id in range(games))
+        return maps, elapsed, sorted(pauses)
+
+    maps, elapsed, pauses = asyncio.run(run())
+    # The queued actions get applied by the target's next tick
+    time.sleep(3 / tick_engine.TICK_RATE)
+    final = [max(100 + i for i in range(queued) if i % players == player) for player in range(players)]
+    for game_id, state in maps.items():
+        moved = target_maps.get(game_id)
+        assert moved.policy.tolist() == final and moved.log_seq == state.log_seq
+        assert np.array_equal(moved.owner, state.owner) and target_ring.owner(game_id) == "target"
+    print(f"{games} games handed over in {elapsed * 1000:.0f}ms, {handoff.DRAIN_CONCURRENCY} at a time")
+    print(f"Pause per game: median {pauses[len(pauses) // 2] * 1000:.1f}ms, max {pauses[-1] * 1000:.1f}ms")
+    assert pauses[-1] < 1
+
+    async def rebalance():
+        """A replica joins, the games now landing on its points must go to it"""
+        maps = map_state.GameMaps()
+        engine = tick_engine.TickEngine(maps, lambda *args: None)
+        ring = placement.HashRing({"self": placement.tokens_for("self")})
+        resident = range(games, 2 * games)
+        for game_id in resident:
+            maps.get_or_create(game_id, range(players))
+
+        def misplaced(game_id):
+            owner = ring.owner(game_id)
+            return None if owner == "self" else owner
+        rebalancer = handoff.Rebalancer(maps, action_log.ActionLog(), engine, rooms.Rooms(), ring, misplaced, lambda host: stub)
+        assert await rebalancer.sweep() == ([], [])
+
+        ring.update({"self": placement.tokens_for("self"), "target": placement.tokens_for("target")})
+        joined = sorted(game_id for game_id in resident if ring.owner(game_id) == "target")
+        start = time.perf_counter()
+        moved, saved = await rebalancer.sweep()
+        elapsed = time.perf_counter() - start
+        assert sorted(moved) == joined and not saved and len(maps) == games - len(joined)
+        # Gone from here, and no longer frozen should the ring give them back
+        assert all(maps.get(game_id) is None and engine.submit(game_id, 0, {}) for game_id in joined)
+        assert all(target_maps.get(game_id) is not None for game_id in joined)
+        return len(joined), elapsed
+
+    moved, elapsed = asyncio.run(rebalance())
+    server.stop(None)
+    print(f"A replica joining: {moved} of {games} resident games handed to it in {elapsed * 1000:.0f}ms")
+
+
+@benchmark
+def hibernation_budget(games = 2000, resident = 500, first_id = 2**31 - 10000):
+    """Keeps many games under a memory budget, then rehydrates hibernated ones"""
+    setup_db()
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+
+    maps = map_state.GameMaps()
+    log = action_log.ActionLog()
+    writer = action_log.LogWriter(None, log, maps)
+    engine = tick_engine.TickEngine(maps, lambda *args: None, log)
+    game_rooms = rooms.Rooms()
+    game_ids = range(first_id, first_id + games)
+    per_game = maps.get_or_create(first_id, range(8)).nbytes()
+    hibernator = hibernation.Hibernator(maps, log, engine, game_rooms, budget = resident * per_game)
+    for game_id in game_ids:
+        maps.get_or_create(game_id, range(8))
+        engine.submit(game_id, 0, {"actionID": actions.POLICY, "policyID": game_id % 100})
+    engine.step()
+    # As if every game was last used a while ago, oldest first
+    for game_id, state in maps.items():
+        state.touched -= hibernation.SWEEP_INTERVAL + (first_id + games - game_id) * 1e-3
+
+    start = time.perf_counter()
+    writer.flush(conn, cursor)
+    writer.snapshot(conn, cursor)
+    saving = time.perf_counter() - start
+    start = time.perf_counter()
+    hibernated = hibernator.sweep()
+    sweeping = time.perf_counter() - start
+    assert len(maps) == resident and hibernated == list(game_ids[:games - resident])
+    print(f"{games} games of {per_game / 1024:.0f}KB, budget for {resident}: {saving * 1000:.0f}ms to snapshot them all, "
+          f"{sweeping * 1000:.1f}ms to hibernate {len(hibernated)}")
+
+    def restore(game_id):
+        # The way the service does, on a pooled connection
+        return main.drive(main.restore_game(game_id))
+
+    start = time.perf_counter()
+    for game_id in hibernated[:100]:
+        state = maps.get_or_create(game_id, range(8), restore)
+        assert state.policy[0] == game_id % 100 and state.log_seq == 1
+    elapsed = time.perf_counter() - start
+    print(f"Rehydrating: {elapsed / 100 * 1000:.2f}ms per game")
+
+    for game_id in game_ids:
+        cursor.execute(queries.FORGET_GAME, {"game": game_id})
+    conn.commit()
+    conn.close()
+    main.pool.close()
+
+
+@benchmark
+def path_queries(queries = 2000, batch = 500, seed = 1):
+    """Paths found per second: one at a time, in tick-sized batches, and from the cache"""
+    world = world_map.open_map()
+    finder = pathfinding.PathFinder(world)
+    rng = np.random.default_rng(seed)
+    land = np.flatnonzero(world.terrain != world_map.LAKE)
+    pairs = [tuple(pair) for pair in rng.choice(land, size = (queries, 2)).tolist()]
+    start = time.perf_counter()
+    single = [finder.path(origin, destination) for origin, destination in pairs]
+    elapsed = time.perf_counter() - start
+    print(f"A*, one at a time: {queries / elapsed:.0f} paths/s")
+
+    # Move orders of a tick come from a few hundred units, many of them sent to the same provinces
+    finder.update(terrain = world.terrain)
+    destinations = rng.choice(land, size = 50)
+    orders = [(int(rng.choice(land)), int(rng.choice(destinations)), pathfinding.LAND) for i in range(batch)]
+    start = time.perf_counter()
+    batched = finder.paths(orders)
+    elapsed = time.perf_counter() - start
+    print(f"Dijkstra, {batch} orders to {len(set(destinations.tolist()))} provinces in one call: "
+          f"{elapsed * 1000:.1f}ms, {batch / elapsed:.0f} paths/s")
+
+    # The same path whichever search found it and whatever was cached before, suffixes included
+    fresh = pathfinding.PathFinder(world)
+    for (origin, destination, mask), path in zip(orders, batched):
+        assert path[0] == origin and path[-1] == destination
+        assert all(b in world.neighbours(a) for a, b in zip(path, path[1:]))
+        assert path == fresh._astar(origin, destination, mask)
+        assert all(path[i:] == fresh._astar(path[i], destination, mask) for i in range(1, len(path) - 1))
+    assert single == pathfinding.PathFinder(world).paths([(origin, destination, pathfinding.LAND) for origin, destination in pairs])
+
+    start = time.perf_counter()
+    for i in range(10):
+        cached = finder.paths(orders)
+    elapsed = time.perf_counter() - start
+    assert cached == batched
+    print(f"Cached: {10 * batch / elapsed:.0f} paths/s")
+
+    lakes = np.flatnonzero(world.terrain == world_map.LAKE).tolist()
+    assert finder.path(int(land[0]), lakes[0]) is None
+    assert all(world.terrain[province] != world_map.LAKE for path in single if path for province in path)
+
+
+@benchmark
+def trade_settlement(players = 16, standing = 5000, per_tick = 64, years = 20, game_id = 2**31 - 2):
+    """Thousands of standing trades settled each game-year, and full ticks of one-off trades"""
+    state = map_state.MapState.generate(game_id, range(1, players + 1), main.world)
+    # A few years into the game, with enough in store to pay for most trades
+    state.stock[:] = 10000
+    types = state.stock.shape[1]
+    rng = np.random.default_rng(game_id)
+
+    def random_trade(yearly):
+        sender, target = rng.choice(players, size = 2, replace = False)
+        sent, got = rng.integers(1, 4, size = 2)
+        return (int(sender) + 1, {
+            "actionID": actions.TRADE, "targetPlayer": int(target) + 1, "yearlyRate": yearly,
+            "tradeSendItems": rng.integers(0, types, sent).astype(np.int32), "tradeSendQty": rng.integers(1, 50, sent).astype(np.int32),
+            "tradeGetItems": rng.integers(0, types, got).astype(np.int32), "tradeGetQty": rng.integers(1, 50, got).astype(np.int32)
+        })
+
+    batch = [random_trade(True) for i in range(standing)]
+    start = time.perf_counter()
+    for i in range(0, standing, per_tick):
+        assert len(actions.apply_batch(state, batch[i:i + per_tick])) == len(batch[i:i + per_tick])
+    elapsed = time.perf_counter() - start
+    print(f"{standing} yearly trades made, {per_tick} a tick: {elapsed / (standing / per_tick) * 1000:.2f}ms per tick")
+
+    replayed = map_state.MapState.load(state.players, state.dump())
+    timings, settled = [], []
+    for year in range(years):
+        before = state.stock.sum()
+        income = state.nation_resources().sum()
+        start = time.perf_counter()
+        settled.append(trade.end_year(state))
+        timings.append(time.perf_counter() - start)
+        # Trades only move goods around, and never below zero
+        assert state.stock.sum() == before + income and state.stock.min() >= 0
+    print(f"Year end with {len(np.unique(state.standing[:, trade.TRADE]))} standing trades: "
+          f"{min(timings) * 1000:.2f}ms to {max(timings) * 1000:.2f}ms, {min(settled)} to {max(settled)} paid")
+
+    one_off = [random_trade(False) for i in range(per_tick * 100)]
+    start = time.perf_counter()
+    taken = 0
+    for i in range(0, len(one_off), per_tick):
+        taken += len(actions.apply_batch(state, one_off[i:i + per_tick]))
+    elapsed = time.perf_counter() - start
+    assert state.stock.min() >= 0
+    print(f"{per_tick} one-off trades a tick: {elapsed / 100 * 1000:.2f}ms per tick, {taken} of {len(one_off)} paid for")
+
+    # Year ends are logged as events, replaying them lands on the same stock
+    event = protocol.decode_binary(protocol.encode_binary(tick_engine.YEAR_END[1]))
+    for year in range(years):
+        actions.apply_batch(replayed, [(actions.GAME, event)])
+    for i in range(0, len(one_off), per_tick):
+        actions.apply_batch(replayed, one_off[i:i + per_tick])
+    assert (replayed.stock == state.stock).all() and (replayed.standing == state.standing).all()
+
+    cancelling = [(1, {**one_off[0][1], "targetPlayer": target, "yearlyRate": True,
+        "tradeSendItems": [], "tradeSendQty": [], "tradeGetItems": [], "tradeGetQty": []}) for target in range(2, players + 1)]
+    actions.apply_batch(state, cancelling)
+    assert not ((state.standing[:, trade.SOURCE] == 0) | (state.standing[:, trade.TARGET] == 0)).any()
+
+
+@benchmark
+def diplomacy_churn(players = 64, actions_count = 100000, queries = 100000, game_id = 2**31 - 3):
+    """Treaties made and broken as fast as players can send them, alliance blocs must keep up"""
+    state = map_state.MapState.generate(game_id, range(1, players + 1), main.world)
+    rng = np.random.default_rng(game_id)
+    # Enough alliances for blocs to form, and enough wars to keep splitting them
+    proposed = rng.choice(diplomacy.RELATIONS, size = actions_count, p = (0.3, 0.2, 0.2, 0.3)).tolist()
+    senders = rng.integers(1, players + 1, actions_count).tolist()
+    targets = rng.integers(1, players + 1, actions_count).tolist()
+    batch = [(sender, {"actionID": actions.DIPLOMACY, "targetPlayer": target, "diploID": relation})
+        for sender, target, relation in zip(senders, targets, proposed)]
+
+    def same_bloc(blocs):
+        return blocs.bloc[:, None] == blocs.bloc[None, :]
+
+    checked = map_state.MapState.generate(game_id, range(1, players + 1), main.world)
+    sizes = []
+    for i in range(0, actions_count, 64):
+        actions.apply_batch(checked, batch[i:i + 64])
+        # Blocs kept up edge by edge match blocs worked out from scratch
+        assert (same_bloc(checked.blocs) == same_bloc(diplomacy.Blocs(checked.relations))).all()
+        sizes.append(np.bincount(checked.blocs.bloc).max())
+
+    changes = 0
+    start = time.perf_counter()
+    for i in range(0, actions_count, 64):
+        changes += len(actions.apply_batch(state, batch[i:i + 64]))
+    elapsed = time.perf_counter() - start
+    print(f"{players} players, {actions_count} diplomatic actions: {elapsed / actions_count * 1e6:.2f}us each, "
+          f"{changes} taken, largest bloc {min(sizes)} to {max(sizes)} nations, median {int(np.median(sizes))}")
+    assert (state.relations == checked.relations).all() and (state.relations == state.relations.T).all()
+    assert (same_bloc(map_state.MapState.load(state.players, state.dump()).blocs) == same_bloc(state.blocs)).all()
+
+    pairs = rng.integers(0, players, (queries, 2)).tolist()
+    start = time.perf_counter()
+    wars = sum(diplomacy.at_war(state, a, b) for a, b in pairs)
+    elapsed = time.perf_counter() - start
+    print(f"At war: {elapsed / queries * 1e6:.2f}us per query, {wars} of {queries} pairs")
+    start = time.perf_counter()
+    allied = sum(len(diplomacy.allies(state, a)) for a, b in pairs)
+    elapsed = time.perf_counter() - start
+    print(f"Allies of: {elapsed / queries * 1e6:.2f}us per query, {allied / queries:.1f} allies on average")
+
+
+@benchmark
+def unit_registry(players = 16, count = 200000, moving = 500, game_id = 2**31 - 4):
+    """Hundreds of thousands of units in one game: memory per unit, bulk queries and updates, marching"""
+    state = map_state.MapState.generate(game_id, range(1, players + 1), main.world)
+    rng = np.random.default_rng(game_id)
+    per_action = protocol.MAX_ITEMS
+    start = time.perf_counter()
+    for i in range(count // per_action):
+        player = i % players + 1
+        raised = actions.apply_batch(state, [(player, {"actionID": actions.UNITS,
+            "unitTypes": rng.integers(0, 3, per_action), "unitIDs": np.arange(i * per_action, (i + 1) * per_action)})])
+        assert raised
+    elapsed = time.perf_counter() - start
+    total = len(state.units)
+    print(f"{total} units raised, {per_action} an action: {elapsed / (count // per_action) * 1e6:.0f}us per action, "
+          f"{state.units.nbytes() / total:.1f} bytes per unit ({state.units.capacity} slots)")
+
+    # Spread over the map, as if they'd marched there
+    land = np.flatnonzero(main.world.terrain != world_map.LAKE)
+    state.units.province[state.units.alive()] = rng.choice(land, total)
+
+    def timed(label, func, rounds = 100):
+        start = time.perf_counter()
+        for i in range(rounds):
+            result = func()
+        print(f"{label}: {(time.perf_counter() - start) / rounds * 1e6:.0f}us")
+        return result
+
+    timed("Units in a province", lambda: state.units.in_province(land[0]))
+    timed("Units of a nation", lambda: state.units.owned_by(3))
+    timed("Units per province", lambda: state.units.per_province(len(state.owner)))
+    # Bulk update: every unit of a nation loses some strength, no Python loop over units
+    def attrition():
+        state.units.strength[state.units.owned_by(3)] -= 1
+    timed("Attrition for a nation's units", attrition)
+
+    # Player IDs are nation indices + 1 here
+    nation = 5
+    dead = state.units.owned_by(nation)
+    capacity = state.units.capacity
+    start = time.perf_counter()
+    state.units.remove(dead)
+    state.unit_changed(dead)
+    readded = actions.apply_batch(state, [(nation + 1, {"actionID": actions.UNITS, "unitTypes": [0] * per_action,
+        "unitIDs": np.arange(-per_action, 0)})])
+    elapsed = time.perf_counter() - start
+    assert readded and state.units.capacity == capacity and len(state.units) == total - len(dead) + per_action
+    assert set(state.units.find(nation, np.arange(-per_action, 0)).tolist()) <= set(dead.tolist())
+    print(f"{len(dead)} units removed and {per_action} raised in their slots: {elapsed * 1000:.2f}ms")
+
+    # Move orders for a few hundred units, resolved with one batch of path queries per march
+    mover = 7
+    slots = state.units.owned_by(mover - 1)[:moving]
+    tags = state.units.tag[slots]
+    targets = rng.choice(land, moving) + 1
+    assert actions.apply_batch(state, [(mover, {"actionID": actions.MOVE, "unitIDs": tags, "provinceIDs": targets})])
+    finder = pathfinding.default_finder()
+    # Whatever the shared finder cached before, a game marches the same as on a replica starting cold
+    for origin, destination in rng.choice(land, (moving, 2)).tolist():
+        finder.path(origin, destination)
+    cold = map_state.MapState.load(state.players, state.dump())
+    cold_finder = pathfinding.PathFinder(main.world)
+    steps, timings = 0, []
+    while state.units.marching():
+        start = time.perf_counter()
+        moved = units.march(state, finder)
+        timings.append(time.perf_counter() - start)
+        assert units.march(cold, cold_finder) == moved
+        assert (cold.units.province == state.units.province).all() and (cold.units.orders == state.units.orders).all()
+        steps += moved
+        if not moved:
+            break
+    arrived = (state.units.province[slots] == targets - 1).mean()
+    print(f"{moving} move orders: {len(timings)} marches, first {timings[0] * 1000:.1f}ms, then "
+          f"{np.median(timings[1:]) * 1000:.1f}ms median, {steps} steps, {arrived:.0%} arrived")
+
+    restored = map_state.MapState.load(state.players, state.dump())
+    for name in units.SAVED:
+        assert (getattr(restored.units, name) == getattr(state.units, name)).all()
+    assert len(restored.units) == len(state.units)
+    # Deltas only carry the units that changed
+    state.commit()
+    seen = state.version
+    actions.apply_batch(state, [(mover, {"actionID": actions.MOVE, "unitIDs": tags[:10], "provinceIDs": targets[::-1][:10]})])
+    units.march(state, finder)
+    state.commit()
+    response = main.game_state(state, pb2.GameStateQuery(epoch = state.epoch, fromVersion = seen))
+    assert not response.snapshot and sorted(unit.slot for unit in response.units) == sorted(slots[:10].tolist())
+    print(f"Game state: {len(main.game_state(state, pb2.GameStateQuery()).units)} units in a snapshot")
+
+
+@benchmark
+def battles(players = 16, count = 500, stack_units = 20, provinces = 1000, game_id = 2**31 - 5):
+    """Hundreds of battles at once in one game, each round must fit well within a march, and a game replayed from its log"""
+    state = map_state.MapState.generate(game_id, range(1, players + 1), province_count = provinces)
+    rng = np.random.default_rng(game_id)
+    # Every nation at war with every other, so battles have two to four sides
+    for a in range(players):
+        for b in range(a + 1, players):
+            diplomacy.set_relation(state, a, b, diplomacy.WAR)
+    fronts = rng.choice(provinces, count, replace = False)
+    sides = rng.integers(2, 5, count)
+    tag = 0
+    for province, side_count in zip(fronts.tolist(), sides.tolist()):
+        for nation in rng.choice(players, side_count, replace = False).tolist():
+            state.units.add(rng.integers(0, 3, stack_units), nation, province, np.arange(tag, tag + stack_units))
+            tag += stack_units
+    total = len(state.units)
+    replayed = map_state.MapState.load(state.players, state.dump())
+
+    timings, fought, taken = [], [], 0
+    while True:
+        start = time.perf_counter()
+        battle_count, provinces_taken = combat.resolve(state)
+        timings.append(time.perf_counter() - start)
+        taken += provinces_taken
+        if not battle_count:
+            break
+        fought.append(battle_count)
+    print(f"{count} battles, {total} units: first round {timings[0] * 1000:.2f}ms, {np.median(timings) * 1000:.2f}ms median, "
+          f"{len(fought)} rounds to end them all, {len(state.units)} units left, {taken} provinces taken")
+    assert fought[0] == count and np.median(timings) < 0.01
+    # Only one side is left in each province
+    alive = state.units.alive()
+    sides_left = np.unique(np.stack((state.units.province[alive], state.units.owner[alive])), axis = 1)[0]
+    assert len(np.unique(sides_left)) == len(sides_left)
+
+    # Armies marching on each other's capitals through the tick engine, then the game
+    # rebuilt from its first state and its log: every round must come out the same
+    maps = map_state.GameMaps()
+    log = action_log.ActionLog()
+    engine = tick_engine.TickEngine(maps, lambda *args: None, log)
+    live = map_state.MapState.generate(game_id, range(1, players + 1), main.world)
+    for a in range(players):
+        for b in range(a + 1, players):
+            diplomacy.set_relation(live, a, b, diplomacy.WAR)
+    first = map_state.MapState.load(live.players, live.dump())
+    maps.put(game_id, live)
+    capitals = [int(np.flatnonzero(live.owner == nation)[0]) for nation in range(players)]
+    tags = np.arange(stack_units)
+    for nation in range(players):
+        engine.submit(game_id, nation + 1, {"actionID": actions.UNITS, "unitTypes": rng.integers(0, 3, stack_units), "unitIDs": tags})
+    # Other games on the replica have paths of their own cached, some to the same provinces
+    finder = pathfinding.default_finder()
+    land = np.flatnonzero(main.world.terrain != world_map.LAKE)
+    for origin, destination in zip(rng.choice(land, 1000).tolist(), rng.choice(capitals, 1000).tolist()):
+        finder.path(origin, destination)
+    ticks = 0
+    while ticks < 5000 and (ticks < 1000 or live.units.marching() or live.units.fighting):
+        # Every so often a nation sends its army on another's capital
+        if ticks % 50 == 1:
+            nation, target = rng.choice(players, 2, replace = False).tolist()
+            engine.submit(game_id, nation + 1, {"actionID": actions.MOVE, "unitIDs": tags,
+                "provinceIDs": np.full(stack_units, capitals[target] + 1)})
+        engine.step()
+        ticks += 1
+    rows, forgotten = log.take()
+    rows = [(seq, tick, player_id, protocol.encode_binary(action)) for game, seq, tick, player_id, action in rows]
+    # Like a replica restoring the game, with no paths cached
+    finder.update()
+    action_log.replay(first, rows)
+    for name in map_state.MapState.SAVED:
+        assert np.array_equal(getattr(first, name), getattr(live, name))
+    for name in units.SAVED:
+        assert np.array_equal(getattr(first.units, name), getattr(live.units, name))
+    assert first.log_seq == live.log_seq and live.combat[1] > 0
+    print(f"Replayed {ticks} ticks from {len(rows)} logged actions, {live.combat[1]} rounds fought, "
+          f"{len(live.units)} of {players * stack_units} units left: the same as live")
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
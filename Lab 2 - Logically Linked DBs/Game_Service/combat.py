@@ -0,0 +1,113 @@
+"""Battles between the units of nations at war, one round per march
+
+A nation's units in a province fight as one stack, against every stack there
+of a nation it's at war with. Each round, every stack loses about LOSS_RATE
+of the strength of the enemies it faces, less if it defends its own province,
+spread over its units by strength. Units left without strength are gone.
+A province is taken by the strongest stack at war with its owner once none
+of the owner's units are left there.
+
+Every battle in the game is resolved in the same few array operations. The
+dice are seeded with the game's seed and the number of rounds fought so far,
+and units march the same whatever paths were cached (see pathfinding.py), so
+a round comes out the same on every replica and when replaying the log, which
+`python bench.py battles` checks.
+"""
+import numpy as np
+
+import map_state
+import diplomacy
+
+
+# Share of the enemies' strength a stack loses in a round, on average
+LOSS_RATE = 0.1
+# Damage taken by stacks defending their own province, compared to the others'
+DEFENCE = 0.75
+
+
+def pairs_within(group_starts, group_sizes):
+    """(i, j) index pairs, i != j, of every two items in the same group, groups being contiguous runs"""
+    group_starts = np.asarray(group_starts, dtype = np.int64)
+    group_sizes = np.asarray(group_sizes, dtype = np.int64)
+    # Every item of the groups, with the start and size of its group
+    sizes = np.repeat(group_sizes, group_sizes)
+    first = np.repeat(group_starts, group_sizes)
+    items = first + np.arange(len(sizes)) - np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+    # Each item paired with every item of its group, j going through the group in order
+    i = np.repeat(items, sizes)
+    j = np.repeat(first, sizes) + np.arange(len(i)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    different = i != j
+    return i[different], j[different]
+
+
+def resolve(state):
+    """Fights a round of every battle in the game and hands over the provinces taken
+
+    Returns how many battles were fought and how many provinces were taken.
+    """
+    units = state.units
+    alive = units.alive()
+    nations = len(state.players)
+    units.fighting = False
+    if not len(alive):
+        return 0, 0
+
+    province = units.province[alive].astype(np.int64)
+    owner = units.owner[alive].astype(np.int64)
+    strength = units.strength[alive].astype(np.float64)
+    stacks, stack_of_unit = np.unique(province * nations + owner, return_inverse = True)
+    stack_province, stack_owner = np.divmod(stacks, nations)
+    stack_strength = np.bincount(stack_of_unit, weights = strength, minlength = len(stacks))
+
+    # Stacks are sorted by province, pair up those sharing one, keep the pairs at war
+    group_starts, group_sizes = np.unique(stack_province, return_index = True, return_counts = True)[1:]
+    shared = group_sizes > 1
+    i, j = pairs_within(group_starts[shared], group_sizes[shared])
+    war = state.relations[stack_owner[i], stack_owner[j]] == diplomacy.WAR
+    i, j = i[war], j[war]
+
+    battles = 0
+    if len(i):
+        enemies = np.bincount(i, weights = stack_strength[j], minlength = len(stacks))
+        engaged = enemies > 0
+        dice = np.random.default_rng(state.combat.tolist())
+        state.combat[1] += 1
+        loss = enemies * LOSS_RATE * dice.uniform(0.5, 1.5, len(stacks))
+        loss[stack_owner == state.owner[stack_province]] *= DEFENCE
+        loss = np.minimum(loss, stack_strength)
+
+        # Spread over the stack's units by strength, rounded up so battles always end
+        hit = engaged[stack_of_unit]
+        share = strength[hit] / stack_strength[stack_of_unit[hit]]
+        left = np.maximum(strength[hit] - np.ceil(loss[stack_of_unit[hit]] * share), 0)
+        strength[hit] = left
+        slots = alive[hit]
+        units.strength[slots] = left
+        state.unit_changed(slots)
+        units.remove(slots[left <= 0])
+        stack_strength = np.bincount(stack_of_unit, weights = strength, minlength = len(stacks))
+        battles = len(np.unique(stack_province[engaged]))
+        units.fighting = True
+
+    return battles, _capture(state, stack_province, stack_owner, stack_strength)
+
+
+def _capture(state, stack_province, stack_owner, stack_strength):
+    """Hands provinces over to the strongest stack at war with their owner if the owner has none left there, returns how many"""
+    held_by = state.owner[stack_province]
+    standing = stack_strength > 0
+    defended = np.zeros(len(state.owner), dtype = bool)
+    defended[stack_province[standing & (stack_owner == held_by)]] = True
+
+    owned = held_by != map_state.NO_OWNER
+    attacking = standing & owned & ~defended[stack_province]
+    attacking[attacking] = state.relations[stack_owner[attacking], held_by[attacking]] == diplomacy.WAR
+    if not attacking.any():
+        return 0
+    candidates = np.flatnonzero(attacking)
+    # Strongest first within each province, then the first of each province wins
+    order = candidates[np.lexsort((-stack_strength[candidates], stack_province[candidates]))]
+    provinces, first = np.unique(stack_province[order], return_index = True)
+    state.owner[provinces] = stack_owner[order[first]]
+    state.province_changed(provinces)
+    return len(provinces)
@@ -0,0 +1,152 @@
+import time
+import queue
+import logging
+from contextlib import contextmanager, asynccontextmanager
+
+import psycopg2
+import psycopg_pool
+from prometheus_client import Gauge, Histogram
+
+import statements
+
+
+logger = logging.getLogger(__name__)
+
+pool_wait_time = Histogram("game_service_db_pool_wait_seconds", "Time spent waiting for a pooled DB connection")
+pool_in_use = Gauge("game_service_db_pool_in_use", "DB connections currently borrowed from the pool")
+pool_size = Gauge("game_service_db_pool_size", "Maximum number of DB connections in the pool")
+
+# Idle connections older than this get pinged before being handed out
+CHECK_AFTER = 30 # seconds
+
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections shared by the gRPC worker threads
+
+    Connections are opened lazily, at most `size` of them exist at once.
+    A thread borrowing from an exhausted pool blocks until one is returned.
+    """
+    def __init__(self, dsn, size):
+        self.dsn = dsn
+        self.size = size
+        # Each slot is either None (not connected yet) or a (connection, last_used) pair
+        self._idle = queue.LifoQueue(maxsize = size)
+        for i in range(size):
+            self._idle.put(None)
+        pool_size.set(size)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory = statements.PreparingConnection)
+        conn.autocommit = True
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < CHECK_AFTER:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self, slot):
+        if slot is not None:
+            conn, last_used = slot
+            if self._is_healthy(conn, last_used):
+                return conn
+            logger.info("Dropping broken DB connection")
+            conn.close()
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection for the duration of the block"""
+        start = time.perf_counter()
+        slot = self._idle.get()
+        pool_wait_time.observe(time.perf_counter() - start)
+        pool_in_use.inc()
+
+        conn = None
+        try:
+            conn = self._checkout(slot)
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection is likely dead, don't hand it out again
+            if conn is not None:
+                conn.close()
+            conn = None
+            raise
+        finally:
+            pool_in_use.dec()
+            if conn is None or conn.closed:
+                self._idle.put(None)
+            else:
+                self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def cursor(self):
+        """Borrows a connection and yields a cursor on it"""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def close(self):
+        while not self._idle.empty():
+            slot = self._idle.get_nowait()
+            if slot is not None:
+                slot[0].close()
+
+
+class AsyncConnectionPool:
+    """Bounded pool of psycopg 3 async connections for the asyncio servicer
+
+    Exposes the same cursor() interface as ConnectionPool, only awaitable.
+    """
+    def __init__(self, dsn, size):
+        self._pool = psycopg_pool.AsyncConnectionPool(
+            dsn,
+            min_size = 1,
+            max_size = size,
+            kwargs = {"autocommit": True},
+            check = psycopg_pool.AsyncConnectionPool.check_connection,
+            open = False
+        )
+        pool_size.set(size)
+
+    async def open(self):
+        await self._pool.open(wait = True)
+
+    @asynccontextmanager
+    async def connection(self):
+        start = time.perf_counter()
+        async with self._pool.connection() as conn:
+            pool_wait_time.observe(time.perf_counter() - start)
+            pool_in_use.inc()
+            try:
+                yield conn
+            finally:
+                pool_in_use.dec()
+
+    @asynccontextmanager
+    async def cursor(self):
+        async with self.connection() as conn:
+            async with conn.cursor() as cursor:
+                yield cursor
+
+    async def close(self):
+        await self._pool.close()
+
+
+@contextmanager
+def single_cursor(dsn):
+    """Opens a throwaway connection, used for one-off setup work"""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            yield cursor
+    finally:
+        conn.close()
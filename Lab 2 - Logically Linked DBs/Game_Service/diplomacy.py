@@ -0,0 +1,118 @@
+"""Relations between the nations of a game (actionID 3)
+
+Each game keeps them as an N x N matrix of small ints, symmetric, from WAR
+to ALLIANCE in order of friendliness. A diplomatic action proposes a relation
+with another nation: anything less friendly than the current one, like
+declaring war or leaving an alliance, takes effect right away, anything
+friendlier once the other nation proposed it too (or friendlier still).
+
+Nations allied to each other, directly or through other allies, form a bloc.
+Blocs are kept up to date on every change of relation, only re-examining the
+bloc an alliance was broken in, so asking who's allied to whom never has to
+walk the alliance graph.
+"""
+import numpy as np
+
+import trade
+
+
+WAR = -1
+NEUTRAL = 0
+NAP = 1
+ALLIANCE = 2
+RELATIONS = (WAR, NEUTRAL, NAP, ALLIANCE)
+
+
+class Blocs:
+    """Alliance blocs of a relations matrix, labelled by one of their members"""
+    def __init__(self, relations):
+        self.relations = relations
+        self.bloc = np.arange(len(relations))
+        # Nation -> the others in its bloc, built on demand and dropped whenever blocs change
+        self._allies = {}
+        for a, b in zip(*np.nonzero(np.triu(relations == ALLIANCE))):
+            self.join(a, b)
+
+    def join(self, a, b):
+        """Merges the blocs of two nations that just allied"""
+        kept, merged = self.bloc[a], self.bloc[b]
+        if kept == merged:
+            return
+        self.bloc[self.bloc == merged] = kept
+        self._allies.clear()
+
+    def split(self, a, b):
+        """Splits a's bloc if breaking its alliance with b left it in two"""
+        label = self.bloc[a]
+        members = np.flatnonzero(self.bloc == label)
+        allied = self.relations[np.ix_(members, members)] == ALLIANCE
+        # Who a still reaches through the alliances left, a whole frontier at a time
+        reached = members == a
+        frontier = reached
+        while frontier.any():
+            frontier = allied[frontier].any(axis = 0) & ~reached
+            reached = reached | frontier
+        if not reached[np.searchsorted(members, b)]:
+            # b's side becomes a bloc of its own, under b's label
+            self.bloc[members[~reached]] = b
+            if not reached[np.searchsorted(members, label)]:
+                # The old label went with b's side, give a's side its own too
+                self.bloc[members[reached]] = a
+            self._allies.clear()
+
+    def allies(self, nation):
+        """The other nations in the nation's bloc, as a tuple"""
+        allies = self._allies.get(nation)
+        if allies is None:
+            bloc = np.flatnonzero(self.bloc == self.bloc[nation])
+            allies = self._allies[nation] = tuple(bloc[bloc != nation].tolist())
+        return allies
+
+    def allied(self, a, b):
+        """Whether two nations are in the same bloc"""
+        return self.bloc[a] == self.bloc[b]
+
+
+def at_war(state, a, b):
+    return state.relations[a, b] == WAR
+
+
+def allies(state, nation):
+    return state.blocs.allies(nation)
+
+
+def set_relation(state, a, b, relation):
+    """Sets the relation of two nations both ways, voiding friendlier offers between them
+
+    Going to war also ends their standing trades, and has their units fight.
+    """
+    old = state.relations[a, b]
+    state.relations[a, b] = state.relations[b, a] = relation
+    state.offers[a, b] = state.offers[b, a] = relation
+    if relation == ALLIANCE:
+        state.blocs.join(a, b)
+    elif old == ALLIANCE:
+        state.blocs.split(a, b)
+    if relation == WAR:
+        trade.cancel_standing(state, a, b)
+        state.units.fighting = True
+    state.nation_changed([a, b])
+
+
+def propose(state, nation, other, relation):
+    """Proposes a relation with another nation, returns whether it changed anything"""
+    if relation not in RELATIONS or not 0 <= other < len(state.players) or other == nation:
+        return False
+    current = state.relations[nation, other]
+    if relation < current:
+        set_relation(state, nation, other, relation)
+        return True
+    if relation == current or relation == state.offers[nation, other]:
+        return False
+
+    state.offers[nation, other] = relation
+    # As friendly as both of them are willing to go
+    agreed = min(relation, state.offers[other, nation])
+    if agreed > current:
+        set_relation(state, nation, other, agreed)
+    return True
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11game_routes.proto\x12\x0bgame_routes\"\x07\n\x05\x45mpty\"\x1a\n\x07LobbyID\x12\x0f\n\x07lobbyID\x18\x01 \x01(\x05\"?\n\rLobbyMakeInfo\x12\x0e\n\x06userID\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x10\n\x08maxCount\x18\x03 \x01(\x05\"+\n\x08HybridID\x12\x0f\n\x07lobbyID\x18\x01 \x01(\x05\x12\x0e\n\x06userID\x18\x02 \x01(\x05\"f\n\x0cLobbyDetails\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x13\n\x0b\x63urrMembers\x18\x03 \x01(\x05\x12\x12\n\nmaxMembers\x18\x04 \x01(\x05\x12\x0f\n\x07players\x18\x05 \x03(\x05\"B\n\tLobbyInfo\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x13\n\x0b\x63urrMembers\x18\x02 \x01(\x05\x12\x12\n\nmaxMembers\x18\x03 \x01(\x05\"D\n\tLobbyList\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\'\n\x07lobbies\x18\x02 \x03(\x0b\x32\x16.game_routes.LobbyInfo\"\x18\n\x06GameID\x12\x0e\n\x06gameID\x18\x01 \x01(\x05\"\x18\n\x06Status\x12\x0e\n\x06status\x18\x01 \x01(\x05\"C\n\x07MapData\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12(\n\x07nations\x18\x02 \x03(\x0b\x32\x17.game_routes.PlayerData\"5\n\nPlayerData\x12\x12\n\npopulation\x18\x01 \x01(\x05\x12\x13\n\x0bprovinceIDs\x18\x02 \x03(\x05\x32\x9c\x04\n\nGameRoutes\x12\x38\n\ngetLobbies\x12\x12.game_routes.Empty\x1a\x16.game_routes.LobbyList\x12;\n\x08getLobby\x12\x14.game_routes.LobbyID\x1a\x19.game_routes.LobbyDetails\x12\x42\n\tmakeLobby\x12\x1a.game_routes.LobbyMakeInfo\x1a\x19.game_routes.LobbyDetails\x12=\n\tjoinLobby\x12\x15.game_routes.HybridID\x1a\x19.game_routes.LobbyDetails\x12\x38\n\nleaveLobby\x12\x15.game_routes.HybridID\x1a\x13.game_routes.Status\x12\x33\n\x07getGame\x12\x13.game_routes.GameID\x1a\x13.game_routes.Status\x12\x34\n\x07\x65ndGame\x12\x13.game_routes.GameID\x1a\x14.game_routes.MapData\x12\x38\n\x0c\x63ontinueGame\x12\x13.game_routes.GameID\x1a\x13.game_routes.Status\x12\x35\n\tcloseGame\x12\x13.game_routes.GameID\x1a\x13.game_routes.Statusb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11game_routes.proto\x12\x0bgame_routes\"\x07\n\x05\x45mpty\"X\n\nLobbyQuery\x12\x10\n\x08pageSize\x18\x01 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x02 \x01(\x05\x12\x14\n\x0chasFreeSlots\x18\x03 \x01(\x08\x12\x12\n\nnamePrefix\x18\x04 \x01(\t\"\x1a\n\x07LobbyID\x12\x0f\n\x07lobbyID\x18\x01 \x01(\x05\"?\n\rLobbyMakeInfo\x12\x0e\n\x06userID\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x10\n\x08maxCount\x18\x03 \x01(\x05\"+\n\x08HybridID\x12\x0f\n\x07lobbyID\x18\x01 \x01(\x05\x12\x0e\n\x06userID\x18\x02 \x01(\x05\"f\n\x0cLobbyDetails\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x13\n\x0b\x63urrMembers\x18\x03 \x01(\x05\x12\x12\n\nmaxMembers\x18\x04 \x01(\x05\x12\x0f\n\x07players\x18\x05 \x03(\x05\"N\n\tLobbyInfo\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x13\n\x0b\x63urrMembers\x18\x02 \x01(\x05\x12\x12\n\nmaxMembers\x18\x03 \x01(\x05\x12\n\n\x02id\x18\x04 \x01(\x05\"X\n\tLobbyList\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\'\n\x07lobbies\x18\x02 \x03(\x0b\x32\x16.game_routes.LobbyInfo\x12\x12\n\nnextCursor\x18\x03 \x01(\x05\"9\n\x13WatchLobbiesRequest\x12\r\n\x05\x65poch\x18\x01 \x01(\t\x12\x13\n\x0b\x66romVersion\x18\x02 \x01(\x05\"\xa1\x01\n\nLobbyDelta\x12\r\n\x05\x65poch\x18\x01 \x01(\t\x12\x0f\n\x07version\x18\x02 \x01(\x05\x12\x10\n\x08snapshot\x18\x03 \x01(\x08\x12\'\n\x07\x63reated\x18\x04 \x03(\x0b\x32\x16.game_routes.LobbyInfo\x12\'\n\x07updated\x18\x05 \x03(\x0b\x32\x16.game_routes.LobbyInfo\x12\x0f\n\x07removed\x18\x06 \x03(\x05\"\x18\n\x06GameID\x12\x0e\n\x06gameID\x18\x01 \x01(\x05\"T\n\x0eGameStateQuery\x12\x0e\n\x06gameID\x18\x01 \x01(\x05\x12\r\n\x05\x65poch\x18\x02 \x01(\t\x12\x13\n\x0b\x66romVersion\x18\x03 \x01(\x05\x12\x0e\n\x06userID\x18\x04 \x01(\x05\"b\n\rProvinceState\x12\n\n\x02id\x18\x01 \x01(\x05\x12\r\n\x05owner\x18\x02 \x01(\x05\x12\x12\n\npopulation\x18\x03 \x01(\x03\x12\x0f\n\x07upgrade\x18\x04 \x01(\x05\x12\x11\n\tresources\x18\x05 \x03(\x03\"O\n\x0bNationState\x12\x0e\n\x06userID\x18\x01 \x01(\x05\x12\x0e\n\x06policy\x18\x02 \x01(\x05\x12\r\n\x05stock\x18\x03 \x03(\x03\x12\x11\n\trelations\x18\x04 \x03(\x05\"\x7f\n\tUnitState\x12\x0c\n\x04slot\x18\x01 \x01(\x05\x12\r\n\x05owner\x18\x02 \x01(\x05\x12\x0e\n\x06unitID\x18\x03 \x01(\x05\x12\x0c\n\x04type\x18\x04 \x01(\x05\x12\x10\n\x08province\x18\x05 \x01(\x05\x12\x10\n\x08strength\x18\x06 \x01(\x05\x12\x13\n\x0b\x64\x65stination\x18\x07 \x01(\x05\"\xdd\x01\n\tGameState\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\r\n\x05\x65poch\x18\x02 \x01(\t\x12\x0f\n\x07version\x18\x03 \x01(\x05\x12\x10\n\x08snapshot\x18\x04 \x01(\x08\x12-\n\tprovinces\x18\x05 \x03(\x0b\x32\x1a.game_routes.ProvinceState\x12)\n\x07nations\x18\x06 \x03(\x0b\x32\x18.game_routes.NationState\x12\r\n\x05owner\x18\x07 \x01(\t\x12%\n\x05units\x18\x08 \x03(\x0b\x32\x16.game_routes.UnitState\"\'\n\x06Status\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\r\n\x05owner\x18\x02 \x01(\t\"R\n\x07MapData\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12(\n\x07nations\x18\x02 \x03(\x0b\x32\x17.game_routes.PlayerData\x12\r\n\x05owner\x18\x03 \x01(\t\"5\n\nPlayerData\x12\x12\n\npopulation\x18\x01 \x01(\x05\x12\x13\n\x0bprovinceIDs\x18\x02 \x03(\x05\"x\n\x0bGameHandoff\x12\x0e\n\x06gameID\x18\x01 \x01(\x05\x12\x0f\n\x07players\x18\x02 \x03(\x05\x12\r\n\x05state\x18\x03 \x01(\x0c\x12\x0e\n\x06logSeq\x18\x04 \x01(\x03\x12)\n\x06queued\x18\x05 \x03(\x0b\x32\x19.game_routes.QueuedAction\".\n\x0cQueuedAction\x12\x0e\n\x06player\x18\x01 \x01(\x05\x12\x0e\n\x06\x61\x63tion\x18\x02 \x01(\x0c\x32\xb7\x05\n\nGameRoutes\x12=\n\ngetLobbies\x12\x17.game_routes.LobbyQuery\x1a\x16.game_routes.LobbyList\x12;\n\x08getLobby\x12\x14.game_routes.LobbyID\x1a\x19.game_routes.LobbyDetails\x12\x42\n\tmakeLobby\x12\x1a.game_routes.LobbyMakeInfo\x1a\x19.game_routes.LobbyDetails\x12=\n\tjoinLobby\x12\x15.game_routes.HybridID\x1a\x19.game_routes.LobbyDetails\x12\x38\n\nleaveLobby\x12\x15.game_routes.HybridID\x1a\x13.game_routes.Status\x12>\n\x07getGame\x12\x1b.game_routes.GameStateQuery\x1a\x16.game_routes.GameState\x12\x34\n\x07\x65ndGame\x12\x13.game_routes.GameID\x1a\x14.game_routes.MapData\x12\x38\n\x0c\x63ontinueGame\x12\x13.game_routes.GameID\x1a\x13.game_routes.Status\x12\x35\n\tcloseGame\x12\x13.game_routes.GameID\x1a\x13.game_routes.Status\x12K\n\x0cwatchLobbies\x12 .game_routes.WatchLobbiesRequest\x1a\x17.game_routes.LobbyDelta0\x01\x12<\n\x0bmigrateGame\x12\x18.game_routes.GameHandoff\x1a\x13.game_routes.Statusb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,26 +33,46 @@ if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_EMPTY']._serialized_start=34
   _globals['_EMPTY']._serialized_end=41
-  _globals['_LOBBYID']._serialized_start=43
-  _globals['_LOBBYID']._serialized_end=69
-  _globals['_LOBBYMAKEINFO']._serialized_start=71
-  _globals['_LOBBYMAKEINFO']._serialized_end=134
-  _globals['_HYBRIDID']._serialized_start=136
-  _globals['_HYBRIDID']._serialized_end=179
-  _globals['_LOBBYDETAILS']._serialized_start=181
-  _globals['_LOBBYDETAILS']._serialized_end=283
-  _globals['_LOBBYINFO']._serialized_start=285
-  _globals['_LOBBYINFO']._serialized_end=351
-  _globals['_LOBBYLIST']._serialized_start=353
-  _globals['_LOBBYLIST']._serialized_end=421
-  _globals['_GAMEID']._serialized_start=423
-  _globals['_GAMEID']._serialized_end=447
-  _globals['_STATUS']._serialized_start=449
-  _globals['_STATUS']._serialized_end=473
-  _globals['_MAPDATA']._serialized_start=475
-  _globals['_MAPDATA']._serialized_end=542
-  _globals['_PLAYERDATA']._serialized_start=544
-  _globals['_PLAYERDATA']._serialized_end=597
-  _globals['_GAMEROUTES']._serialized_start=600
-  _globals['_GAMEROUTES']._serialized_end=1140
+  _globals['_LOBBYQUERY']._serialized_start=43
+  _globals['_LOBBYQUERY']._serialized_end=131
+  _globals['_LOBBYID']._serialized_start=133
+  _globals['_LOBBYID']._serialized_end=159
+  _globals['_LOBBYMAKEINFO']._serialized_start=161
+  _globals['_LOBBYMAKEINFO']._serialized_end=224
+  _globals['_HYBRIDID']._serialized_start=226
+  _globals['_HYBRIDID']._serialized_end=269
+  _globals['_LOBBYDETAILS']._serialized_start=271
+  _globals['_LOBBYDETAILS']._serialized_end=373
+  _globals['_LOBBYINFO']._serialized_start=375
+  _globals['_LOBBYINFO']._serialized_end=453
+  _globals['_LOBBYLIST']._serialized_start=455
+  _globals['_LOBBYLIST']._serialized_end=543
+  _globals['_WATCHLOBBIESREQUEST']._serialized_start=545
+  _globals['_WATCHLOBBIESREQUEST']._serialized_end=602
+  _globals['_LOBBYDELTA']._serialized_start=605
+  _globals['_LOBBYDELTA']._serialized_end=766
+  _globals['_GAMEID']._serialized_start=768
+  _globals['_GAMEID']._serialized_end=792
+  _globals['_GAMESTATEQUERY']._serialized_start=794
+  _globals['_GAMESTATEQUERY']._serialized_end=878
+  _globals['_PROVINCESTATE']._serialized_start=880
+  _globals['_PROVINCESTATE']._serialized_end=978
+  _globals['_NATIONSTATE']._serialized_start=980
+  _globals['_NATIONSTATE']._serialized_end=1059
+  _globals['_UNITSTATE']._serialized_start=1061
+  _globals['_UNITSTATE']._serialized_end=1188
+  _globals['_GAMESTATE']._serialized_start=1191
+  _globals['_GAMESTATE']._serialized_end=1412
+  _globals['_STATUS']._serialized_start=1414
+  _globals['_STATUS']._serialized_end=1453
+  _globals['_MAPDATA']._serialized_start=1455
+  _globals['_MAPDATA']._serialized_end=1537
+  _globals['_PLAYERDATA']._serialized_start=1539
+  _globals['_PLAYERDATA']._serialized_end=1592
+  _globals['_GAMEHANDOFF']._serialized_start=1594
+  _globals['_GAMEHANDOFF']._serialized_end=1714
+  _globals['_QUEUEDACTION']._serialized_start=1716
+  _globals['_QUEUEDACTION']._serialized_end=1762
+  _globals['_GAMEROUTES']._serialized_start=1765
+  _globals['_GAMEROUTES']._serialized_end=2460
 # @@protoc_insertion_point(module_scope)
@@ -36,7 +36,7 @@ class GameRoutesStub(object):
         """
         self.getLobbies = channel.unary_unary(
                 '/game_routes.GameRoutes/getLobbies',
-                request_serializer=game__routes__pb2.Empty.SerializeToString,
+                request_serializer=game__routes__pb2.LobbyQuery.SerializeToString,
                 response_deserializer=game__routes__pb2.LobbyList.FromString,
                 _registered_method=True)
         self.getLobby = channel.unary_unary(
@@ -61,8 +61,8 @@ class GameRoutesStub(object):
                 _registered_method=True)
         self.getGame = channel.unary_unary(
                 '/game_routes.GameRoutes/getGame',
-                request_serializer=game__routes__pb2.GameID.SerializeToString,
-                response_deserializer=game__routes__pb2.Status.FromString,
+                request_serializer=game__routes__pb2.GameStateQuery.SerializeToString,
+                response_deserializer=game__routes__pb2.GameState.FromString,
                 _registered_method=True)
         self.endGame = channel.unary_unary(
                 '/game_routes.GameRoutes/endGame',
@@ -79,6 +79,16 @@ class GameRoutesStub(object):
                 request_serializer=game__routes__pb2.GameID.SerializeToString,
                 response_deserializer=game__routes__pb2.Status.FromString,
                 _registered_method=True)
+        self.watchLobbies = channel.unary_stream(
+                '/game_routes.GameRoutes/watchLobbies',
+                request_serializer=game__routes__pb2.WatchLobbiesRequest.SerializeToString,
+                response_deserializer=game__routes__pb2.LobbyDelta.FromString,
+                _registered_method=True)
+        self.migrateGame = channel.unary_unary(
+                '/game_routes.GameRoutes/migrateGame',
+                request_serializer=game__routes__pb2.GameHandoff.SerializeToString,
+                response_deserializer=game__routes__pb2.Status.FromString,
+                _registered_method=True)
 
 
 class GameRoutesServicer(object):
@@ -138,12 +148,24 @@ class GameRoutesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def watchLobbies(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def migrateGame(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_GameRoutesServicer_to_server(servicer, server):
     rpc_method_handlers = {
             'getLobbies': grpc.unary_unary_rpc_method_handler(
                     servicer.getLobbies,
-                    request_deserializer=game__routes__pb2.Empty.FromString,
+                    request_deserializer=game__routes__pb2.LobbyQuery.FromString,
                     response_serializer=game__routes__pb2.LobbyList.SerializeToString,
             ),
             'getLobby': grpc.unary_unary_rpc_method_handler(
@@ -168,8 +190,8 @@ def add_GameRoutesServicer_to_server(servicer, server):
             ),
             'getGame': grpc.unary_unary_rpc_method_handler(
                     servicer.getGame,
-                    request_deserializer=game__routes__pb2.GameID.FromString,
-                    response_serializer=game__routes__pb2.Status.SerializeToString,
+                    request_deserializer=game__routes__pb2.GameStateQuery.FromString,
+                    response_serializer=game__routes__pb2.GameState.SerializeToString,
             ),
             'endGame': grpc.unary_unary_rpc_method_handler(
                     servicer.endGame,
@@ -186,6 +208,16 @@ def add_GameRoutesServicer_to_server(servicer, server):
                     request_deserializer=game__routes__pb2.GameID.FromString,
                     response_serializer=game__routes__pb2.Status.SerializeToString,
             ),
+            'watchLobbies': grpc.unary_stream_rpc_method_handler(
+                    servicer.watchLobbies,
+                    request_deserializer=game__routes__pb2.WatchLobbiesRequest.FromString,
+                    response_serializer=game__routes__pb2.LobbyDelta.SerializeToString,
+            ),
+            'migrateGame': grpc.unary_unary_rpc_method_handler(
+                    servicer.migrateGame,
+                    request_deserializer=game__routes__pb2.GameHandoff.FromString,
+                    response_serializer=game__routes__pb2.Status.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'game_routes.GameRoutes', rpc_method_handlers)
@@ -212,7 +244,7 @@ class GameRoutes(object):
             request,
             target,
             '/game_routes.GameRoutes/getLobbies',
-            game__routes__pb2.Empty.SerializeToString,
+            game__routes__pb2.LobbyQuery.SerializeToString,
             game__routes__pb2.LobbyList.FromString,
             options,
             channel_credentials,
@@ -347,8 +379,8 @@ class GameRoutes(object):
             request,
             target,
             '/game_routes.GameRoutes/getGame',
-            game__routes__pb2.GameID.SerializeToString,
-            game__routes__pb2.Status.FromString,
+            game__routes__pb2.GameStateQuery.SerializeToString,
+            game__routes__pb2.GameState.FromString,
             options,
             channel_credentials,
             insecure,
@@ -439,3 +471,57 @@ class GameRoutes(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def watchLobbies(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/game_routes.GameRoutes/watchLobbies',
+            game__routes__pb2.WatchLobbiesRequest.SerializeToString,
+            game__routes__pb2.LobbyDelta.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def migrateGame(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/game_routes.GameRoutes/migrateGame',
+            game__routes__pb2.GameHandoff.SerializeToString,
+            game__routes__pb2.Status.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
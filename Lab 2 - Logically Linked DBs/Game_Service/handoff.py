@@ -0,0 +1,176 @@
+"""Handing games over to other replicas, while this one drains or as others join
+
+Each game is frozen between two ticks, its map and waiting actions are sent
+to the replica the ring gives it to (once this one is gone, when draining),
+and its players' websockets are closed with the new owner's host, for the
+Gateway to reconnect them there. The game is only paused from the freeze
+until the sockets close.
+
+Games the new owner didn't take are saved to the DB for it to restore, and
+their players only sent there once the snapshot has everything this replica
+logged. Sooner, the new owner would restore an older snapshot and log its
+actions under sequence numbers already used here, forking the game's history.
+"""
+import time
+import asyncio
+import logging
+
+import grpc
+from prometheus_client import Counter, Histogram
+
+import protocol
+import placement
+import action_log
+from map_state import MapState
+import game_routes_pb2 as pb2
+
+
+logger = logging.getLogger(__name__)
+
+handoff_pause = Histogram("game_service_handoff_pause_seconds", "Time a game was paused while handed to another replica",
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+handoffs_failed = Counter("game_service_handoffs_failed", "Games that couldn't be handed to another replica")
+
+HANDOFF_TIMEOUT = 2 # seconds
+# Games handed over at the same time
+DRAIN_CONCURRENCY = 16
+# How long games whose handoff failed may take to be saved to the DB instead
+SAVE_TIMEOUT = 10 # seconds
+
+
+def handoff_message(game_id, state, queued):
+    return pb2.GameHandoff(
+        gameID = game_id,
+        players = state.players,
+        state = state.dump(),
+        logSeq = state.log_seq,
+        queued = [pb2.QueuedAction(player = player_id, action = protocol.encode_binary(action)) for player_id, action in queued]
+    )
+
+
+def adopt(handoff, maps, ring, engine, instance):
+    """Takes over a game handed over by a draining replica, on the receiving end"""
+    state = MapState.load(handoff.players, handoff.state)
+    state.log_seq = handoff.logSeq
+    maps.put(handoff.gameID, state)
+    # Ours from now on, even if our ring doesn't say so yet
+    ring.move(handoff.gameID, instance)
+    for queued in handoff.queued:
+        engine.submit_threadsafe(handoff.gameID, queued.player, protocol.decode_binary(queued.action))
+
+
+async def hand_over(game_id, state, target, stub, engine, game_rooms, ring):
+    """Freezes a game and hands it to the `target` replica through `stub`, True if it took it
+
+    Runs on the engine's event loop. The game stays frozen either way, and its
+    players are only sent to the target if it took it, see save_and_redirect().
+    """
+    start = time.perf_counter()
+    queued = engine.freeze(game_id)
+    with state.lock:
+        message = handoff_message(game_id, state, queued)
+
+    try:
+        response = await asyncio.to_thread(stub.migrateGame, message, timeout = HANDOFF_TIMEOUT)
+        handed_over = response.status == 200
+    except grpc.RpcError as e:
+        logger.info(f"Couldn't hand game {game_id} to {target}: {e.code()}")
+        handed_over = False
+
+    if not handed_over:
+        handoffs_failed.inc()
+        return False
+    ring.move(game_id, target)
+    await game_rooms.close(game_id, placement.MISPLACED_CLOSE_CODE, target)
+    handoff_pause.observe(time.perf_counter() - start)
+    return True
+
+
+async def hand_over_all(games, targets, stubs, engine, game_rooms, ring):
+    """Hands (game ID, map) pairs to their `targets` a few at a time, returns the IDs of those that failed"""
+    slots = asyncio.Semaphore(DRAIN_CONCURRENCY)
+
+    async def one(game_id, state):
+        async with slots:
+            target = targets[game_id]
+            return await hand_over(game_id, state, target, stubs[target], engine, game_rooms, ring)
+
+    results = await asyncio.gather(*(one(game_id, state) for game_id, state in games))
+    return [game_id for (game_id, state), handed_over in zip(games, results) if not handed_over]
+
+
+async def save_and_redirect(games, targets, log, game_rooms, ring):
+    """Saves frozen (game ID, map) pairs the targets didn't take to the DB, then sends their players there
+
+    Returns the IDs of the games saved. Those that aren't by SAVE_TIMEOUT keep their players here.
+    """
+    for game_id, state in games:
+        log.resnapshot(game_id)
+    deadline = time.monotonic() + SAVE_TIMEOUT
+    unsaved = dict(games)
+    while unsaved and time.monotonic() < deadline:
+        await asyncio.sleep(action_log.FLUSH_INTERVAL)
+        unsaved = {game_id: state for game_id, state in unsaved.items() if not log.saved(game_id, state.log_seq)}
+
+    saved = [game_id for game_id, state in games if game_id not in unsaved]
+    for game_id in saved:
+        # Don't serve it here again if its players come back before our ring says it moved
+        ring.move(game_id, targets[game_id])
+    await asyncio.gather(*(game_rooms.close(game_id, placement.MISPLACED_CLOSE_CODE, targets[game_id]) for game_id in saved))
+    return saved
+
+
+class Rebalancer:
+    """Hands over the games the ring gives to other replicas, as they join, on the engine's event loop
+
+    Otherwise this replica would keep ticking and logging games their new owner
+    restores from the DB as soon as their players get routed there, both of
+    them writing the same log and snapshots. Games whose handoff failed are
+    saved to the DB for the new owner instead, before their players go there.
+    Either way they're dropped from memory, and come back as any other game
+    would if the ring gives them back.
+    """
+    def __init__(self, maps, log, engine, game_rooms, ring, misplaced, stub_for):
+        self.maps = maps
+        self.log = log
+        self.engine = engine
+        self.game_rooms = game_rooms
+        self.ring = ring
+        # Game ID -> the replica it belongs to, None if it's this one
+        self.misplaced = misplaced
+        # Replica host -> gRPC stub to hand games to it through
+        self.stub_for = stub_for
+        self._moving = set()
+
+    async def sweep(self):
+        """Moves the games placed elsewhere, returns the IDs of those handed over and of those saved to the DB"""
+        games = [(game_id, state) for game_id, state in self.maps.items() if game_id not in self._moving]
+        targets = {game_id: self.misplaced(game_id) for game_id, state in games}
+        games = [(game_id, state) for game_id, state in games if targets[game_id] is not None]
+        if not games:
+            return [], []
+        self._moving.update(game_id for game_id, state in games)
+        try:
+            stubs = {target: self.stub_for(target) for target in {targets[game_id] for game_id, state in games}}
+            failed = set(await hand_over_all(games, targets, stubs, self.engine, self.game_rooms, self.ring))
+            # Frozen, so nothing changes them before they're saved
+            saved = await save_and_redirect([(game_id, state) for game_id, state in games if game_id in failed],
+                targets, self.log, self.game_rooms, self.ring)
+
+            moved = [game_id for game_id, state in games if game_id not in failed]
+            for game_id in moved + saved:
+                self.maps.remove(game_id)
+                self.log.release(game_id)
+            # Games that couldn't be saved go on here with their players, for the next sweep to try again
+            for game_id, state in games:
+                self.engine.thaw(game_id)
+            if failed:
+                logger.info(f"Rebalanced, {len(moved)} games handed over and {len(saved)} saved to the DB")
+            return moved, saved
+        finally:
+            self._moving.difference_update(game_id for game_id, state in games)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(placement.POLL_INTERVAL)
+            await self.sweep()
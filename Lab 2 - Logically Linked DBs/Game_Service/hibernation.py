@@ -0,0 +1,71 @@
+"""Dropping idle games' maps from memory, keeping each replica's memory bounded
+
+A game is hibernated once nobody looked it up for a while, or sooner, least
+recently used first, while the replica's maps take more than the memory budget.
+Its latest snapshot in the Game DB (see action_log.py) is all that's kept,
+and the next lookup rebuilds it from there like after a crash. Games with
+players connected or actions waiting are never hibernated.
+"""
+import time
+import asyncio
+
+from prometheus_client import Counter, Gauge
+
+
+resident_games = Gauge("game_service_resident_games", "Game maps held in memory")
+resident_bytes = Gauge("game_service_resident_bytes", "Memory taken by the game maps held")
+games_hibernated = Counter("game_service_games_hibernated", "Game maps dropped from memory until they're needed again")
+
+# Memory the maps of a replica may take before the least recently used get hibernated
+MEMORY_BUDGET = 256 * 2**20 # bytes
+# Games nobody looked up for this long get hibernated, within budget or not
+IDLE_AFTER = 300 # seconds
+SWEEP_INTERVAL = 5 # seconds
+
+
+class Hibernator:
+    """Hibernates games on the engine's event loop, so no tick or websocket sees one half gone
+
+    Games whose last snapshot is behind get one on the log writer's next round,
+    and are hibernated on a later sweep.
+    """
+    def __init__(self, maps, log, engine, game_rooms, budget = MEMORY_BUDGET, idle_after = IDLE_AFTER):
+        self.maps = maps
+        self.log = log
+        self.engine = engine
+        self.game_rooms = game_rooms
+        self.budget = budget
+        self.idle_after = idle_after
+
+    def sweep(self):
+        """Hibernates what it can, returns the IDs of the games it did"""
+        now = time.monotonic()
+        games = sorted(self.maps.items(), key = lambda item: item[1].touched)
+        resident = sum(state.nbytes() for game_id, state in games)
+        hibernated = []
+        for game_id, state in games:
+            idle = now - state.touched
+            if idle < SWEEP_INTERVAL or (resident <= self.budget and idle < self.idle_after):
+                # The rest were looked up more recently still. Games looked up since the
+                # last sweep are kept regardless, their player may be about to join
+                break
+            if self.game_rooms.size(game_id) or self.engine.pending(game_id):
+                continue
+            if not self.log.saved(game_id, state.log_seq):
+                self.log.resnapshot(game_id)
+                continue
+
+            self.maps.remove(game_id)
+            self.log.release(game_id)
+            resident -= state.nbytes()
+            hibernated.append(game_id)
+
+        games_hibernated.inc(len(hibernated))
+        resident_games.set(len(self.maps))
+        resident_bytes.set(resident)
+        return hibernated
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
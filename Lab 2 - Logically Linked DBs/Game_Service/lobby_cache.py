@@ -0,0 +1,245 @@
+import time
+import uuid
+import bisect
+import select
+import logging
+import threading
+from collections import deque
+
+import psycopg2
+from prometheus_client import Gauge, Histogram
+
+import queries
+
+
+logger = logging.getLogger(__name__)
+
+cache_lag = Histogram("game_service_lobby_cache_lag_seconds", "Delay between a lobby write and the cache applying it")
+cache_version = Gauge("game_service_lobby_cache_version", "Version of the in-memory lobby list")
+
+# lobby_tbl's trigger sends "<lobby id>:<epoch seconds>" on this channel for every write
+CHANNEL = "lobby_changes"
+# How long the listener waits for notifications before pinging its connection
+POLL_TIMEOUT = 10 # seconds
+RETRY_DELAY = 2 # seconds
+# Watchers further behind than this many lobby changes get a fresh snapshot instead
+CHANGE_LOG_SIZE = 10000
+
+# lobby_tbl.status of lobbies still taking members, see queries.START_GAME
+OPEN = 1
+
+CREATED = "created"
+UPDATED = "updated"
+REMOVED = "removed"
+
+
+class LobbyCache:
+    """In-memory copy of the open lobby list, kept in sync by a LobbyListener
+
+    Rows have the same (id, name, member_count, max_members, status) shape as the lobby list queries.
+    Reads should fall back to the DB while `ready` is False, the listener
+    flips it off whenever it might have missed a change.
+
+    Every change bumps `version` and is kept in a bounded log, so watchers can
+    catch up from the version they last saw. Versions only mean something
+    within one `epoch`, i.e. one cache on one replica.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lobbies = {}
+        self._ids = []
+        # Lobby writes seen so far, and the write each lobby last changed at. Unlike
+        # versions, these count writes that leave the row as it was, like swapping members
+        self._writes = 0
+        self._changed_at = {}
+        self._log = deque(maxlen = CHANGE_LOG_SIZE)
+        self._loaded_version = 0
+        self._subscribers = []
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.ready = False
+
+    def load(self, rows):
+        """Replaces the whole list, watchers have to start over from a snapshot"""
+        with self._lock:
+            self._lobbies = {row[0]: row for row in rows}
+            self._ids = sorted(self._lobbies)
+            self.version += 1
+            self._writes += 1
+            self._changed_at = dict.fromkeys(self._ids, self._writes)
+            self._log.clear()
+            self._loaded_version = self.version
+            self.ready = True
+        cache_version.set(self.version)
+        self._notify()
+
+    def apply(self, changed_ids, rows):
+        """Updates the changed lobbies, those missing from `rows` got closed or deleted"""
+        with self._lock:
+            version = self.version + 1
+            fresh = {row[0]: row for row in rows}
+            for lobby_id in changed_ids:
+                row = fresh.get(lobby_id)
+                if row is not None:
+                    if lobby_id not in self._lobbies:
+                        bisect.insort(self._ids, lobby_id)
+                        self._log.append((version, lobby_id, CREATED, row))
+                    elif self._lobbies[lobby_id] != row:
+                        self._log.append((version, lobby_id, UPDATED, row))
+                    self._lobbies[lobby_id] = row
+                    self._writes += 1
+                    self._changed_at[lobby_id] = self._writes
+                elif self._lobbies.pop(lobby_id, None) is not None:
+                    del self._ids[bisect.bisect_left(self._ids, lobby_id)]
+                    del self._changed_at[lobby_id]
+                    self._log.append((version, lobby_id, REMOVED, None))
+
+            if not self._log or self._log[-1][0] != version:
+                # Nothing visible changed
+                return
+            self.version = version
+        cache_version.set(self.version)
+        self._notify()
+
+    def invalidate(self):
+        self.ready = False
+
+    def subscribe(self, callback):
+        """Calls `callback` from the listener thread after every change, returns a function to unsubscribe"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _notify(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback()
+
+    def lobby_version(self, lobby_id):
+        """A value that changes with every write to the lobby, None if it's not an open lobby or the cache isn't ready"""
+        if not self.ready:
+            return None
+        return self._changed_at.get(lobby_id)
+
+    def touch(self, lobby_id):
+        """Marks a lobby this replica just wrote to as changed, without waiting for its notification"""
+        with self._lock:
+            if lobby_id in self._changed_at:
+                self._writes += 1
+                self._changed_at[lobby_id] = self._writes
+
+    def snapshot(self):
+        """Returns the current version and every lobby, ordered by ID"""
+        with self._lock:
+            return self.version, [self._lobbies[lobby_id] for lobby_id in self._ids]
+
+    def changes_since(self, version):
+        """Returns (current version, created rows, updated rows, removed IDs) since `version`
+
+        Returns None if the log doesn't reach back that far and a snapshot is needed.
+        A lobby created and removed in between isn't mentioned at all.
+        """
+        with self._lock:
+            oldest = self._loaded_version
+            if len(self._log) == self._log.maxlen:
+                # Entries of the oldest logged version may have been partly dropped
+                oldest = max(oldest, self._log[0][0])
+            if not self.ready or version < oldest or version > self.version:
+                return None
+
+            latest = {}
+            first_kind = {}
+            for entry_version, lobby_id, kind, row in reversed(self._log):
+                if entry_version <= version:
+                    break
+                latest.setdefault(lobby_id, (kind, row))
+                first_kind[lobby_id] = kind
+            current = self.version
+
+        created, updated, removed = [], [], []
+        for lobby_id, (kind, row) in latest.items():
+            if kind == REMOVED:
+                if first_kind[lobby_id] != CREATED:
+                    removed.append(lobby_id)
+            elif first_kind[lobby_id] == CREATED:
+                created.append(row)
+            else:
+                updated.append(row)
+        return current, created, updated, removed
+
+    def page(self, after, prefix, has_free_slots, limit):
+        """Same rows GET_LOBBIES/GET_FREE_LOBBIES would return, one past the limit included"""
+        rows = []
+        with self._lock:
+            ids = self._ids
+            i = bisect.bisect_right(ids, after)
+            while i < len(ids) and len(rows) <= limit:
+                row = self._lobbies[ids[i]]
+                i += 1
+                if has_free_slots and (row[4] != OPEN or row[2] >= row[3]):
+                    continue
+                if not row[1].startswith(prefix):
+                    continue
+                rows.append(row)
+        return rows
+
+
+class LobbyListener(threading.Thread):
+    """Keeps a LobbyCache up to date from lobby_tbl's notifications
+
+    Only the lobbies named in a batch of notifications get fetched again.
+    After a reconnect the whole list is reloaded, as notifications sent
+    while disconnected are lost.
+    """
+    def __init__(self, dsn, cache):
+        super().__init__(daemon = True)
+        self.dsn = dsn
+        self.cache = cache
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except psycopg2.Error as e:
+                logger.info(f"Lost the lobby change feed, retrying: {e}")
+                self.cache.invalidate()
+                time.sleep(RETRY_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                # Listen first, so nothing written during the load gets missed
+                cursor.execute(f"LISTEN {CHANNEL}")
+                cursor.execute(queries.GET_OPEN_LOBBIES)
+                self.cache.load(cursor.fetchall())
+                logger.info("Lobby cache loaded")
+
+                while True:
+                    if select.select([conn], [], [], POLL_TIMEOUT) == ([], [], []):
+                        # Nothing happened for a while, make sure the connection is still alive
+                        cursor.execute("SELECT 1")
+                        continue
+
+                    conn.poll()
+                    written_at = {}
+                    while conn.notifies:
+                        lobby_id, timestamp = conn.notifies.pop(0).payload.split(":")
+                        written_at.setdefault(int(lobby_id), float(timestamp))
+                    if not written_at:
+                        continue
+
+                    cursor.execute(queries.GET_LOBBY_ROWS, (list(written_at),))
+                    self.cache.apply(written_at, cursor.fetchall())
+
+                    now = time.time()
+                    for timestamp in written_at.values():
+                        cache_lag.observe(max(now - timestamp, 0))
+        finally:
+            conn.close()
@@ -1,17 +1,36 @@
 import os
+import re
 import grpc
-import random
+import json
 import requests
 import logging
 import signal
 import atexit
 import asyncio
-import psycopg2
+import threading
 import websockets
+import numpy as np
 from time import sleep
 from concurrent import futures
 from prometheus_client import start_http_server, Counter
 
+import db
+import queries
+import rooms
+import units
+import actions
+import action_log
+import protocol
+import map_state
+import world_map
+import placement
+import handoff
+import hibernation
+import tick_engine
+import lobby_cache
+import response_cache
+import singleflight
+import statements
 import game_routes_pb2 as pb2
 import game_routes_pb2_grpc as pb2_grpc
 import health_pb2 as hpb2
@@ -19,9 +38,51 @@ import health_pb2_grpc as hpb2_grpc
 
 
 request_counter = Counter("game_service_total_requests", "Total requests to the Game Service")
+cache_hits = Counter("game_service_lobby_cache_hits", "Lobby lists served from memory")
+cache_misses = Counter("game_service_lobby_cache_misses", "Lobby lists served from the DB while the cache wasn't ready")
+
+# Open lobbies, kept up to date by a LobbyListener started in __main__
+lobbies = lobby_cache.LobbyCache()
+# Serialized getLobbies/getLobby responses, tied to the lobby cache's versions
+responses = response_cache.ResponseCache(max_entries = 2048)
+# Concurrent identical reads share one DB query, one of these is used depending on the mode
+flights = singleflight.SingleFlight()
+async_flights = singleflight.AsyncSingleFlight()
+# Map state of every game played on this replica
+# The static map, memory-mapped from the file the Dockerfile compiles (or compiled here if missing)
+world = world_map.open_map()
+maps = map_state.GameMaps(world)
+
+# Players' websockets, by game
+game_rooms = rooms.Rooms()
+# Which replica each game belongs to, kept up to date by a RingWatcher started in __main__
+ring = placement.HashRing()
+# Applied actions on their way to the DB, written by a LogWriter started in __main__
+history = action_log.ActionLog()
+
+# How long a drain waits for the games it couldn't hand over to be saved, at most
+DRAIN_SAVE_TIMEOUT = 10 # seconds
+
+# Players connect their websocket to /game/<game ID>/<user ID>, the Gateway checks who they are
+GAME_PATH = re.compile(r"/game/(\d+)/(\d+)")
+
+# Also the size of the DB connection pool, so that every worker can hold a connection
+MAX_WORKERS = 10
+# The async servicer has no worker threads, only a cap on concurrent DB connections
+ASYNC_POOL_SIZE = 20
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Each lobby watcher holds a worker thread for as long as it's connected in threaded mode,
+# leave some for the other routes. The async mode has no such limit.
+MAX_WATCHERS = MAX_WORKERS // 2
+watcher_slots = threading.BoundedSemaphore(MAX_WATCHERS)
 
 def registerSelf():
-    response = requests.post(f"{SERVICE_DISCOVERY_URL}/register", json = {f"game-service": INSTANCE_ID})
+    # The ring points other replicas and the Gateway place games with
+    payload = {"game-service": INSTANCE_ID, "tokens": placement.tokens_for(INSTANCE_ID)}
+    response = requests.post(f"{SERVICE_DISCOVERY_URL}/register", json = payload)
 
     if response.status_code == 201:
         logger.info("Registered a Game Service!")
@@ -38,179 +99,631 @@ def deregisterSelf():
         logger.info("Error deregistering service!")
 
 
-def signalHandler(signal, frame):
-    deregisterSelf()
-    exit(0)
+def misplaced(game_id):
+    """The replica the game belongs to if it isn't this one, None otherwise
 
+    Games are served anywhere while the ring is empty, e.g. before discovery answered.
+    """
+    owner = ring.owner(game_id)
+    if owner is None or owner == INSTANCE_ID:
+        return None
+    return owner
 
-class HealthService(hpb2_grpc.HealthServicer):
-    def Check(self, request, context):
-        return hpb2.HealthCheckResponse(status = hpb2.HealthCheckResponse.SERVING)
 
+def lobby_page_query(request):
+    """Picks the query and its parameters for a page of lobbies"""
+    page_size = request.pageSize
+    if page_size <= 0:
+        page_size = DEFAULT_PAGE_SIZE
+    page_size = min(page_size, MAX_PAGE_SIZE)
 
-class GameService(pb2_grpc.GameRoutesServicer):
-    def getLobbies(self, request, context):
-        """Returns a list of available lobbies from the database"""
-        query = "SELECT name, curr_members, max_members FROM lobby_tbl WHERE status!=0"
-        cursor.execute(query)
+    params = {"after": request.cursor, "prefix": request.namePrefix, "limit": page_size}
+    if request.hasFreeSlots:
+        return queries.GET_FREE_LOBBIES, params
+    return queries.GET_LOBBIES, params
 
-        request_counter.inc()
 
-        lobby_list = cursor.fetchall()
-        proto_lobbies = []
-        for lobby in lobby_list:
-            p_lobby = pb2.LobbyInfo()
-            p_lobby.name = lobby[0]
-            p_lobby.currMembers = len(lobby[1])
-            p_lobby.maxMembers = lobby[2]
-            proto_lobbies.append(p_lobby)
-
-        result = {"status": 200, "lobbies": proto_lobbies}
-        return pb2.LobbyList(**result)
-    
-    def getLobby(self, request, context):
-        query = "SELECT name, curr_members, max_members FROM lobby_tbl WHERE status!=0 AND id=%s"
-        cursor.execute(query, (request.lobbyID,))
-        
-        request_counter.inc()
-        lobby = cursor.fetchone()
-        if lobby:
-            result = {
-                "status": 200, 
-                "name": lobby[0],
-                "currMembers": len(lobby[1]),
-                "maxMembers": lobby[2],
-                "players": lobby[1]
-            }
-        else:
-            result = {"status": 404}
+def cached_lobby_page(request, params):
+    """Returns a page of lobbies from memory, or None if the cache can't be trusted right now"""
+    if not lobbies.ready:
+        cache_misses.inc()
+        return None
 
-        return pb2.LobbyDetails(**result)
-    
-    def makeLobby(self, request, context):
-        query = "INSERT INTO lobby_tbl (name, curr_members, max_members, status) VALUES (%s, %s, %s, %s)"
-        cursor.execute(query, (request.name, [request.userID], request.maxCount, 1))
-        request_counter.inc()
+    cache_hits.inc()
+    return lobbies.page(request.cursor, request.namePrefix, request.hasFreeSlots, params["limit"])
+
+
+def lobby_info(lobby):
+    return pb2.LobbyInfo(id = lobby[0], name = lobby[1], currMembers = lobby[2], maxMembers = lobby[3])
+
+
+def lobby_list(rows, page_size):
+    proto_lobbies = [lobby_info(lobby) for lobby in rows[:page_size]]
+
+    result = {"status": 200, "lobbies": proto_lobbies}
+    # The query fetches one extra row if there's another page after this one
+    if len(rows) > page_size:
+        result["nextCursor"] = rows[page_size - 1][0]
+    return pb2.LobbyList(**result)
+
+
+def lobby_delta(version):
+    """Builds the LobbyDelta bringing a watcher at `version` up to date
+
+    Returns None as the delta if there's nothing to send, along with the watcher's new version.
+    Pass a version of -1 to get a snapshot.
+    """
+    if not lobbies.ready:
+        # Wait for the cache to (re)load, it tells its subscribers once it does
+        return None, version
+
+    changes = lobbies.changes_since(version)
+    if changes is None:
+        version, rows = lobbies.snapshot()
+        result = {
+            "epoch": lobbies.epoch,
+            "version": version,
+            "snapshot": True,
+            "created": [lobby_info(lobby) for lobby in rows]
+        }
+        return pb2.LobbyDelta(**result), version
+
+    version, created, updated, removed = changes
+    if not (created or updated or removed):
+        return None, version
+
+    result = {
+        "epoch": lobbies.epoch,
+        "version": version,
+        "created": [lobby_info(lobby) for lobby in created],
+        "updated": [lobby_info(lobby) for lobby in updated],
+        "removed": removed
+    }
+    return pb2.LobbyDelta(**result), version
+
+
+def watch_start_version(request):
+    # Versions from another replica's cache (or an older one of ours) mean nothing here
+    if request.epoch == lobbies.epoch:
+        return request.fromVersion
+    return -1
+
+
+def lobby_read_key(route, query, params):
+    # The lobby's version is part of the key, so no one joins a query started before a change they've seen
+    version = lobbies.lobby_version(params[0]) if route == "getLobby" else None
+    return (route, query, str(params), version)
+
+
+class Query:
+    """Route step running one statement on a pooled connection
+
+    Resolves to its first row, or all of them with fetch_all, None if it returns no rows.
+    """
+    def __init__(self, sql, params, fetch_all = False):
+        self.sql = sql
+        self.params = params
+        self.fetch_all = fetch_all
+
+    def run(self):
+        with pool.cursor() as cursor:
+            statements.execute(cursor, self.sql, self.params)
+            if cursor.description is None:
+                return None
+            return cursor.fetchall() if self.fetch_all else cursor.fetchone()
+
+    async def run_async(self):
+        async with pool.cursor() as cursor:
+            await statements.execute_async(cursor, self.sql, self.params)
+            if cursor.description is None:
+                return None
+            return await (cursor.fetchall() if self.fetch_all else cursor.fetchone())
+
+
+class Read(Query):
+    """Query step shared with identical concurrent reads"""
+    def __init__(self, route, sql, params, fetch_all = False):
+        super().__init__(sql, params, fetch_all)
+        self.route = route
+
+    def run(self):
+        return flights.do(self.route, lobby_read_key(self.route, self.sql, self.params), super().run)
+
+    async def run_async(self):
+        return await async_flights.do(self.route, lobby_read_key(self.route, self.sql, self.params), super().run_async)
+
+
+class Call:
+    """Route step calling a blocking function, off the event loop in async mode"""
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def run(self):
+        return self.func(*self.args)
+
+    async def run_async(self):
+        return await asyncio.to_thread(self.func, *self.args)
+
+
+def drive(route):
+    """Runs a route, a generator yielding the steps above and returning its response, on this thread"""
+    result = None
+    while True:
+        try:
+            step = route.send(result)
+        except StopIteration as done:
+            return done.value
+        result = step.run()
+
+
+async def drive_async(route):
+    """Runs a route on the event loop, its steps awaited, or run on a thread for a threaded pool's connections"""
+    on_loop = isinstance(pool, db.AsyncConnectionPool)
+    result = None
+    while True:
+        try:
+            step = route.send(result)
+        except StopIteration as done:
+            return done.value
+        result = await (step.run_async() if on_loop else asyncio.to_thread(step.run))
+
+
+def lobby_list_version():
+    """Data version for cached getLobbies responses, None if they can't be cached right now"""
+    if not lobbies.ready:
+        return None
+    return lobbies.version
+
+
+def lobby_details(lobby):
+    if lobby:
         result = {
             "status": 200,
-            "currMembers": 1,
-            "maxMembers": request.maxCount,
-            "name": request.name,
-            "players": [request.userID]
+            "name": lobby[0],
+            "currMembers": lobby[1],
+            "maxMembers": lobby[2],
+            "players": lobby[3]
         }
-        return pb2.LobbyDetails(**result)
-    
-    def joinLobby(self, request, context):
-        query = "SELECT curr_members, max_members FROM lobby_tbl WHERE status!=0 AND id=%s"
-        cursor.execute(query, (request.lobbyID,))
-        request_counter.inc()
+    else:
+        result = {"status": 404}
+
+    return pb2.LobbyDetails(**result)
 
-        lobby = cursor.fetchone()
-        if lobby:
-            if len(lobby[0]) + 1 < lobby[1]:
-                query = "UPDATE lobby_tbl \
-                    SET curr_members = array_append(curr_members, %s) \
-                    WHERE id = %s"
-                cursor.execute(query, (request.userID, request.lobbyID))
-                result = {"status": 200}
-            else:
-                result = {"status": 400}
+
+def joined_lobby(lobby):
+    if lobby:
+        if lobby[3]:
+            result = {
+                "status": 200,
+                "name": lobby[0],
+                "currMembers": lobby[1],
+                "maxMembers": lobby[2]
+            }
         else:
-            result = {"status": 404}
+            # Lobby is full, or its game started
+            result = {"status": 400}
+    else:
+        result = {"status": 404}
 
-        return pb2.LobbyDetails(**result)
-    
-    def leaveLobby(self, request, context):
-        query = "SELECT curr_members, max_members FROM lobby_tbl WHERE status!=0 AND id=%s"
-        cursor.execute(query, (request.lobbyID,))
-        request_counter.inc()
+    return pb2.LobbyDetails(**result)
 
-        lobby = cursor.fetchone()
-        if lobby:
-            query = "UPDATE lobby_tbl \
-                SET curr_members = array_remove(curr_members, %s) \
-                WHERE id = %s \
-                RETURNING curr_members"
-            cursor.execute(query, (request.userID, request.lobbyID))
-            members = cursor.fetchone()[0]
-            if len(members) == 0:
-                query = "DELETE FROM lobby_tbl WHERE id = %s;"
-                cursor.execute(query, (request.lobbyID,))
-
-            result = {"status": 200}
+
+def game_state(state, request):
+    """GameState with only what changed since the caller's version, or all of it if that can't be told"""
+    with state.lock:
+        changes = state.changes_since(request.fromVersion) if request.epoch == state.epoch else None
+        if changes is None:
+            provinces, nations, slots = np.arange(len(state.owner)), np.arange(len(state.players)), state.units.alive()
         else:
-            result = {"status": 404}
+            provinces, nations, slots = changes
+        version = state.version
+        owners = state.owner[provinces].tolist()
+        population = state.population[provinces].tolist()
+        upgrades = state.upgrade[provinces].tolist()
+        resources = state.resources[provinces].tolist()
+        policies = state.policy[nations].tolist()
+        stock = state.stock[nations].tolist()
+        relations = state.relations[nations].tolist()
+        unit_fields = [getattr(state.units, name)[slots].tolist() for name in ("owner", "tag", "type", "province", "strength", "orders")]
+
+    players = state.players
+    result = {
+        "status": 200,
+        "epoch": state.epoch,
+        "version": version,
+        "snapshot": changes is None,
+        "provinces": [
+            pb2.ProvinceState(
+                id = province + 1,
+                # User ID of the owner, 0 for none
+                owner = players[owners[i]] if owners[i] != map_state.NO_OWNER else 0,
+                population = population[i],
+                upgrade = upgrades[i],
+                resources = resources[i]
+            )
+            for i, province in enumerate(provinces.tolist())
+        ],
+        "nations": [
+            pb2.NationState(userID = players[nation], policy = policies[i], stock = stock[i], relations = relations[i])
+            for i, nation in enumerate(nations.tolist())
+        ],
+        "units": [
+            pb2.UnitState(
+                slot = slot,
+                owner = players[owner] if owner != units.NO_OWNER else 0,
+                unitID = tag,
+                type = kind,
+                province = province + 1,
+                strength = strength,
+                destination = orders + 1
+            )
+            for slot, (owner, tag, kind, province, strength, orders) in zip(slots.tolist(), zip(*unit_fields))
+        ]
+    }
+    return pb2.GameState(**result)
+
+
+def nation_data(state):
+    """PlayerData of every nation in the game, in lobby join order"""
+    with state.lock:
+        population, provinces = state.summary()
+    return [pb2.PlayerData(population = total, provinceIDs = ids) for total, ids in zip(population, provinces)]
 
-        return pb2.Status(**result)
 
-    def getGame(self, request, context):
+class HealthService(hpb2_grpc.HealthServicer):
+    def Check(self, request, context):
+        return hpb2.HealthCheckResponse(status = hpb2.HealthCheckResponse.SERVING)
+
+
+class AsyncHealthService(hpb2_grpc.HealthServicer):
+    async def Check(self, request, context):
+        return hpb2.HealthCheckResponse(status = hpb2.HealthCheckResponse.SERVING)
+
+
+def get_lobbies(request):
+    """Returns a page of available lobbies from the database"""
+    query, params = lobby_page_query(request)
+    rows = cached_lobby_page(request, params)
+    if rows is None:
+        rows = yield Read("getLobbies", query, params, fetch_all = True)
+
+    request_counter.inc()
+    return lobby_list(rows, params["limit"])
+
+
+def get_lobby(request):
+    lobby = yield Read("getLobby", queries.GET_LOBBY, (request.lobbyID,))
+
+    request_counter.inc()
+    return lobby_details(lobby)
+
+
+def make_lobby(request):
+    yield Query(queries.MAKE_LOBBY, {"name": request.name, "max": request.maxCount, "user": request.userID})
+    request_counter.inc()
+    result = {
+        "status": 200,
+        "currMembers": 1,
+        "maxMembers": request.maxCount,
+        "name": request.name,
+        "players": [request.userID]
+    }
+    return pb2.LobbyDetails(**result)
+
+
+def join_lobby(request):
+    request_counter.inc()
+
+    lobby = yield Query(queries.JOIN_LOBBY, {"lobby": request.lobbyID, "user": request.userID})
+    # Written, this replica's cached copies of the lobby are out of date
+    lobbies.touch(request.lobbyID)
+
+    return joined_lobby(lobby)
+
+
+def leave_lobby(request):
+    request_counter.inc()
+
+    lobby = yield Query(queries.LEAVE_LOBBY, {"lobby": request.lobbyID, "user": request.userID})
+    # Written, this replica's cached copies of the lobby are out of date
+    lobbies.touch(request.lobbyID)
+
+    if lobby:
         result = {"status": 200}
-        # Placeholder...
-        return pb2.Status(**result)
-    
-    def endGame(self, request, context):
-        # Made-up data for testing purposes
-        players = []
-        for i in range(random.randint(5, 20)):
-            player_info = pb2.PlayerData()
-
-            provinces = []
-            for i in range(random.randint(10, 50)):
-                provinces.append(random.randint(1, 400))
-            
-            player_info.population = random.randint(10000, 250000)
-            player_info.provinceIDs.extend(provinces)
-            players.append(player_info)
-        
-        query = "UPDATE lobby_tbl SET status = -1 WHERE id = %s RETURNING status"
-        cursor.execute(query, (request.gameID,))
-        lobby = cursor.fetchone()
-
-        if lobby != None:
-            result = {"status": 200, "nations": players}
-        else:
-            result = {"status": 404}
-        return pb2.MapData(**result)
+    else:
+        result = {"status": 404}
 
-    def continueGame(self, request, context):
-        query = "UPDATE lobby_tbl SET status = 1 WHERE id = %s RETURNING status"
-        cursor.execute(query, (request.gameID,))
-        lobby = cursor.fetchone()
+    return pb2.Status(**result)
 
-        if lobby != None:
-            result = {"status": 200}
-        else:
-            result = {"status": 404}
-        return pb2.Status(**result)
 
-    def closeGame(self, request, context):
-        query = "DELETE FROM lobby_tbl WHERE id = %s;"
-        cursor.execute(query, (request.gameID,))
-        
+def get_game(request):
+    """Returns the game's state, or only what changed since the version the caller saw"""
+    owner = misplaced(request.gameID)
+    if owner is not None:
+        return pb2.GameState(status = 421, owner = owner)
+    state = yield from game_map(request.gameID, request.userID)
+    request_counter.inc()
+    if state is None:
+        return pb2.GameState(status = 404)
+    return game_state(state, request)
+
+
+def end_game(request):
+    owner = misplaced(request.gameID)
+    if owner is not None:
+        return pb2.MapData(status = 421, owner = owner)
+    lobby = yield Query(queries.END_GAME, (request.gameID,))
+
+    if lobby != None:
+        # Games that never got a map (e.g. ended right away) end on a freshly laid out one
+        state = yield from load_game(request.gameID, lobby[1])
+        result = {"status": 200, "nations": nation_data(state)}
+    else:
+        result = {"status": 404}
+    return pb2.MapData(**result)
+
+
+def continue_game(request):
+    owner = misplaced(request.gameID)
+    if owner is not None:
+        return pb2.Status(status = 421, owner = owner)
+    lobby = yield Query(queries.CONTINUE_GAME, (request.gameID,))
+
+    if lobby != None:
         result = {"status": 200}
-        return pb2.Status(**result)
+    else:
+        result = {"status": 404}
+    return pb2.Status(**result)
+
+
+def close_game(request):
+    owner = misplaced(request.gameID)
+    if owner is not None:
+        return pb2.Status(status = 421, owner = owner)
+    yield Query(queries.DELETE_LOBBY, (request.gameID,))
+    maps.remove(request.gameID)
+    history.forget(request.gameID)
+
+    result = {"status": 200}
+    return pb2.Status(**result)
+
+
+def migrate_game(request):
+    """Takes over a game from a draining replica"""
+    handoff.adopt(request, maps, ring, engine, INSTANCE_ID)
+    return pb2.Status(status = 200)
+
+
+def get_lobbies_raw(request_bytes):
+    """getLobbies, straight from serialized request to serialized response
+
+    Skips building the response if an up to date copy is cached.
+    """
+    version = lobby_list_version()
+    data = responses.get("getLobbies", request_bytes, version) if version is not None else None
+    if data is None:
+        data = (yield from get_lobbies(pb2.LobbyQuery.FromString(request_bytes))).SerializeToString()
+        if version is not None:
+            responses.put("getLobbies", request_bytes, version, data)
+    else:
+        request_counter.inc()
+    return data
 
 
+def get_lobby_raw(request_bytes):
+    request = pb2.LobbyID.FromString(request_bytes)
+    version = lobbies.lobby_version(request.lobbyID)
+    data = responses.get("getLobby", request_bytes, version) if version is not None else None
+    if data is None:
+        data = (yield from get_lobby(request)).SerializeToString()
+        if version is not None:
+            responses.put("getLobby", request_bytes, version, data)
+    else:
+        request_counter.inc()
+    return data
+
 
+class GameService(pb2_grpc.GameRoutesServicer):
+    """The routes above, run on the gRPC worker threads"""
+    def getLobbies(self, request, context):
+        return drive(get_lobbies(request))
+
+    def getLobby(self, request, context):
+        return drive(get_lobby(request))
+
+    def makeLobby(self, request, context):
+        return drive(make_lobby(request))
+
+    def joinLobby(self, request, context):
+        return drive(join_lobby(request))
+
+    def leaveLobby(self, request, context):
+        return drive(leave_lobby(request))
+
+    def getGame(self, request, context):
+        return drive(get_game(request))
+
+    def endGame(self, request, context):
+        return drive(end_game(request))
 
-def addAllServicers(server):
-    pb2_grpc.add_GameRoutesServicer_to_server(GameService(), server)
-    hpb2_grpc.add_HealthServicer_to_server(HealthService(), server)
+    def continueGame(self, request, context):
+        return drive(continue_game(request))
 
-    
-def check_db_tables():
+    def closeGame(self, request, context):
+        return drive(close_game(request))
+
+    def migrateGame(self, request, context):
+        return migrate_game(request)
+
+    def getLobbiesRaw(self, request_bytes, context):
+        return drive(get_lobbies_raw(request_bytes))
+
+    def getLobbyRaw(self, request_bytes, context):
+        return drive(get_lobby_raw(request_bytes))
+
+    def watchLobbies(self, request, context):
+        """Streams a lobby snapshot, then deltas as lobbies change"""
+        if not watcher_slots.acquire(blocking = False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many lobby watchers")
+
+        changed = threading.Event()
+        unsubscribe = lobbies.subscribe(changed.set)
+        # Wake up to notice the client leaving
+        context.add_callback(changed.set)
+        try:
+            version = watch_start_version(request)
+            while context.is_active():
+                changed.clear()
+                delta, version = lobby_delta(version)
+                if delta is not None:
+                    yield delta
+                changed.wait()
+        finally:
+            unsubscribe()
+            watcher_slots.release()
+
+
+class AsyncGameService(pb2_grpc.GameRoutesServicer):
+    """The same routes, run as coroutines on the event loop"""
+    async def getLobbies(self, request, context):
+        return await drive_async(get_lobbies(request))
+
+    async def getLobby(self, request, context):
+        return await drive_async(get_lobby(request))
+
+    async def makeLobby(self, request, context):
+        return await drive_async(make_lobby(request))
+
+    async def joinLobby(self, request, context):
+        return await drive_async(join_lobby(request))
+
+    async def leaveLobby(self, request, context):
+        return await drive_async(leave_lobby(request))
+
+    async def getGame(self, request, context):
+        return await drive_async(get_game(request))
+
+    async def endGame(self, request, context):
+        return await drive_async(end_game(request))
+
+    async def continueGame(self, request, context):
+        return await drive_async(continue_game(request))
+
+    async def closeGame(self, request, context):
+        return await drive_async(close_game(request))
+
+    async def migrateGame(self, request, context):
+        return migrate_game(request)
+
+    async def getLobbiesRaw(self, request_bytes, context):
+        return await drive_async(get_lobbies_raw(request_bytes))
+
+    async def getLobbyRaw(self, request_bytes, context):
+        return await drive_async(get_lobby_raw(request_bytes))
+
+    async def watchLobbies(self, request, context):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        unsubscribe = lobbies.subscribe(lambda: loop.call_soon_threadsafe(changed.set))
+        try:
+            version = watch_start_version(request)
+            while True:
+                changed.clear()
+                delta, version = lobby_delta(version)
+                if delta is not None:
+                    yield delta
+                await changed.wait()
+        finally:
+            unsubscribe()
+
+
+def addAllServicers(server, game_service, health_service):
+    pb2_grpc.add_GameRoutesServicer_to_server(game_service, server)
+    # Replace the generated handlers of the cached read routes with ones that
+    # take and return bytes as they are, (de)serializing only on cache misses
+    raw_handlers = {
+        "getLobbies": grpc.unary_unary_rpc_method_handler(game_service.getLobbiesRaw),
+        "getLobby": grpc.unary_unary_rpc_method_handler(game_service.getLobbyRaw)
+    }
+    server.add_registered_method_handlers("game_routes.GameRoutes", raw_handlers)
+    hpb2_grpc.add_HealthServicer_to_server(health_service, server)
+
+
+def check_db_tables(cursor):
     cursor.execute("SELECT 1 FROM pg_catalog.pg_database WHERE datname = 'game_data'")
     exists = cursor.fetchone()
     if not exists:
         cursor.execute("CREATE DATABASE game_data")
 
+    # Every replica runs this on startup, only let one of them change the schema at a time
+    cursor.execute("SELECT pg_advisory_lock(hashtext('game_service_schema'))")
+
     cursor.execute("CREATE TABLE IF NOT EXISTS lobby_tbl\
-        (id SERIAL PRIMARY KEY, name TEXT, curr_members INTEGER[], max_members SMALLINT, status SMALLINT)")
+        (id SERIAL PRIMARY KEY, name TEXT, member_count SMALLINT NOT NULL DEFAULT 0, max_members SMALLINT, status SMALLINT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS lobby_members\
+        (lobby_id INTEGER NOT NULL REFERENCES lobby_tbl (id) ON DELETE CASCADE,\
+        user_id INTEGER NOT NULL,\
+        joined_at TIMESTAMPTZ NOT NULL DEFAULT now(),\
+        PRIMARY KEY (lobby_id, user_id))")
+    # Looking up which lobby a user is in
+    cursor.execute("CREATE INDEX IF NOT EXISTS lobby_members_user_idx ON lobby_members (user_id)")
+    migrate_lobby_members(cursor)
+    # Only joinable lobbies, for listing lobbies with free slots
+    # Replaced by lobby_free_slots_idx, whose lobbies can fill every last slot
+    cursor.execute("DROP INDEX IF EXISTS lobby_joinable_idx")
+    cursor.execute("CREATE INDEX IF NOT EXISTS lobby_free_slots_idx ON lobby_tbl (id)\
+        WHERE status != 0 AND member_count < max_members")
+
+    # Every write to a lobby tells the other replicas' lobby caches which lobby changed
+    cursor.execute(f"CREATE OR REPLACE FUNCTION notify_lobby_change() RETURNS trigger AS $$\
+        DECLARE lobby INTEGER;\
+        BEGIN\
+            IF TG_OP = 'DELETE' THEN lobby := OLD.id; ELSE lobby := NEW.id; END IF;\
+            PERFORM pg_notify('{lobby_cache.CHANNEL}', lobby || ':' || extract(epoch FROM clock_timestamp()));\
+            RETURN NULL;\
+        END;\
+        $$ LANGUAGE plpgsql")
+    cursor.execute("CREATE OR REPLACE TRIGGER lobby_changed AFTER INSERT OR UPDATE OR DELETE ON lobby_tbl\
+        FOR EACH ROW EXECUTE FUNCTION notify_lobby_change()")
+
+    # Saved game maps, see action_log.py
+    cursor.execute("CREATE TABLE IF NOT EXISTS game_snapshots\
+        (game_id INTEGER PRIMARY KEY, seq BIGINT NOT NULL, players INTEGER[] NOT NULL, state BYTEA NOT NULL,\
+        taken_at TIMESTAMPTZ NOT NULL DEFAULT now())")
+    # Map dumps barely compress, don't spend time trying
+    cursor.execute("ALTER TABLE game_snapshots ALTER COLUMN state SET STORAGE EXTERNAL")
+    cursor.execute("CREATE TABLE IF NOT EXISTS game_actions\
+        (game_id INTEGER NOT NULL, seq BIGINT NOT NULL, tick INTEGER NOT NULL, player_id INTEGER NOT NULL,\
+        action BYTEA NOT NULL, PRIMARY KEY (game_id, seq))")
+
+    cursor.execute("SELECT pg_advisory_unlock(hashtext('game_service_schema'))")
+
+
+def migrate_lobby_members(cursor):
+    """Moves members out of the old lobby_tbl.curr_members arrays, if they're still there"""
+    cursor.execute("SELECT 1 FROM information_schema.columns \
+        WHERE table_name = 'lobby_tbl' AND column_name = 'curr_members'")
+    if not cursor.fetchone():
+        return
+
+    cursor.execute("BEGIN")
+    cursor.execute("ALTER TABLE lobby_tbl ADD COLUMN IF NOT EXISTS member_count SMALLINT NOT NULL DEFAULT 0")
+    # Members were kept in join order, which decides their nations: a microsecond apart keeps it
+    cursor.execute("INSERT INTO lobby_members (lobby_id, user_id, joined_at)\
+        SELECT id, member.user_id, now() + member.position * interval '1 microsecond'\
+        FROM lobby_tbl, unnest(curr_members) WITH ORDINALITY AS member (user_id, position)\
+        ON CONFLICT DO NOTHING")
+    cursor.execute("UPDATE lobby_tbl SET member_count =\
+        (SELECT count(*) FROM lobby_members WHERE lobby_id = lobby_tbl.id)")
+    cursor.execute("ALTER TABLE lobby_tbl DROP COLUMN curr_members")
+    cursor.execute("COMMIT")
+    logger.info("Migrated lobby members to lobby_members")
 
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers = 10))
-    addAllServicers(server)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers = MAX_WORKERS))
+    addAllServicers(server, GameService(), HealthService())
 
     server.add_insecure_port("[::]:7000")
     server.start()
@@ -219,40 +732,231 @@ def serve():
     return server
 
 
+def tick_message(tick, entries):
+    return json.dumps({"tick": tick, "actions": entries}, default = protocol.to_json)
+
+
+def publish_actions(game_id, tick, applied):
+    """Sends the game's players what happened in a tick, encoded once for all of them
+
+    Chat messages only go to their sender and target.
+    """
+    public = []
+    for player_id, action in applied:
+        entry = {"player": player_id, **action}
+        if action["actionID"] == actions.CHAT:
+            game_rooms.send_to(game_id, {player_id, action["targetPlayer"]}, tick_message(tick, [entry]))
+        else:
+            public.append(entry)
+    if public:
+        game_rooms.broadcast(game_id, tick_message(tick, public))
+
+
+engine = tick_engine.TickEngine(maps, publish_actions, history)
+hibernator = hibernation.Hibernator(maps, history, engine, game_rooms)
+# Other replicas' Game Service, by host, for handing games over
+replica_stubs = {}
+
+
+def replica_stub(host):
+    stub = replica_stubs.get(host)
+    if stub is None:
+        stub = replica_stubs[host] = pb2_grpc.GameRoutesStub(grpc.insecure_channel(f"{host}:7000"))
+    return stub
+
+
+rebalancer = handoff.Rebalancer(maps, history, engine, game_rooms, ring, misplaced, replica_stub)
+
+
+def restore_game(game_id):
+    """The game's map as last saved to the DB, None if it never was"""
+    snapshot = yield Query(queries.GET_SNAPSHOT, (game_id,))
+    if snapshot is None:
+        return None
+    rows = yield Query(queries.GET_LOGGED_ACTIONS, (game_id, snapshot[0]), fetch_all = True)
+    return (yield Call(action_log.restore, snapshot, rows))
+
+
+def load_game(game_id, players):
+    """The game's map, restored from the DB or laid out anew if this replica doesn't have it yet"""
+    state = maps.get(game_id)
+    if state is None:
+        restored = yield from restore_game(game_id)
+        state = yield Call(maps.get_or_create, game_id, players, lambda game_id: restored)
+    return state
+
+
+def start_game(game_id):
+    """Locks the game's roster and returns its lobby, None if there's no such game
+
+    Not shared with concurrent getLobby reads, which may have started before the roster was locked.
+    """
+    yield Query(queries.START_GAME, (game_id,))
+    lobby = yield Query(queries.GET_LOBBY, (game_id,))
+    lobbies.touch(game_id)
+    return lobby
+
+
+def game_map(game_id, player_id):
+    """The game's map, restored or laid out on first use, None if there's no such game
+
+    Laying out the map starts the game: nobody else can join its lobby from
+    then on, so only the lobby's players do. Anyone else gets None until then.
+    """
+    state = maps.get(game_id)
+    if state is not None:
+        return state
+
+    lobby = yield Query(queries.GET_LOBBY, (game_id,))
+    if lobby is None:
+        return None
+    if lobby[4] == lobby_cache.OPEN:
+        if player_id not in lobby[3]:
+            return None
+        lobby = yield from start_game(game_id)
+        if lobby is None:
+            return None
+    return (yield from load_game(game_id, lobby[3]))
+
+
 async def process_websocket(websocket):
-    async for message in websocket:
-        logger.info(message)
-        await websocket.send(f"Echo: {message}")
+    """Queues a player's actions for the game's next tick, and sends them everyone else's"""
+    match = GAME_PATH.fullmatch(websocket.request.path)
+    if match is None:
+        await websocket.close(1008, "Expected /game/<game ID>/<user ID>")
+        return
+    game_id, player_id = int(match[1]), int(match[2])
+
+    owner = misplaced(game_id)
+    if owner is not None:
+        # The Gateway reconnects the player to the owner
+        await websocket.close(placement.MISPLACED_CLOSE_CODE, owner)
+        return
+
+    state = await drive_async(game_map(game_id, player_id))
+    if state is None or player_id not in state.nation_of:
+        await websocket.close(1008, "Not a player of this game")
+        return
+
+    connection = rooms.Connection(websocket, player_id)
+    game_rooms.join(game_id, connection)
+    try:
+        async for message in websocket:
+            action = protocol.decode(message)
+            if action is None:
+                connection.send(json.dumps({"error": "Invalid action"}))
+            elif not engine.submit(game_id, player_id, action):
+                connection.send(json.dumps({"error": "Too many pending actions"}))
+    finally:
+        game_rooms.leave(game_id, connection)
+        connection.close()
+
+
+async def drain():
+    """Hands this replica's games to the ones taking them over once it's gone
+
+    Games with nowhere to go, or whose handoff failed, are snapshotted to the DB instead.
+    """
+    await asyncio.to_thread(deregisterSelf)
+    remaining = ring.without(INSTANCE_ID)
+    games = maps.items()
+    targets = {game_id: remaining.owner(game_id) for game_id, state in games}
+    stubs = {target: replica_stub(target) for target in set(targets.values()) if target is not None}
+
+    movable = [(game_id, state) for game_id, state in games if targets[game_id] is not None]
+    failed = set(await handoff.hand_over_all(movable, targets, stubs, engine, game_rooms, ring))
+    for game_id, state in movable:
+        if game_id not in failed:
+            maps.remove(game_id)
+
+    homeless = [game_id for game_id, state in games if targets[game_id] is None]
+    for game_id in homeless:
+        engine.freeze(game_id)
+        history.resnapshot(game_id)
+    # Their players only go to the targets once they're saved
+    saved = await handoff.save_and_redirect([(game_id, state) for game_id, state in movable if game_id in failed],
+        targets, history, game_rooms, ring)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_SAVE_TIMEOUT
+    while not history.settled(homeless) and loop.time() < deadline:
+        await asyncio.sleep(action_log.FLUSH_INTERVAL)
+    logger.info(f"Drained, {len(movable) - len(failed)} games handed over, {len(saved)} of {len(failed)} others "
+                f"and {len(homeless)} with nowhere to go saved to the DB")
 
 
 async def websock():
-    async with websockets.serve(process_websocket, "0.0.0.0", 7500):
-        await asyncio.Future()
+    """Serves websockets and runs the game loops until stopped, then drains, in either mode"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    ticks = asyncio.create_task(engine.run())
+    sweeps = asyncio.create_task(hibernator.run())
+    moves = asyncio.create_task(rebalancer.run())
+    try:
+        async with websockets.serve(process_websocket, "0.0.0.0", 7500):
+            await stop.wait()
+            # The drain hands over every game, don't have the rebalancer move some at the same time
+            moves.cancel()
+            await drain()
+    finally:
+        ticks.cancel()
+        sweeps.cancel()
+        moves.cancel()
+
+
+def run_threaded():
+    """gRPC handlers on a thread pool, websockets on the main thread's event loop"""
+    grpcServer = serve()
+    try:
+        asyncio.run(websock())
+    finally:
+        grpcServer.stop(1)
+        pool.close()
+
+
+async def run_async():
+    """gRPC handlers, websockets and DB access all on one event loop"""
+    await pool.open()
+
+    server = grpc.aio.server()
+    addAllServicers(server, AsyncGameService(), AsyncHealthService())
+    server.add_insecure_port("[::]:7000")
+    await server.start()
+    logger.info("Async server up and running!")
+    try:
+        await websock()
+    finally:
+        await server.stop(1)
+        await pool.close()
 
 
 if __name__ == '__main__':
     INSTANCE_ID = os.environ.get("HOSTNAME")
     SERVICE_DISCOVERY_URL = os.environ.get("SERVICE_DISCOVERY_URL")
+    DATABASE_URL = os.getenv('DATABASE_URL')
+    # "threaded" or "async", both serve the same routes so they can be benchmarked side by side
+    SERVICE_MODE = os.getenv('GAME_SERVICE_MODE', "threaded")
 
     logger = logging.getLogger(__name__)
     logging.basicConfig(level=logging.INFO)
 
     start_http_server(7700)
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    conn.autocommit = True
-    cursor = conn.cursor()
-    check_db_tables()
+    with db.single_cursor(DATABASE_URL) as cursor:
+        check_db_tables(cursor)
+    lobby_cache.LobbyListener(DATABASE_URL, lobbies).start()
+    action_log.LogWriter(DATABASE_URL, history, maps).start()
+    placement.RingWatcher(SERVICE_DISCOVERY_URL, ring).start()
 
     registerSelf()
     # Deregister self if service is shut down
-    signal.signal(signal.SIGINT, signalHandler)
-    signal.signal(signal.SIGTERM, signalHandler)
     atexit.register(deregisterSelf)
 
-    grpcServer = serve()
-    asyncio.run(websock())
-    grpcServer.wait_for_termination()
-
-    cursor.close()
-    conn.close()
\ No newline at end of file
+    if SERVICE_MODE == "async":
+        pool = db.AsyncConnectionPool(DATABASE_URL, ASYNC_POOL_SIZE)
+        asyncio.run(run_async())
+    else:
+        pool = db.ConnectionPool(DATABASE_URL, MAX_WORKERS)
+        run_threaded()
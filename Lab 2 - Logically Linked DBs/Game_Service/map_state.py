@@ -0,0 +1,226 @@
+import io
+import time
+import uuid
+import threading
+
+import numpy as np
+
+import trade
+import units
+import diplomacy
+import world_map
+
+
+# Provinces are numbered 1 to PROVINCE_COUNT, stored at index ID - 1
+PROVINCE_COUNT = 400
+RESOURCE_TYPES = 8
+# Owner of provinces no nation holds
+NO_OWNER = -1
+
+STARTING_POPULATION = 10000
+# Unowned provinces start with a population in this range
+NATIVE_POPULATION = (1000, 5000)
+RESOURCE_YIELD = (0, 100)
+
+
+class MapState:
+    """Authoritative map of one game, one array entry per province
+
+    Nations are referred to by their index in `players`, the game's user IDs
+    in lobby join order. Per-nation figures come out in that same order.
+
+    Every tick that changes something bumps `version`, and each province and
+    nation remembers the version it last changed at, so readers can ask for
+    just what changed since a version they saw. Versions only mean something
+    within one `epoch`, i.e. this copy of the map.
+    """
+    def __init__(self, players, province_count = PROVINCE_COUNT, resource_types = RESOURCE_TYPES):
+        self.players = list(players)
+        self.nation_of = {player: nation for nation, player in enumerate(self.players)}
+        self.owner = np.full(province_count, NO_OWNER, dtype = np.int32)
+        self.population = np.zeros(province_count, dtype = np.int64)
+        self.resources = np.zeros((province_count, resource_types), dtype = np.int64)
+        # Last upgrade built in each province, 0 for none
+        self.upgrade = np.zeros(province_count, dtype = np.int32)
+        # Policy each nation currently follows, 0 for none
+        self.policy = np.zeros(len(self.players), dtype = np.int32)
+        # Resources each nation has in store, and its yearly trades as legs, see trade.py
+        self.stock = np.zeros((len(self.players), resource_types), dtype = np.int64)
+        self.standing = np.zeros((0, trade.LEG_COLUMNS), dtype = np.int32)
+        # Relation between each pair of nations, and the relation each one proposed to each other,
+        # see diplomacy.py. Alliance blocs are worked out from them
+        self.relations = np.zeros((len(self.players), len(self.players)), dtype = np.int8)
+        self.offers = np.zeros((len(self.players), len(self.players)), dtype = np.int8)
+        self.blocs = diplomacy.Blocs(self.relations)
+        self.units = units.Units()
+        # Seed of the game's dice, and rounds of combat fought so far, see combat.py
+        self.combat = np.zeros(2, dtype = np.int64)
+        # Held while a tick changes the map, so readers on other threads see whole ticks
+        self.lock = threading.Lock()
+
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.province_version = np.zeros(province_count, dtype = np.int32)
+        self.nation_version = np.zeros(len(self.players), dtype = np.int32)
+        self._changed = False
+        # Sequence number of the last action logged for this game, see action_log.py
+        self.log_seq = 0
+        # Last time the map was looked up, for hibernating the least recently used ones
+        self.touched = time.monotonic()
+
+    @classmethod
+    def generate(cls, game_id, players, world = None, province_count = PROVINCE_COUNT):
+        """Lays out a new map, the same one for a given game on every replica
+
+        Provinces yield what the `world` map says, or random amounts without one.
+        Each nation starts out with a single province, and a year of its yield in store.
+        """
+        if world is not None:
+            province_count = world.province_count
+        state = cls(players, province_count)
+        rng = np.random.default_rng(game_id)
+        state.population[:] = rng.integers(*NATIVE_POPULATION, size = province_count)
+        if world is not None:
+            state.resources[:] = world.base_yield
+            habitable = np.flatnonzero(world.terrain != world_map.LAKE)
+            state.population[world.terrain == world_map.LAKE] = 0
+        else:
+            state.resources[:] = rng.integers(*RESOURCE_YIELD, size = state.resources.shape)
+            habitable = province_count
+
+        capitals = rng.choice(habitable, size = len(state.players), replace = False)
+        state.owner[capitals] = np.arange(len(state.players))
+        state.population[capitals] = STARTING_POPULATION
+        state.stock[:] = state.nation_resources()
+        state.combat[0] = game_id
+        return state
+
+    # Arrays making up the game's state, the rest can be worked out from them
+    SAVED = ("owner", "population", "resources", "upgrade", "policy", "stock", "standing", "relations", "offers", "combat")
+
+    def dump(self):
+        """The map's arrays as bytes, for snapshots and handoffs
+
+        Each array is written in .npy format, one after the other in SAVED
+        order then the units', which reads back faster than an .npz archive.
+        """
+        buffer = io.BytesIO()
+        for name in self.SAVED:
+            np.lib.format.write_array(buffer, getattr(self, name), allow_pickle = False)
+        for array in self.units.arrays().values():
+            np.lib.format.write_array(buffer, array, allow_pickle = False)
+        return buffer.getvalue()
+
+    @classmethod
+    def load(cls, players, data):
+        """Rebuilds a map from dump()'s output, under a new epoch"""
+        buffer = io.BytesIO(data)
+        arrays = {name: np.lib.format.read_array(buffer, allow_pickle = False) for name in cls.SAVED}
+        state = cls(players, len(arrays["owner"]), arrays["resources"].shape[1])
+        for name in cls.SAVED:
+            # Copied, read_array's are views into the read-only data
+            setattr(state, name, arrays[name].copy())
+        state.blocs = diplomacy.Blocs(state.relations)
+        state.units = units.Units.from_arrays({name: np.lib.format.read_array(buffer, allow_pickle = False) for name in units.SAVED})
+        return state
+
+    def nbytes(self):
+        """Memory taken by the map's arrays"""
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray)) + self.units.nbytes()
+
+    def province_changed(self, provinces):
+        """Marks provinces (an index or array of indices) as changed in the version being built"""
+        self.province_version[provinces] = self.version + 1
+        self._changed = True
+
+    def nation_changed(self, nations):
+        self.nation_version[nations] = self.version + 1
+        self._changed = True
+
+    def unit_changed(self, slots):
+        self.units.version[slots] = self.version + 1
+        self._changed = True
+
+    def commit(self):
+        """Ends a tick's changes, bumping the version if there were any"""
+        if self._changed:
+            self.version += 1
+            self._changed = False
+
+    def changes_since(self, version):
+        """Indices of the provinces, nations and unit slots changed after `version`, None if a snapshot is needed"""
+        if not 0 <= version <= self.version:
+            return None
+        return (np.flatnonzero(self.province_version > version), np.flatnonzero(self.nation_version > version),
+            np.flatnonzero(self.units.version > version))
+
+    def nation_resources(self):
+        """Resource totals as a (nations, resource types) array"""
+        nations = len(self.players)
+        types = self.resources.shape[1]
+        # One bincount over (owner, resource type) bins, unowned provinces land in the owner -1 row
+        bins = (self.owner[:, None] + 1) * types + np.arange(types)
+        totals = np.bincount(bins.ravel(), weights = self.resources.ravel(), minlength = (nations + 1) * types)
+        return totals.reshape(nations + 1, types)[1:].astype(np.int64)
+
+    def summary(self):
+        """Population totals and held province IDs of each nation, as lists ready for a response"""
+        owned = np.flatnonzero(self.owner != NO_OWNER)
+        owners = self.owner[owned]
+        population = np.bincount(owners, weights = self.population[owned], minlength = len(self.players))
+
+        # Stable, so each nation's provinces stay in ID order
+        by_owner = (owned[np.argsort(owners, kind = "stable")] + 1).tolist()
+        ends = np.cumsum(np.bincount(owners, minlength = len(self.players))).tolist()
+        provinces = [by_owner[start:end] for start, end in zip([0] + ends, ends)]
+        return population.astype(np.int64).tolist(), provinces
+
+
+class GameMaps:
+    """Map states of the games played on this replica, by game ID
+
+    New games are laid out on the `world` map, if given.
+    """
+    def __init__(self, world = None):
+        self.world = world
+        self._lock = threading.Lock()
+        self._maps = {}
+
+    def get(self, game_id):
+        state = self._maps.get(game_id)
+        if state is not None:
+            state.touched = time.monotonic()
+        return state
+
+    def get_or_create(self, game_id, players, restore = None):
+        """Returns the game's map
+
+        If this replica doesn't have it yet, it's rebuilt with `restore(game_id)`
+        if given, or generated if that returns None too.
+        """
+        state = self.get(game_id)
+        if state is not None:
+            return state
+
+        # Restoring may take a while, don't hold up other games meanwhile
+        state = restore(game_id) if restore is not None else None
+        if state is None:
+            state = MapState.generate(game_id, players, self.world)
+        with self._lock:
+            return self._maps.setdefault(game_id, state)
+
+    def put(self, game_id, state):
+        """Sets the game's map, replacing any it had"""
+        with self._lock:
+            self._maps[game_id] = state
+
+    def items(self):
+        with self._lock:
+            return list(self._maps.items())
+
+    def remove(self, game_id):
+        with self._lock:
+            self._maps.pop(game_id, None)
+
+    def __len__(self):
+        return len(self._maps)
@@ -0,0 +1,221 @@
+"""Routes for units moving across the world map
+
+Provinces are the nodes of a graph kept in CSR form (see world_map.py), and
+moving into a province costs its terrain's MOVE_COSTS. Which terrain a unit
+can enter at all is a bitmask, bit t standing for terrain type t. Searches go
+back from the destination, with A* for single queries and one Dijkstra per
+destination for batches, then paths are cached per (origin, destination,
+mask) until the borders or the terrain change.
+
+Among cheapest paths, a path always steps to the lowest numbered neighbour it
+can, so it only depends on the map and the query: not on which search found
+it, nor on what was cached before, and games replayed or moved to another
+replica take the same paths. The rest of a path from any province along it is
+then that province's path too, so it's cached as well: units marching along a
+path don't search again at every step.
+"""
+import math
+import heapq
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+import world_map
+
+
+path_hits = Counter("game_service_path_cache_hits", "Paths served from the cache")
+path_misses = Counter("game_service_path_cache_misses", "Paths that had to be searched for")
+
+# Cost of moving into a province, by terrain
+MOVE_COSTS = (1, 2, 2, 3, 2, 3, 1)
+# Every terrain but lakes
+LAND = ((1 << world_map.TERRAIN_TYPES) - 1) & ~(1 << world_map.LAKE)
+CACHE_SIZE = 65536 # paths
+
+_default = None
+
+
+def mask_of(*terrains):
+    """Passability mask letting units into the given terrain types"""
+    mask = 0
+    for terrain in terrains:
+        mask |= 1 << terrain
+    return mask
+
+
+def default_finder():
+    """PathFinder over the world map at world_map.DEFAULT_PATH, made on first use"""
+    global _default
+    if _default is None:
+        _default = PathFinder(world_map.open_map())
+    return _default
+
+
+class PathFinder:
+    """Cheapest paths between provinces, by province index, with an LRU cache
+
+    Paths are tuples of province indices from the origin to the destination,
+    both included, or None if the destination can't be reached. Shared by every
+    game on the replica, the map being the same for all of them.
+    """
+    def __init__(self, world, max_entries = CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.max_entries = max_entries
+        self.update(world.adjacency_offsets, world.adjacency, world.terrain, world.coords)
+
+    def update(self, adjacency_offsets = None, adjacency = None, terrain = None, coords = None):
+        """Replaces the borders, terrain or province positions, and drops every cached path"""
+        with self._lock:
+            if adjacency_offsets is not None:
+                # Plain lists, indexing NumPy arrays one element at a time is a lot slower
+                self._offsets = adjacency_offsets.tolist()
+                self._adjacency = adjacency.tolist()
+            if terrain is not None:
+                self._terrain = terrain.tolist()
+                self._costs = [MOVE_COSTS[t] for t in self._terrain]
+            if coords is not None:
+                self._coords = [tuple(xy) for xy in coords.tolist()]
+            # The heuristic must never overestimate: no border is longer than the
+            # longest one, and no move is cheaper than the cheapest terrain
+            longest = max((math.dist(self._coords[u], self._coords[v])
+                for u in range(len(self._coords)) for v in self._adjacency[self._offsets[u]:self._offsets[u + 1]]), default = 1)
+            self._cost_per_distance = min(MOVE_COSTS) / longest
+            self._moves = {}
+            self._cache.clear()
+
+    def moves(self, mask):
+        """(neighbour, cost) pairs a unit with the passability mask can move to, from each province"""
+        moves = self._moves.get(mask)
+        if moves is None:
+            offsets, adjacency, costs, terrain = self._offsets, self._adjacency, self._costs, self._terrain
+            moves = self._moves[mask] = [
+                [(neighbour, costs[neighbour]) for neighbour in adjacency[offsets[province]:offsets[province + 1]] if mask >> terrain[neighbour] & 1]
+                for province in range(len(terrain))
+            ]
+        return moves
+
+    def path(self, origin, destination, mask = LAND):
+        key = (origin, destination, mask)
+        found = self._cached(key)
+        if found is not False:
+            return found
+        found = self._astar(origin, destination, mask)
+        self._store(key, found)
+        return found
+
+    def paths(self, queries):
+        """Paths for many (origin, destination, mask) queries at once, in the same order
+
+        Every destination is searched from once, however many origins it has.
+        """
+        found = {}
+        missing = {}
+        for key in queries:
+            if key in found:
+                continue
+            path = self._cached(key)
+            if path is False:
+                origin, destination, mask = key
+                missing.setdefault((destination, mask), set()).add(origin)
+            else:
+                found[key] = path
+
+        for (destination, mask), origins in missing.items():
+            costs_to = self._costs_to(destination, mask, origins)
+            moves = self.moves(mask)
+            for origin in origins:
+                key = (origin, destination, mask)
+                found[key] = path = self._follow(origin, destination, costs_to, moves)
+                self._store(key, path)
+        return [found[key] for key in queries]
+
+    def _cached(self, key):
+        """The cached path, False if there's none (None being a path too: there's no way through)"""
+        with self._lock:
+            path = self._cache.get(key, False)
+            if path is not False:
+                self._cache.move_to_end(key)
+        if path is False:
+            path_misses.inc()
+        else:
+            path_hits.inc()
+        return path
+
+    def _store(self, key, path):
+        origin, destination, mask = key
+        with self._lock:
+            self._cache[key] = path
+            if path is not None:
+                for i in range(1, len(path) - 1):
+                    self._cache[(path[i], destination, mask)] = path[i:]
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last = False)
+
+    def _astar(self, origin, destination, mask):
+        if origin == destination:
+            return (origin,)
+        coords = self._coords
+        start = coords[origin]
+        scale = self._cost_per_distance
+        costs_to = self._costs_to(destination, mask, (origin,), lambda province: math.dist(coords[province], start) * scale)
+        return self._follow(origin, destination, costs_to, self.moves(mask))
+
+    def _costs_to(self, destination, mask, origins, heuristic = None):
+        """Cost of the cheapest path from each province settled to the destination, None for the others
+
+        Searches back from the destination, with A* if given a heuristic (to the
+        origin), until the origins are settled along with every province that
+        can be on a cheapest path from one of them, for _follow to choose from.
+        """
+        terrain, costs, offsets, adjacency = self._terrain, self._costs, self._offsets, self._adjacency
+        costs_to = [None] * len(terrain)
+        best = [math.inf] * len(terrain)
+        best[destination] = 0
+        frontier = [(heuristic(destination) if heuristic else 0, 0, destination)]
+        waiting = set(origins)
+        # Estimates of provinces on a cheapest path are at most that of the last origin
+        # settled, give or take floating point error in the heuristic
+        bound = math.inf
+        while frontier:
+            estimate, spent, province = heapq.heappop(frontier)
+            if estimate > bound:
+                break
+            if costs_to[province] is not None:
+                # Settled already, more cheaply
+                continue
+            costs_to[province] = spent
+            if province in waiting:
+                waiting.discard(province)
+                if not waiting:
+                    bound = estimate + 1e-9
+            if not mask >> terrain[province] & 1:
+                # Can't be moved into, so no path goes on from here
+                continue
+            through = spent + costs[province]
+            for neighbour in adjacency[offsets[province]:offsets[province + 1]]:
+                if through < best[neighbour]:
+                    best[neighbour] = through
+                    heapq.heappush(frontier, (through + (heuristic(neighbour) if heuristic else 0), through, neighbour))
+        return costs_to
+
+    @staticmethod
+    def _follow(origin, destination, costs_to, moves):
+        """The path from the origin, stepping to the lowest numbered neighbour a cheapest path goes through
+
+        Which path that is depends on nothing but the origin, the destination and
+        the mask, whichever search settled the costs, and the rest of it from any
+        province along it is that province's path.
+        """
+        if costs_to[origin] is None:
+            return None
+        path = [origin]
+        province = origin
+        while province != destination:
+            left = costs_to[province]
+            # Neighbours come in increasing order
+            province = next(neighbour for neighbour, step in moves[province]
+                if costs_to[neighbour] is not None and costs_to[neighbour] + step == left)
+            path.append(province)
+        return tuple(path)
@@ -0,0 +1,101 @@
+"""Which Game Service replica each game belongs to
+
+Replicas take VNODES points each on a ring of 32 bit hashes, and a game
+belongs to the replica holding the first point at or after the hash of its ID.
+A replica joining or leaving only moves the games landing right before its
+points, about 1/N of them. Replicas advertise their points when registering
+with service discovery, the Gateway routes on the same ring.
+"""
+import time
+import bisect
+import hashlib
+import logging
+import threading
+
+import requests
+from prometheus_client import Gauge
+
+
+logger = logging.getLogger(__name__)
+
+ring_members = Gauge("game_service_ring_members", "Game Service replicas on the placement ring")
+
+# Points per replica, more spread games more evenly
+VNODES = 256
+POLL_INTERVAL = 5 # seconds
+# How long a game handed over by a draining replica stays with the replica it went to
+# regardless of the ring, long enough for every ring to have dropped the drained replica
+MOVE_TTL = 30 # seconds
+
+# Closes websockets of games owned by another replica, with the owner's host as the reason
+MISPLACED_CLOSE_CODE = 4421
+
+
+def token(key):
+    """Position of a key on the ring, first 4 bytes of the MD5 of its decimal form, as the Gateway does"""
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:4], "big")
+
+
+def tokens_for(instance, vnodes = VNODES):
+    return sorted(token(f"{instance}#{i}") for i in range(vnodes))
+
+
+class HashRing:
+    """Replicas' points on the ring, by replica host name
+
+    Games that moved during a drain can be pinned to a replica for a while,
+    until the rings have caught up with the replica that left.
+    """
+    def __init__(self, members = None):
+        self._moved = {}
+        self.update(members or {})
+
+    def update(self, members):
+        """Replaces the ring's members, a {host: tokens} dict"""
+        points = sorted((point, host) for host, tokens in members.items() for point in tokens)
+        # Swapped in whole, so lookups on other threads never see half a ring
+        self._points = ([point for point, host in points], [host for point, host in points])
+        self._members = dict(members)
+        self.members = set(members)
+
+    def without(self, host):
+        """The ring as it will be once a replica has left"""
+        return HashRing({member: tokens for member, tokens in self._members.items() if member != host})
+
+    def move(self, key, host, ttl = MOVE_TTL):
+        self._moved[key] = (host, time.monotonic() + ttl)
+
+    def owner(self, key):
+        """Host of the replica the key belongs to, None while the ring is empty"""
+        moved = self._moved.get(key)
+        if moved is not None:
+            if time.monotonic() < moved[1]:
+                return moved[0]
+            self._moved.pop(key, None)
+
+        points, hosts = self._points
+        if not points:
+            return None
+        return hosts[bisect.bisect_left(points, token(key)) % len(hosts)]
+
+
+class RingWatcher(threading.Thread):
+    """Keeps a HashRing in line with the replicas registered with service discovery
+
+    The old ring is kept while discovery can't be reached.
+    """
+    def __init__(self, discovery_url, ring):
+        super().__init__(daemon = True)
+        self.discovery_url = discovery_url
+        self.ring = ring
+
+    def run(self):
+        while True:
+            try:
+                response = requests.get(f"{self.discovery_url}/placement", timeout = POLL_INTERVAL)
+                response.raise_for_status()
+                self.ring.update({entry["host"]: entry["tokens"] for entry in response.json().values()})
+                ring_members.set(len(self.ring.members))
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.info(f"Couldn't refresh the placement ring: {e}")
+            time.sleep(POLL_INTERVAL)
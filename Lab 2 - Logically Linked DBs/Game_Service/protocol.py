@@ -0,0 +1,198 @@
+"""Decoding the players' websocket actions
+
+Binary frames start with a fixed 16 byte header, all little-endian:
+
+    actionID  uint8
+    flags     uint8   bit 0 is yearlyRate, for trades
+    count     uint16  length of the first pair of arrays (trade send items, units, move orders)
+    count2    uint16  length of the second pair (trade get items)
+    (padding) uint16
+    first     int32   policyID, provinceID or targetPlayer
+    second    int32   upgradeID or diploID
+
+followed by the action's int32 arrays back to back, or by the UTF-8 body of a
+chat message. Arrays are decoded as NumPy views into the frame, not copied.
+Text frames are JSON as in the README, checked against schemas compiled at import.
+"""
+import json
+import struct
+
+import numpy as np
+import jsonschema
+
+from actions import YEAR_END, MARCH, POLICY, UPGRADE, DIPLOMACY, TRADE, UNITS, CHAT, MOVE
+
+
+HEADER = struct.Struct("<BBHHxxii")
+YEARLY_RATE = 0x1
+INT32 = np.dtype("<i4")
+
+# Longest arrays and chat messages accepted, either way
+MAX_ITEMS = 256
+MAX_MESSAGE = 1000
+
+
+def _schema(**fields):
+    # actionID itself isn't checked, it's what picks the schema
+    return {"type": "object", "properties": fields, "required": list(fields)}
+
+_int = {"type": "integer", "minimum": -2**31, "maximum": 2**31 - 1}
+_ints = {"type": "array", "items": _int, "maxItems": MAX_ITEMS}
+
+SCHEMAS = {
+    POLICY: _schema(policyID = _int),
+    UPGRADE: _schema(provinceID = _int, upgradeID = _int),
+    DIPLOMACY: _schema(targetPlayer = _int, diploID = _int),
+    TRADE: _schema(targetPlayer = _int, tradeSendItems = _ints, tradeSendQty = _ints,
+        tradeGetItems = _ints, tradeGetQty = _ints, yearlyRate = {"type": "boolean"}),
+    UNITS: _schema(unitTypes = _ints, unitIDs = _ints),
+    CHAT: _schema(targetPlayer = _int, messageBody = {"type": "string", "maxLength": MAX_MESSAGE}),
+    MOVE: _schema(unitIDs = _ints, provinceIDs = _ints)
+}
+
+# Arrays that go together item by item, so must be just as long
+PAIRS = {
+    TRADE: (("tradeSendItems", "tradeSendQty"), ("tradeGetItems", "tradeGetQty")),
+    UNITS: (("unitTypes", "unitIDs"),),
+    MOVE: (("unitIDs", "provinceIDs"),)
+}
+
+# One validator per action, so each message is only checked against its own schema
+VALIDATORS = {}
+for action_id, schema in SCHEMAS.items():
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    VALIDATORS[action_id] = validator_class(schema)
+
+
+def decode_json(message):
+    """Decodes a JSON action, None if it isn't a valid one"""
+    try:
+        action = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(action, dict) or type(action.get("actionID")) is not int:
+        return None
+    validator = VALIDATORS.get(action["actionID"])
+    if validator is None or not validator.is_valid(action):
+        return None
+    for first, second in PAIRS.get(action["actionID"], ()):
+        if len(action[first]) != len(action[second]):
+            return None
+    return action
+
+
+def _arrays(body, counts):
+    # Views into the frame, one per count
+    if len(body) != sum(counts) * INT32.itemsize:
+        return None
+    values = np.frombuffer(body, dtype = INT32)
+    ends = np.cumsum(counts).tolist()
+    return [values[end - count:end] for count, end in zip(counts, ends)]
+
+
+def decode_binary(frame):
+    """Decodes a binary action, None if it isn't a valid one"""
+    view = memoryview(frame)
+    if len(view) < HEADER.size:
+        return None
+    action_id, flags, count, count2, first, second = HEADER.unpack_from(view)
+    body = view[HEADER.size:]
+
+    if action_id in (YEAR_END, MARCH, POLICY, UPGRADE, DIPLOMACY):
+        if body:
+            return None
+        if action_id in (YEAR_END, MARCH):
+            # Only logged, players sending them have them dropped by actions.apply_batch
+            return {"actionID": action_id}
+        if action_id == POLICY:
+            return {"actionID": POLICY, "policyID": first}
+        if action_id == UPGRADE:
+            return {"actionID": UPGRADE, "provinceID": first, "upgradeID": second}
+        return {"actionID": DIPLOMACY, "targetPlayer": first, "diploID": second}
+
+    if action_id == TRADE:
+        if max(count, count2) > MAX_ITEMS:
+            return None
+        arrays = _arrays(body, (count, count, count2, count2))
+        if arrays is None:
+            return None
+        return {
+            "actionID": TRADE,
+            "targetPlayer": first,
+            "tradeSendItems": arrays[0],
+            "tradeSendQty": arrays[1],
+            "tradeGetItems": arrays[2],
+            "tradeGetQty": arrays[3],
+            "yearlyRate": bool(flags & YEARLY_RATE)
+        }
+
+    if action_id == UNITS:
+        if count > MAX_ITEMS:
+            return None
+        arrays = _arrays(body, (count, count))
+        if arrays is None:
+            return None
+        return {"actionID": UNITS, "unitTypes": arrays[0], "unitIDs": arrays[1]}
+
+    if action_id == MOVE:
+        if count > MAX_ITEMS:
+            return None
+        arrays = _arrays(body, (count, count))
+        if arrays is None:
+            return None
+        return {"actionID": MOVE, "unitIDs": arrays[0], "provinceIDs": arrays[1]}
+
+    if action_id == CHAT:
+        try:
+            message = str(body, "utf-8")
+        except UnicodeDecodeError:
+            return None
+        if len(message) > MAX_MESSAGE:
+            return None
+        return {"actionID": CHAT, "targetPlayer": first, "messageBody": message}
+
+    return None
+
+
+def decode(message):
+    """Decodes a websocket message, binary frames arrive as bytes and text ones as str"""
+    if isinstance(message, str):
+        return decode_json(message)
+    return decode_binary(message)
+
+
+def encode_binary(action):
+    """Packs an action into a binary frame, as clients would"""
+    action_id = action["actionID"]
+    flags, count, count2, first, second = 0, 0, 0, 0, 0
+    body = b""
+    if action_id == POLICY:
+        first = action["policyID"]
+    elif action_id == UPGRADE:
+        first, second = action["provinceID"], action["upgradeID"]
+    elif action_id == DIPLOMACY:
+        first, second = action["targetPlayer"], action["diploID"]
+    elif action_id == TRADE:
+        first = action["targetPlayer"]
+        flags = YEARLY_RATE if action["yearlyRate"] else 0
+        count, count2 = len(action["tradeSendItems"]), len(action["tradeGetItems"])
+        arrays = [action[field] for field in ("tradeSendItems", "tradeSendQty", "tradeGetItems", "tradeGetQty")]
+        body = np.concatenate(arrays).astype(INT32).tobytes()
+    elif action_id == UNITS:
+        count = len(action["unitTypes"])
+        body = np.concatenate([action["unitTypes"], action["unitIDs"]]).astype(INT32).tobytes()
+    elif action_id == MOVE:
+        count = len(action["unitIDs"])
+        body = np.concatenate([action["unitIDs"], action["provinceIDs"]]).astype(INT32).tobytes()
+    elif action_id == CHAT:
+        first = action["targetPlayer"]
+        body = action["messageBody"].encode()
+    return HEADER.pack(action_id, flags, count, count2, first, second) + body
+
+
+def to_json(value):
+    """json.dumps default for the NumPy arrays in binary decoded actions"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
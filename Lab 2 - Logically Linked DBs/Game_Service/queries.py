@@ -0,0 +1,117 @@
+# SQL shared by the threaded (psycopg2) and async (psycopg 3) servicers
+# Both drivers use the same %s placeholder style
+# The hot ones are registered as prepared statements, see statements.py
+
+from statements import prepared
+
+# Keyset pagination, pages pick up after the last ID of the previous one
+# Fetches one row more than a page, to know whether there's a next page
+GET_LOBBIES = prepared("get_lobbies", """SELECT id, name, member_count, max_members, status FROM lobby_tbl
+    WHERE status != 0 AND id > %(after)s AND starts_with(name, %(prefix)s)
+    ORDER BY id LIMIT %(limit)s + 1""")
+
+# Within lobby_free_slots_idx's conditions, so only lobbies with free slots are scanned
+GET_FREE_LOBBIES = prepared("get_free_lobbies", """SELECT id, name, member_count, max_members, status FROM lobby_tbl
+    WHERE status = 1 AND member_count < max_members
+        AND id > %(after)s AND starts_with(name, %(prefix)s)
+    ORDER BY id LIMIT %(limit)s + 1""")
+
+# Used to fill and refresh the in-memory lobby list
+GET_OPEN_LOBBIES = "SELECT id, name, member_count, max_members, status FROM lobby_tbl WHERE status != 0"
+
+GET_LOBBY_ROWS = "SELECT id, name, member_count, max_members, status FROM lobby_tbl WHERE status != 0 AND id = ANY(%s)"
+
+GET_LOBBY = prepared("get_lobby", """SELECT name, member_count, max_members,
+        ARRAY(SELECT user_id FROM lobby_members WHERE lobby_id = lobby_tbl.id ORDER BY joined_at, user_id), status
+    FROM lobby_tbl WHERE status!=0 AND id=%s""")
+
+# Returns the ID of the new lobby
+MAKE_LOBBY = prepared("make_lobby", """WITH lobby AS (
+        INSERT INTO lobby_tbl (name, member_count, max_members, status)
+        VALUES (%(name)s, 1, %(max)s, 1)
+        RETURNING id
+    )
+    INSERT INTO lobby_members (lobby_id, user_id) SELECT id, %(user)s FROM lobby
+    RETURNING lobby_id""")
+
+# Joins and leaves lock the lobby row in the first CTE, so concurrent calls queue up on it
+# and each one checks capacity against the member count left by the previous one
+# Returns no row if the lobby doesn't exist, otherwise the new member count
+# and whether the user is in the lobby (it's full or its game started if they aren't)
+JOIN_LOBBY = prepared("join_lobby", """WITH target AS (
+        SELECT id, name, member_count, max_members, status FROM lobby_tbl
+        WHERE id = %(lobby)s AND status != 0
+        FOR UPDATE
+    ), joined AS (
+        INSERT INTO lobby_members (lobby_id, user_id)
+        SELECT id, %(user)s FROM target WHERE status = 1 AND member_count < max_members
+        ON CONFLICT DO NOTHING
+        RETURNING lobby_id
+    ), counted AS (
+        UPDATE lobby_tbl SET member_count = lobby_tbl.member_count + 1
+        FROM joined
+        WHERE lobby_tbl.id = joined.lobby_id
+        RETURNING lobby_tbl.member_count
+    )
+    SELECT name, COALESCE((SELECT member_count FROM counted), member_count), max_members,
+        EXISTS (SELECT 1 FROM counted)
+        OR EXISTS (SELECT 1 FROM lobby_members WHERE lobby_id = %(lobby)s AND user_id = %(user)s)
+    FROM target""")
+
+# Deletes the lobby instead when the last member leaves
+# Returns no row if the lobby doesn't exist, otherwise the remaining member count
+LEAVE_LOBBY = prepared("leave_lobby", """WITH target AS (
+        SELECT id, member_count FROM lobby_tbl
+        WHERE id = %(lobby)s AND status != 0
+        FOR UPDATE
+    ), removed AS (
+        DELETE FROM lobby_members USING target
+        WHERE lobby_members.lobby_id = target.id AND lobby_members.user_id = %(user)s
+        RETURNING lobby_members.lobby_id
+    ), emptied AS (
+        DELETE FROM lobby_tbl USING target, removed
+        WHERE lobby_tbl.id = target.id AND target.member_count <= 1
+    ), counted AS (
+        UPDATE lobby_tbl SET member_count = target.member_count - 1
+        FROM target, removed
+        WHERE lobby_tbl.id = target.id AND target.member_count > 1
+    )
+    SELECT member_count - (SELECT count(*) FROM removed) FROM target""")
+
+DELETE_LOBBY = "DELETE FROM lobby_tbl WHERE id = %s;"
+
+# Also returns the players, in the order they joined
+END_GAME = """UPDATE lobby_tbl SET status = -1 WHERE id = %s
+    RETURNING status, ARRAY(SELECT user_id FROM lobby_members WHERE lobby_id = lobby_tbl.id ORDER BY joined_at, user_id)"""
+
+# Lobbies are open (1) until their game's map is laid out, which locks the roster (2),
+# the map having a nation for each player already in. Run before reading the roster
+# with GET_LOBBY: joins wait for the row lock, so the roster read afterwards is final.
+# Only ever run for one of the lobby's players
+START_GAME = "UPDATE lobby_tbl SET status = 2 WHERE id = %s AND status = 1"
+
+# A continued game keeps its roster
+CONTINUE_GAME = "UPDATE lobby_tbl SET status = 2 WHERE id = %s RETURNING status"
+
+# Game persistence, see action_log.py
+# Logged actions are binary frames (protocol.encode_binary), seq counts up per game
+LOG_ACTIONS = """INSERT INTO game_actions (game_id, seq, tick, player_id, action)
+    SELECT * FROM unnest(%s::integer[], %s::bigint[], %s::integer[], %s::integer[], %s::bytea[])
+    ON CONFLICT DO NOTHING"""
+
+# Only the latest snapshot of a game is kept, a late one from a replica the game moved
+# away from never replaces a newer one
+SAVE_SNAPSHOT = """INSERT INTO game_snapshots (game_id, seq, players, state) VALUES (%(game)s, %(seq)s, %(players)s, %(state)s)
+    ON CONFLICT (game_id) DO UPDATE SET seq = EXCLUDED.seq, players = EXCLUDED.players,
+        state = EXCLUDED.state, taken_at = now()
+    WHERE game_snapshots.seq <= EXCLUDED.seq"""
+
+# Actions the snapshot already includes
+COMPACT_ACTIONS = "DELETE FROM game_actions WHERE game_id = %s AND seq <= %s"
+
+GET_SNAPSHOT = "SELECT seq, players, state FROM game_snapshots WHERE game_id = %s"
+
+GET_LOGGED_ACTIONS = "SELECT seq, tick, player_id, action FROM game_actions WHERE game_id = %s AND seq > %s ORDER BY seq"
+
+FORGET_GAME = """WITH snapshot AS (DELETE FROM game_snapshots WHERE game_id = %(game)s)
+    DELETE FROM game_actions WHERE game_id = %(game)s"""
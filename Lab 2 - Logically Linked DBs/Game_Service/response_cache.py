@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+
+response_hits = Counter("game_service_response_cache_hits", "Responses served already serialized", ["route"])
+response_misses = Counter("game_service_response_cache_misses", "Responses that had to be built and serialized", ["route"])
+
+
+class ResponseCache:
+    """LRU cache of serialized responses, keyed by route and serialized request
+
+    Each entry remembers the data version it was built from and only
+    gets served while the caller still asks for that same version.
+    """
+    def __init__(self, max_entries):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, route, request_bytes, version):
+        key = (route, request_bytes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                response_misses.labels(route).inc()
+                return None
+            self._entries.move_to_end(key)
+        response_hits.labels(route).inc()
+        return entry[1]
+
+    def put(self, route, request_bytes, version, data):
+        with self._lock:
+            self._entries[(route, request_bytes)] = (version, data)
+            self._entries.move_to_end((route, request_bytes))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
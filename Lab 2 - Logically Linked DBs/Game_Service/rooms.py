@@ -0,0 +1,106 @@
+import asyncio
+
+import websockets
+from prometheus_client import Counter, Gauge
+
+
+room_connections = Gauge("game_service_room_connections", "Websockets currently in a game's room")
+messages_dropped = Counter("game_service_room_messages_dropped", "Messages dropped because a client couldn't keep up")
+slow_disconnects = Counter("game_service_room_slow_disconnects", "Clients disconnected because they couldn't keep up")
+
+# Messages waiting to be written to one websocket, at most
+SEND_QUEUE_SIZE = 256
+
+# What happens to a client whose send queue is full:
+# DROP loses its oldest waiting message, DISCONNECT closes the websocket
+# so the client reconnects and fetches the game state again
+DROP = "drop"
+DISCONNECT = "disconnect"
+# "Try again later"
+SLOW_CLOSE_CODE = 1013
+
+
+class Connection:
+    """A player's websocket with its own bounded send queue
+
+    Sending only queues the message, a writer task per connection writes
+    them out, so one slow client never holds up sending to the others.
+    """
+    def __init__(self, websocket, player_id, queue_size = SEND_QUEUE_SIZE, policy = DISCONNECT):
+        self.websocket = websocket
+        self.player_id = player_id
+        self.policy = policy
+        self.closed = False
+        self._queue = asyncio.Queue(maxsize = queue_size)
+        self._writer = asyncio.create_task(self._write())
+        self._closing = None
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == DROP:
+            self._queue.get_nowait()
+            self._queue.put_nowait(message)
+            messages_dropped.inc()
+        else:
+            slow_disconnects.inc()
+            self.close()
+            self._closing = asyncio.create_task(self.websocket.close(SLOW_CLOSE_CODE, "Too slow to keep up with the game"))
+
+    async def _write(self):
+        try:
+            while True:
+                await self.websocket.send(await self._queue.get())
+        except websockets.ConnectionClosed:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self._writer.cancel()
+
+
+class Rooms:
+    """The connections of every game played on this replica, by game ID"""
+    def __init__(self):
+        self._rooms = {}
+
+    def join(self, game_id, connection):
+        self._rooms.setdefault(game_id, set()).add(connection)
+        room_connections.inc()
+
+    def leave(self, game_id, connection):
+        room = self._rooms.get(game_id)
+        if room is None or connection not in room:
+            return
+        room.remove(connection)
+        room_connections.dec()
+        if not room:
+            del self._rooms[game_id]
+
+    def broadcast(self, game_id, message):
+        """Queues an already encoded message for everyone in the game"""
+        for connection in self._rooms.get(game_id, ()):
+            connection.send(message)
+
+    def send_to(self, game_id, player_ids, message):
+        """Queues an already encoded message for some of the game's players"""
+        for connection in self._rooms.get(game_id, ()):
+            if connection.player_id in player_ids:
+                connection.send(message)
+
+    async def close(self, game_id, code, reason):
+        """Closes every websocket in the game's room, messages still waiting are dropped"""
+        room = self._rooms.pop(game_id, set())
+        room_connections.dec(len(room))
+        for connection in room:
+            connection.close()
+        await asyncio.gather(*(connection.websocket.close(code, reason) for connection in room), return_exceptions = True)
+
+    def size(self, game_id):
+        return len(self._rooms.get(game_id, ()))
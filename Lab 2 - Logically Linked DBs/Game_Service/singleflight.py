@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+from prometheus_client import Counter
+
+
+flight_calls = Counter("game_service_singleflight_calls", "Reads that went through request coalescing", ["route"])
+flight_shared = Counter("game_service_singleflight_shared", "Reads answered by another caller's in-flight query", ["route"])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets concurrent identical reads share one in-flight call
+
+    The first caller of a key runs the function, callers arriving with the
+    same key while it runs wait for and get its result (or exception).
+    Nothing is kept once the call returns, so results are never older than
+    a call that was already running when the caller arrived.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, route, key, func):
+        flight_calls.labels(route).inc()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            flight_shared.labels(route).inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop
+
+    The shared call runs as its own task, so a caller giving up (e.g. a
+    cancelled RPC) doesn't cancel it for everyone else.
+    """
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, route, key, func):
+        flight_calls.labels(route).inc()
+        task = self._calls.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            flight_shared.labels(route).inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
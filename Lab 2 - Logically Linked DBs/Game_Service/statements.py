@@ -0,0 +1,82 @@
+"""Server-side prepared statements for the hot queries
+
+psycopg2 can't prepare statements itself, so registered queries get a
+PREPARE the first time they run on a connection and an EXECUTE by name
+from then on. The names a connection has prepared are kept on the
+connection, so a reconnect simply prepares them again on first use.
+
+psycopg 3 keeps its own per-connection cache of prepared statements,
+the async servicer only has to ask for registered queries to go in it.
+"""
+import re
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from prometheus_client import Counter
+
+
+statement_prepares = Counter("game_service_statement_prepares", "Statements prepared on a DB connection", ["statement"])
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s")
+
+# SQL text -> (name, PREPARE statement, EXECUTE statement, parameter keys in $n order)
+_statements = {}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements it has prepared"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def prepared(name, sql):
+    """Registers `sql` to be run as the prepared statement `name`, returns the SQL unchanged
+
+    Named placeholders become $n in order of first use, plain %s ones in order.
+    Parameter types are left for Postgres to infer from the query.
+    """
+    keys = []
+    def number(match):
+        key = match.group(1) or len(keys)
+        if key not in keys:
+            keys.append(key)
+        return f"${keys.index(key) + 1}"
+
+    body = PLACEHOLDER.sub(number, sql)
+    run = f"EXECUTE {name}"
+    if keys:
+        run += f" ({', '.join(['%s'] * len(keys))})"
+    _statements[sql] = (name, f"PREPARE {name} AS {body}", run, keys)
+    return sql
+
+
+def execute(cursor, sql, params = None):
+    """Runs `sql` on a psycopg2 cursor, by name if it's a registered statement"""
+    statement = _statements.get(sql)
+    conn = cursor.connection
+    if statement is None or not isinstance(conn, PreparingConnection):
+        cursor.execute(sql, params)
+        return
+
+    name, prepare, run, keys = statement
+    args = [params[key] for key in keys]
+    for attempt in range(2):
+        if name not in conn.prepared:
+            cursor.execute(prepare)
+            conn.prepared.add(name)
+            statement_prepares.labels(name).inc()
+        try:
+            cursor.execute(run, args)
+            return
+        except psycopg2.errors.InvalidSqlStatementName:
+            # The server forgot it (e.g. DISCARD ALL), prepare it again
+            conn.prepared.discard(name)
+            if attempt:
+                raise
+
+
+async def execute_async(cursor, sql, params = None):
+    """Runs `sql` on a psycopg 3 cursor, registered statements get prepared on first use"""
+    await cursor.execute(sql, params, prepare = True if sql in _statements else None)
@@ -0,0 +1,179 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+from prometheus_client import Counter, Gauge, Histogram
+
+import actions
+
+
+logger = logging.getLogger(__name__)
+
+tick_duration = Histogram("game_service_tick_seconds", "Time taken to apply one tick across all games",
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+queue_depth = Gauge("game_service_tick_queue_depth", "Actions waiting for a tick, across all games")
+game_queue_depth = Histogram("game_service_tick_game_queue_depth", "Actions a game had waiting at the start of a tick",
+    buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+ticks_skipped = Counter("game_service_ticks_skipped", "Ticks skipped after falling too far behind")
+actions_rejected = Counter("game_service_tick_actions_rejected", "Actions refused because their game's queue was full")
+
+TICK_RATE = 10 # ticks per second
+# Running further behind than this many ticks skips them, instead of running them back to back
+MAX_CATCH_UP = 5
+# Actions applied per game in one tick, the rest wait for the next one,
+# so a busy game can't make the tick late for everyone else
+MAX_ACTIONS_PER_TICK = 64
+# Actions a game can have waiting before new ones get refused
+MAX_QUEUED = 1024
+# A game-year lasts a minute at TICK_RATE, each game ends it with a YEAR_END event
+TICKS_PER_YEAR = 600
+YEAR_END = (actions.GAME, {"actionID": actions.YEAR_END})
+# Units with orders take a step towards their destination, then battles are fought, this often, with a MARCH event
+MARCH_TICKS = 10
+MARCH = (actions.GAME, {"actionID": actions.MARCH})
+
+
+class TickEngine:
+    """Applies the players' actions to every game's map in batches, at a fixed rate
+
+    Actions are queued per game as they arrive and applied at the next tick, in
+    arrival order. `publish(game_id, tick, applied)` is called with the actions
+    that took effect in each game, and they're recorded in `log` (an
+    action_log.ActionLog) if given. Game-years end, and units march, on the
+    same ticks for every game on the replica, with events applied, published
+    and logged like the players' actions, each as a batch of its own after
+    theirs, which replaying the log relies on. Both queuing and ticks run on
+    the event loop serving the websockets.
+    """
+    def __init__(self, maps, publish, log = None, tick_rate = TICK_RATE):
+        self.maps = maps
+        self.publish = publish
+        self.log = log
+        self.interval = 1 / tick_rate
+        self.tick = 0
+        self.year = 0
+        # Only games with actions waiting have a queue
+        self._queues = {}
+        self._queued = 0
+        # Games being handed to another replica, see freeze()
+        self._frozen = set()
+        self._loop = None
+
+    def submit(self, game_id, player_id, action):
+        """Queues an action for the next tick, returns False if the game has too many waiting"""
+        if game_id in self._frozen:
+            actions_rejected.inc()
+            return False
+        queue = self._queues.get(game_id)
+        if queue is None:
+            queue = self._queues[game_id] = deque()
+        elif len(queue) >= MAX_QUEUED:
+            actions_rejected.inc()
+            return False
+
+        queue.append((player_id, action))
+        self._queued += 1
+        queue_depth.set(self._queued)
+        return True
+
+    def submit_threadsafe(self, game_id, player_id, action):
+        """Queues an action from outside the engine's event loop, without waiting to see if it fit"""
+        if self._loop is None:
+            self.submit(game_id, player_id, action)
+        else:
+            self._loop.call_soon_threadsafe(self.submit, game_id, player_id, action)
+
+    def pending(self, game_id):
+        """Whether the game has actions waiting for a tick"""
+        return game_id in self._queues
+
+    def freeze(self, game_id):
+        """Stops the game's actions from being applied or queued, returns the ones still waiting
+
+        Called from the event loop, so always between two ticks.
+        """
+        self._frozen.add(game_id)
+        queue = self._queues.pop(game_id, ())
+        self._queued -= len(queue)
+        queue_depth.set(self._queued)
+        return list(queue)
+
+    def thaw(self, game_id):
+        """Lets a frozen game's actions be queued again, once its map left this replica"""
+        self._frozen.discard(game_id)
+
+    def step(self):
+        """Runs one tick"""
+        start = time.perf_counter()
+        self.tick += 1
+        for game_id in list(self._queues):
+            queue = self._queues[game_id]
+            game_queue_depth.observe(len(queue))
+            state = self.maps.get(game_id)
+            if state is None:
+                # The game was closed meanwhile
+                batch = []
+                self._queued -= len(queue)
+                queue.clear()
+            else:
+                batch = [queue.popleft() for i in range(min(len(queue), MAX_ACTIONS_PER_TICK))]
+                self._queued -= len(batch)
+            if not queue:
+                del self._queues[game_id]
+            if batch:
+                self._apply(game_id, state, batch)
+
+        # Skipped ticks can't skip a year end, though several skipped years only make one
+        if self.tick // TICKS_PER_YEAR > self.year:
+            self.year = self.tick // TICKS_PER_YEAR
+            self.end_year()
+        if self.tick % MARCH_TICKS == 0:
+            self.march()
+        queue_depth.set(self._queued)
+        tick_duration.observe(time.perf_counter() - start)
+
+    def end_year(self):
+        """Ends the game-year in every game on the replica, but those being handed over"""
+        for game_id, state in self.maps.items():
+            if game_id not in self._frozen:
+                self._apply(game_id, state, [YEAR_END])
+
+    def march(self):
+        """Moves units and fights battles in every game with units marching or fighting, but those being handed over"""
+        for game_id, state in self.maps.items():
+            if game_id not in self._frozen and (state.units.marching() or state.units.fighting):
+                self._apply(game_id, state, [MARCH])
+
+    def _apply(self, game_id, state, batch):
+        try:
+            with state.lock:
+                applied = actions.apply_batch(state, batch)
+                state.commit()
+                if applied and self.log is not None:
+                    self.log.record(game_id, state, self.tick, applied)
+            if applied:
+                self.publish(game_id, self.tick, applied)
+        except Exception:
+            # Don't let one game's bug stop every other game
+            logger.exception(f"Tick {self.tick} failed for game {game_id}")
+
+    async def run(self):
+        loop = self._loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            now = loop.time()
+            if now < next_tick:
+                await asyncio.sleep(next_tick - now)
+            else:
+                behind = int((now - next_tick) / self.interval)
+                if behind > MAX_CATCH_UP:
+                    # Too late to catch up, game time jumps ahead instead
+                    ticks_skipped.inc(behind)
+                    self.tick += behind
+                    next_tick += behind * self.interval
+                # Catching up, let the websockets in between ticks
+                await asyncio.sleep(0)
+
+            self.step()
+            next_tick += self.interval
@@ -0,0 +1,220 @@
+"""Units of a game (actionID 5), as parallel arrays with a free list
+
+A unit is a slot across every array in FIELDS, 23 bytes with its free list
+entry, no more than twice that counting the room the arrays grew ahead. When
+a unit is gone its slot goes back on the free list, for the next unit raised
+to reuse, and the arrays only grow when the free list runs out. Units are
+looked up, moved and updated in bulk with array operations.
+
+Players refer to their units by the IDs they gave them when raising them
+(`tag`), unique among a player's units, while the Game Service uses slots.
+"""
+import numpy as np
+
+import world_map
+import pathfinding
+
+
+NO_OWNER = -1
+NO_ORDERS = -1
+
+INFANTRY = 0
+CAVALRY = 1
+ARTILLERY = 2
+# Strength units are raised with, and the terrain they can enter, by type
+STRENGTH = np.array([100, 80, 150], dtype = np.int32)
+PASSABLE = (
+    pathfinding.LAND,
+    pathfinding.mask_of(world_map.PLAINS, world_map.FOREST, world_map.HILLS, world_map.DESERT),
+    pathfinding.mask_of(world_map.PLAINS, world_map.FOREST, world_map.HILLS, world_map.DESERT, world_map.MARSH)
+)
+
+# Name, dtype and value of free slots
+FIELDS = (
+    ("type", np.int8, 0),
+    ("owner", np.int16, NO_OWNER),
+    ("province", np.int16, 0),
+    ("strength", np.int32, 0),
+    # Province the unit was ordered to, NO_ORDERS if it stays put
+    ("orders", np.int16, NO_ORDERS),
+    ("tag", np.int32, 0),
+    # MapState version the unit last changed at
+    ("version", np.int32, 0)
+)
+# Fields kept in snapshots, versions only mean something in memory
+SAVED = tuple(name for name, dtype, empty in FIELDS if name != "version")
+INITIAL_CAPACITY = 64
+# Slots a game can have at most, province and owner fields being narrow anyway
+MAX_UNITS = 2**20
+
+
+class Units:
+    """Every unit of one game, free slots having NO_OWNER"""
+    def __init__(self, capacity = INITIAL_CAPACITY):
+        for name, dtype, empty in FIELDS:
+            setattr(self, name, np.full(capacity, empty, dtype = dtype))
+        # Stack of free slots, the lowest on top so units stay packed at the front
+        self._free = np.arange(capacity - 1, -1, -1, dtype = np.int32)
+        self._free_count = capacity
+        # Whether units may be fighting, for combat.py to check at the next march
+        self.fighting = False
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Units from their SAVED arrays, by name"""
+        units = cls(len(arrays["owner"]))
+        for name in SAVED:
+            getattr(units, name)[:] = arrays[name]
+        free = np.flatnonzero(units.owner == NO_OWNER)[::-1]
+        units._free[:len(free)] = free
+        units._free_count = len(free)
+        units.fighting = True
+        return units
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in SAVED}
+
+    @property
+    def capacity(self):
+        return len(self.owner)
+
+    def __len__(self):
+        return self.capacity - self._free_count
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, dtype, empty in FIELDS) + self._free.nbytes
+
+    def add(self, types, owner, provinces, tags):
+        """Takes slots off the free list for new units, returns them, None if the game is full"""
+        count = len(types)
+        if count > self._free_count and not self._grow(count - self._free_count):
+            return None
+        slots = self._free[self._free_count - count:self._free_count][::-1].copy()
+        self._free_count -= count
+        self.type[slots] = types
+        self.owner[slots] = owner
+        self.province[slots] = provinces
+        self.strength[slots] = STRENGTH[types]
+        self.orders[slots] = NO_ORDERS
+        self.tag[slots] = tags
+        self.fighting = True
+        return slots
+
+    def remove(self, slots):
+        """Puts the slots back on the free list"""
+        slots = np.asarray(slots, dtype = np.int32)
+        for name, dtype, empty in FIELDS:
+            if name in SAVED:
+                getattr(self, name)[slots] = empty
+        # Pushed highest first, so the lowest slots are reused first
+        self._free[self._free_count:self._free_count + len(slots)] = np.sort(slots)[::-1]
+        self._free_count += len(slots)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        grown = min(max(2 * capacity, capacity + needed), MAX_UNITS)
+        if grown - capacity < needed:
+            return False
+        for name, dtype, empty in FIELDS:
+            setattr(self, name, np.concatenate((getattr(self, name), np.full(grown - capacity, empty, dtype = dtype))))
+        # The new slots go under the ones already free
+        free = np.empty(grown, dtype = np.int32)
+        free[:grown - capacity] = np.arange(grown - 1, capacity - 1, -1)
+        free[grown - capacity:grown - capacity + self._free_count] = self._free[:self._free_count]
+        self._free = free
+        self._free_count += grown - capacity
+        return True
+
+    def alive(self):
+        return np.flatnonzero(self.owner != NO_OWNER)
+
+    def in_province(self, province):
+        return np.flatnonzero((self.province == province) & (self.owner != NO_OWNER))
+
+    def owned_by(self, nation):
+        return np.flatnonzero(self.owner == nation)
+
+    def per_province(self, province_count):
+        """Number of units in each province"""
+        alive = self.owner != NO_OWNER
+        return np.bincount(self.province[alive], minlength = province_count)
+
+    def find(self, nation, tags):
+        """Slots of the nation's units with the given tags, -1 for tags it has no unit with"""
+        owned = self.owned_by(nation)
+        if not len(owned):
+            return np.full(len(tags), -1)
+        order = np.argsort(self.tag[owned])
+        sorted_tags = self.tag[owned][order]
+        positions = np.searchsorted(sorted_tags, tags)
+        found = positions < len(owned)
+        found[found] = sorted_tags[positions[found]] == np.asarray(tags)[found]
+        return np.where(found, owned[order][np.minimum(positions, len(owned) - 1)], -1)
+
+    def marching(self):
+        """Whether any unit has orders to carry out"""
+        return bool((self.orders != NO_ORDERS).any())
+
+
+def raise_units(state, nation, types, tags):
+    """Raises units in the nation's most populous province, returns whether it did
+
+    All of them or none: types must exist and tags can't be used twice.
+    """
+    types = np.asarray(types, dtype = np.int64)
+    tags = np.asarray(tags, dtype = np.int64)
+    if not len(types) or ((types < 0) | (types >= len(STRENGTH))).any():
+        return False
+    if (tags < np.iinfo(np.int32).min).any() or (tags > np.iinfo(np.int32).max).any():
+        return False
+    if len(np.unique(tags)) != len(tags) or (state.units.find(nation, tags) >= 0).any():
+        return False
+    owned = np.flatnonzero(state.owner == nation)
+    if not len(owned):
+        return False
+
+    home = owned[np.argmax(state.population[owned])]
+    slots = state.units.add(types, nation, home, tags)
+    if slots is None:
+        return False
+    state.unit_changed(slots)
+    return True
+
+
+def order_units(state, nation, tags, provinces):
+    """Orders the nation's units to march to provinces (by ID, 0 to stop), returns whether any were"""
+    provinces = np.asarray(provinces, dtype = np.int64)
+    slots = state.units.find(nation, tags)
+    valid = (slots >= 0) & (provinces >= 0) & (provinces <= len(state.owner))
+    if not valid.any():
+        return False
+    slots = slots[valid]
+    # Province ID 0 becomes NO_ORDERS
+    state.units.orders[slots] = provinces[valid] - 1
+    state.unit_changed(slots)
+    return True
+
+
+def march(state, finder):
+    """Moves every unit with orders one province along its path, returns how many moved
+
+    Units that arrived, or can't get there, drop their orders. Paths don't
+    depend on what the finder cached before, so where units end up depends on
+    nothing but the game.
+    """
+    units = state.units
+    moving = np.flatnonzero((units.orders != NO_ORDERS) & (units.owner != NO_OWNER))
+    if not len(moving):
+        return 0
+    # Units of the same type going the same way share a query
+    queries, inverse = np.unique(np.stack((units.province[moving], units.orders[moving], units.type[moving]), axis = 1),
+        axis = 0, return_inverse = True)
+    paths = finder.paths([(origin, destination, PASSABLE[kind]) for origin, destination, kind in queries.tolist()])
+    next_step = np.array([path[1] if path is not None and len(path) > 1 else -1 for path in paths], dtype = np.int64)[inverse.ravel()]
+
+    steps = next_step >= 0
+    units.province[moving[steps]] = next_step[steps]
+    done = (units.province[moving] == units.orders[moving]) | ~steps
+    units.orders[moving[done]] = NO_ORDERS
+    state.unit_changed(moving)
+    return int(np.count_nonzero(steps))
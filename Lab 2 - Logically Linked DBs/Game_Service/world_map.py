@@ -0,0 +1,179 @@
+"""The static map every game is played on: terrain, base yields, coordinates and adjacency
+
+It's compiled once into a binary file, `python world_map.py [path]`, which the
+Dockerfile does at build time, and open_map() does on first use if there's no file
+yet. Every Game Service process memory-maps that
+file read-only, and its arrays are NumPy views straight into the mapping:
+opening it reads nothing but the header, and all processes on a host share
+one physical copy through the page cache.
+
+File layout, all little-endian:
+
+    magic          8 bytes   b"PADWORLD"
+    version        uint32
+    provinces      uint32
+    resource types uint32
+    edges          uint32    length of the adjacency array
+    sections       (offset uint64, length uint64) each, in SECTIONS order
+
+followed by the sections' data, each starting on a 64 byte boundary.
+Adjacency is in CSR form: the neighbours of province index i are
+adjacency[adjacency_offsets[i]:adjacency_offsets[i + 1]], as indices.
+"""
+import os
+import sys
+import mmap
+import struct
+
+import numpy as np
+
+
+MAGIC = b"PADWORLD"
+VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+SECTION = struct.Struct("<QQ")
+ALIGNMENT = 64
+
+DEFAULT_PATH = os.getenv("WORLD_MAP_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "world.map"))
+
+PLAINS = 0
+FOREST = 1
+HILLS = 2
+MOUNTAINS = 3
+DESERT = 4
+MARSH = 5
+# No unit can enter lakes, and nobody starts in one
+LAKE = 6
+TERRAIN_TYPES = 7
+
+# Section name, dtype, shape as a function of (provinces, resource types, edges)
+SECTIONS = (
+    ("terrain", np.dtype("u1"), lambda p, r, e: (p,)),
+    ("base_yield", np.dtype("<i4"), lambda p, r, e: (p, r)),
+    ("coords", np.dtype("<f4"), lambda p, r, e: (p, 2)),
+    ("adjacency_offsets", np.dtype("<i4"), lambda p, r, e: (p + 1,)),
+    ("adjacency", np.dtype("<i4"), lambda p, r, e: (e,))
+)
+
+
+class WorldMap:
+    """A compiled map file, memory-mapped read-only
+
+    The arrays (see SECTIONS) are read-only views into the file, indexed by province ID - 1.
+    """
+    def __init__(self, path = DEFAULT_PATH):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, provinces, resource_types, edges = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} isn't a version {VERSION} world map, rebuild it with world_map.py")
+
+        self.province_count = provinces
+        self.resource_types = resource_types
+        for i, (name, dtype, shape) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(self._mmap, HEADER.size + i * SECTION.size)
+            shape = shape(provinces, resource_types, edges)
+            if length != dtype.itemsize * int(np.prod(shape)) or offset + length > len(self._mmap):
+                raise ValueError(f"{path} is truncated or corrupt, rebuild it with world_map.py")
+            setattr(self, name, np.frombuffer(self._mmap, dtype = dtype, count = length // dtype.itemsize, offset = offset).reshape(shape))
+
+    def neighbours(self, province):
+        """Indices of the provinces bordering the one at index `province`"""
+        return self.adjacency[self.adjacency_offsets[province]:self.adjacency_offsets[province + 1]]
+
+
+def open_map(path = DEFAULT_PATH):
+    """The world map at path, compiling the generated one there first if there's no file yet"""
+    if not os.path.exists(path):
+        write(path, *generate())
+    return WorldMap(path)
+
+
+def write(path, terrain, base_yield, coords, neighbours):
+    """Compiles map data into a file, `neighbours` being one list of province indices per province"""
+    offsets = np.zeros(len(neighbours) + 1, dtype = np.int32)
+    offsets[1:] = np.cumsum([len(adjacent) for adjacent in neighbours])
+    adjacency = np.concatenate([np.sort(adjacent) for adjacent in neighbours]).astype(np.int32)
+    arrays = {
+        "terrain": terrain, "base_yield": base_yield, "coords": coords,
+        "adjacency_offsets": offsets, "adjacency": adjacency
+    }
+
+    provinces, resource_types = base_yield.shape
+    position = HEADER.size + SECTION.size * len(SECTIONS)
+    sections, blobs = [], []
+    for name, dtype, shape in SECTIONS:
+        data = np.ascontiguousarray(arrays[name], dtype = dtype)
+        assert data.shape == shape(provinces, resource_types, len(adjacency)), name
+        padding = -position % ALIGNMENT
+        blobs.append(bytes(padding) + data.tobytes())
+        position += padding
+        sections.append(SECTION.pack(position, data.nbytes))
+        position += data.nbytes
+
+    # Written aside and renamed, processes mapping the old file keep it intact
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, provinces, resource_types, len(adjacency)))
+        file.write(b"".join(sections))
+        file.write(b"".join(blobs))
+    os.replace(temporary, path)
+
+
+# Base yield of each resource type, by terrain, before each province's own variation
+TERRAIN_YIELDS = np.array([
+    [60, 20, 10, 10, 30, 10, 20, 10], # Plains
+    [20, 60, 10, 10, 10, 20, 20, 10], # Forest
+    [20, 20, 40, 30, 10, 10, 10, 20], # Hills
+    [ 5, 10, 60, 50,  5,  5,  5, 40], # Mountains
+    [ 5,  5, 20, 20,  5, 40, 10, 30], # Desert
+    [10, 30,  5,  5, 40, 20, 10, 10], # Marsh
+    [ 0,  0,  0,  0,  0,  0,  0,  0]  # Lake
+])
+
+
+def generate(side = 20, seed = 0):
+    """Lays out a side x side map of provinces on a jittered grid, each bordering up to 6 others"""
+    rng = np.random.default_rng(seed)
+    rows, columns = np.divmod(np.arange(side * side), side)
+    coords = np.stack([columns + rng.uniform(-0.3, 0.3, side * side), rows + rng.uniform(-0.3, 0.3, side * side)], axis = 1)
+
+    # Smooth elevation and moisture from a few random bumps, for terrain to come in regions
+    def field(bumps):
+        centres = rng.uniform(0, side, (bumps, 2))
+        heights = rng.uniform(-1, 1, bumps)
+        distance = np.linalg.norm(coords[:, None, :] - centres[None, :, :], axis = 2)
+        return (heights * np.exp(-(distance / (side / 5)) ** 2)).sum(axis = 1)
+    elevation, moisture = field(12), field(12)
+
+    # Thresholds by share of the map, whatever the bumps came out as
+    dry, wet, very_wet = np.quantile(moisture, (0.15, 0.65, 0.9))
+    low, high, peak = np.quantile(elevation, (0.04, 0.8, 0.93))
+    terrain = np.where(moisture > wet, FOREST, PLAINS)
+    terrain = np.where(moisture < dry, DESERT, terrain)
+    terrain = np.where((moisture > very_wet) & (elevation < high), MARSH, terrain)
+    terrain = np.where(elevation > high, HILLS, terrain)
+    terrain = np.where(elevation > peak, MOUNTAINS, terrain)
+    terrain = np.where(elevation < low, LAKE, terrain)
+
+    variation = rng.uniform(0.5, 1.5, (side * side, TERRAIN_YIELDS.shape[1]))
+    base_yield = np.rint(TERRAIN_YIELDS[terrain] * variation)
+
+    # Hexagonal neighbourhood: left/right, up/down and one diagonal
+    neighbours = []
+    for row, column in zip(rows, columns):
+        adjacent = []
+        for d_row, d_column in ((0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, 1)):
+            r, c = row + d_row, column + d_column
+            if 0 <= r < side and 0 <= c < side:
+                adjacent.append(r * side + c)
+        neighbours.append(adjacent)
+    return terrain, base_yield, coords, neighbours
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    write(path, *generate())
+    world = WorldMap(path)
+    print(f"Wrote {path}: {world.province_count} provinces, {len(world.adjacency) // 2} borders, "
+          f"{os.path.getsize(path)} bytes")
@@ -2,6 +2,7 @@ const express = require('express');
 const http = require("http");
 const WebSocket = require("ws");
 const axios = require('axios');
+const crypto = require('crypto');
 const jwt = require('jsonwebtoken');
 const opossum = require('opossum');
 const grpc = require('@grpc/grpc-js');
@@ -13,6 +14,8 @@ const Redis = require('ioredis');
 let PORT = 6969;
 let services = {};
 let clients = {};
+// Points on the game placement ring, sorted by token, see Game_Service/placement.py
+let ring = [];
 let user_port = 9000;
 let game_port = 7000;
 let websocket_port = 7500;
@@ -27,6 +30,13 @@ const ping_limit = 5;
 
 const reroute_limit = 2;
 const error_limit = 3;
+// Status & websocket close code of a Game Service the game doesn't belong to
+const misplaced_status = 421;
+const misplaced_close_code = 4421;
+// Times a websocket follows its game to another Game Service before the client has to reconnect
+const move_limit = 3;
+// Client messages held while a websocket connects to a Game Service, past this the client gets disconnected
+const backlog_limit = 64;
 
 // Express & Websocket setup
 const app = express();
@@ -166,16 +176,82 @@ async function setUpClients(){
         delete clients[key];
       }
     }
+
+    let placement = await axios.get(`${service_discovery_url}/placement`);
+    ring = buildRing(placement.data);
   }catch{
     console.log("Failed to sync gRPC clients with services!")
   }
 }
 
 
-function pickService(name){
+function ringToken(key){
+  // First 4 bytes of the MD5 of the key's decimal form, as the Game Service hashes it
+  return crypto.createHash('md5').update(String(Number(key))).digest().readUInt32BE(0)
+}
+
+
+function buildRing(placement){
+  let points = []
+  for(let key in placement){
+    for(let token of placement[key].tokens){
+      points.push({token: token, key: key})
+    }
+  }
+  return points.sort((a, b) => a.token - b.token)
+}
+
+
+function ringOwner(name, routing_key){
+  /**
+   * Walks the ring from the key's position, the first available service it reaches gets the key
+   * 
+   * Returns undefined if no service with that name is on the ring
+   */
+  let points = ring.filter(point => point.key.startsWith(name))
+  if(points.length == 0){
+    return undefined
+  }
+
+  let token = ringToken(routing_key)
+  let start = points.findIndex(point => point.token >= token)
+  if(start == -1){
+    start = 0
+  }
+  for(let i = 0; i < points.length; i++){
+    let key = points[(start + i) % points.length].key
+    if(key in clients && clients[key][0].closed){
+      return clients[key]
+    }
+  }
+  return null
+}
+
+
+function hostService(host){
+  // Client of the service registered under a host name, if it's available
+  for(let key in clients){
+    if(services[key] == host && clients[key][0].closed){
+      return clients[key]
+    }
+  }
+  return null
+}
+
+
+function pickService(name, routing_key){
   /**
    * Function that returns the client with a desired name, with the fewest requests
+   * 
+   * Services placing their work on the ring get the key's owner instead, if there's a key
    */
+  if(routing_key !== undefined){
+    let owner = ringOwner(name, routing_key)
+    if(owner !== undefined){
+      return owner
+    }
+  }
+
   let target_task = null
   let min_task_count = Infinity
   for(let key in clients){
@@ -210,6 +286,9 @@ async function RPC(req, res, service_name, method, cache=0, cache_key=null, set_
   let reroute_count = 0
   let status = 503
   let json = {}
+  // Games go to the Game Service replica they belong to
+  let routing_key = req.body ? req.body.gameID : undefined
+  let redirect = null
 
   if(cache == 1 && cache_key != null){
     // Retrieve value from cache
@@ -224,7 +303,8 @@ async function RPC(req, res, service_name, method, cache=0, cache_key=null, set_
 
   while(reroute_count < reroute_limit && success == false){
     // Pick an available service
-    let service = pickService(service_name)
+    let service = redirect != null ? redirect : pickService(service_name, routing_key)
+    redirect = null
     if(service != null){
       console.log(service[0].options.name)
       service[2] += 1
@@ -242,6 +322,14 @@ async function RPC(req, res, service_name, method, cache=0, cache_key=null, set_
         }
       }
       service[2] -= 1
+
+      if(success && status == misplaced_status){
+        // The service's ring is newer than ours, go where it says the game is
+        console.log(`Game belongs to ${json.body.owner}, redirecting...`)
+        await setUpClients()
+        redirect = hostService(json.body.owner)
+        success = false
+      }
     }else{
       //Ran out of options
       status = 503
@@ -313,8 +401,22 @@ function authenticate(req, res, next){
 }
 
 
-wss.on('connection', (ws) => {
-  let service = pickService("game-service")
+wss.on('connection', (ws, req) => {
+  // Players connect to /game/<GID>?token=<JWT>, browsers can't set an authorization header on websockets
+  let url = new URL(req.url, "ws://gateway");
+  let gameMatch = url.pathname.match(/^\/game\/(\d+)$/);
+  let user;
+  try {
+    user = jwt.verify(url.searchParams.get("token"), process.env.JWT_SECRET);
+  } catch(err) {
+    user = null;
+  }
+  if(gameMatch == null || user == null || !user.id){
+    ws.close(1008, "Unauthorized");
+    return;
+  }
+
+  let service = pickService("game-service", gameMatch[1])
   if(service == null){
     ws.send("Service currently unavailable");
     ws.close();
@@ -322,16 +424,68 @@ wss.on('connection', (ws) => {
   }
 
   service[2] += 1;
-  let serviceURL = `ws://${services[service[0].options.name]}:${websocket_port}`;
+  let serviceSocket = null;
+  let moves = 0;
+  // Client messages sent while connecting to a Game Service, forwarded once it's open
+  let backlog = [];
+
+  function connectService(host){
+    // The Game Service trusts the user ID in the path, it only ever comes from here
+    serviceSocket = new WebSocket(`ws://${host}:${websocket_port}/game/${gameMatch[1]}/${user.id}`);
+
+    serviceSocket.on('open', () => {
+      for(let [message, isBinary] of backlog){
+        serviceSocket.send(message, {binary: isBinary});
+      }
+      backlog = [];
+    });
 
-  const serviceSocket = new WebSocket(serviceURL);
+    serviceSocket.on('message', (message, isBinary) => {
+      // The game is being served, later moves get their own tries
+      moves = 0;
+      ws.send(message, {binary: isBinary});
+    });
 
-  ws.on('message', (message) => {
-    serviceSocket.send(message);
-  });
+    serviceSocket.on('error', (err) => {
+      // Always followed by 'close'
+      console.log("Game Service websocket error! ", err.message);
+    });
 
-  serviceSocket.on('message', (message) => {
-    ws.send(message);
+    serviceSocket.on('close', (code, reason) => {
+      if(ws.readyState != WebSocket.OPEN){
+        return;
+      }
+      if(code == misplaced_close_code){
+        // The game belongs to, or just moved to, the replica named in the reason: follow it there,
+        // the client only notices the pause
+        setUpClients();
+        moves += 1;
+        if(moves <= move_limit){
+          connectService(reason.toString());
+          return;
+        }
+        code = 1012;
+        reason = "Game moved, reconnect";
+      }
+      // Anything else ends the client's websocket the same way, 1005 & 1006 only mean the Game Service went away
+      backlog = [];
+      let sendable = (code >= 1000 && code <= 1014 && ![1004, 1005, 1006].includes(code)) || (code >= 3000 && code <= 4999);
+      ws.close(sendable ? code : 1011, sendable ? reason.toString() : "Game Service unavailable");
+    });
+  }
+
+  connectService(services[service[0].options.name]);
+
+  // Keep text frames as text, the Game Service tells JSON and binary actions apart by the frame type
+  ws.on('message', (message, isBinary) => {
+    if(serviceSocket.readyState == WebSocket.OPEN){
+      serviceSocket.send(message, {binary: isBinary});
+    }else if(backlog.length < backlog_limit){
+      backlog.push([message, isBinary]);
+    }else{
+      backlog = [];
+      ws.close(1013, "Too many messages, reconnect");
+    }
   });
 
   ws.on('close', () => {
@@ -367,7 +521,48 @@ app.post('/frequest/:userID', countPings, authenticate, async (req, res) => {
 // ROUTES - GAME
 
 app.get('/lobby', countPings, authenticate, async (req, res) => {
-  RPC(req, res, "game-service", "getLobbies", 1, "lobby_list")
+  req.body["pageSize"] = req.query.pageSize
+  req.body["cursor"] = req.query.cursor
+  req.body["hasFreeSlots"] = req.query.free === "true"
+  req.body["namePrefix"] = req.query.name
+  RPC(req, res, "game-service", "getLobbies", 1, `lobby_list:${new URLSearchParams(req.query)}`)
+})
+
+app.get('/lobby/watch', countPings, authenticate, (req, res) => {
+  /**
+   * Relays a Game Service lobby stream as Server-Sent Events
+   *
+   * Clients that got cut off can reconnect with the last epoch & version they saw
+   */
+  let service = pickService("game-service")
+  if(service == null){
+    return res.status(503).json({error: "Service temporarily unavailable. Try again later"})
+  }
+
+  res.set({
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive"
+  })
+  res.flushHeaders()
+
+  service[2] += 1
+  const call = service[1].watchLobbies({epoch: req.query.epoch || "", fromVersion: req.query.version || 0})
+
+  call.on('data', (delta) => {
+    res.write(`data: ${JSON.stringify(delta)}\n\n`)
+  })
+  call.on('error', () => {
+    res.end()
+  })
+  call.on('end', () => {
+    res.end()
+  })
+
+  res.on('close', () => {
+    call.cancel()
+    service[2] -= 1
+  })
 })
 
 app.get('/lobby/:lobbyID', countPings, authenticate, async (req, res) => {
@@ -394,6 +589,11 @@ app.get('/lobby/:lobbyID/leave', countPings, authenticate, async (req, res) => {
 
 app.get('/game/:gameID', countPings, authenticate, async (req, res) => {
   req.body["gameID"] = req.params.gameID
+  // The last epoch & version the client saw, to only get what changed since
+  req.body["epoch"] = req.query.epoch || ""
+  req.body["fromVersion"] = req.query.version || 0
+  // Only the lobby's own players can start its game by looking at it
+  req.body["userID"] = req.body["srcID"]
   RPC(req, res, "game-service", "getGame")
 })
 
@@ -4,12 +4,15 @@ const app = express();
 
 let PORT = 4444
 let services = {}
+// Hash ring points advertised by services that place work by key, by entry name
+let placement = {}
 
 app.use(express.json());
 
 function addEntry(entry){
   let count = 1
-  let key = Object.keys(entry)[0]
+  let {tokens, ...named} = entry
+  let key = Object.keys(named)[0]
 
   let newKey = key + count.toString()
   while(services.hasOwnProperty(newKey)){
@@ -18,6 +21,21 @@ function addEntry(entry){
   }
 
   services[newKey] = entry[key];
+  if(tokens !== undefined){
+    placement[newKey] = {host: entry[key], tokens: tokens}
+  }
+}
+
+
+function findEntry(entry){
+  /**
+   * Name of a registered entry, services deregistering themselves send the same entry they registered with
+   */
+  if(entry.name !== undefined){
+    return entry.name
+  }
+  let key = Object.keys(entry)[0]
+  return Object.keys(services).find(name => name.startsWith(key) && services[name] == entry[key])
 }
 
 app.post('/register', (req, res) => {
@@ -27,7 +45,9 @@ app.post('/register', (req, res) => {
 
 
 app.post('/deregister', (req, res) => {
-  delete services[req.body.name]
+  let name = findEntry(req.body)
+  delete services[name]
+  delete placement[name]
   res.status(200).json({"response": 200})
 })
 
@@ -37,6 +57,11 @@ app.get('/services', (req, res) => {
 })
 
 
+app.get('/placement', (req, res) => {
+  res.status(200).json(placement)
+})
+
+
 app.get('/status', (req, res) => {
   res.status(200).json({"status": "online"})
 })
@@ -0,0 +1,76 @@
+"""Benchmarks for the User Service
+
+Run with `python bench.py [name ...]`, all of them run if no name is given.
+They write to DATABASE_URL, so point it at a scratch database.
+"""
+import os
+import sys
+import time
+
+import psycopg2
+
+import main
+import statements
+
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def prepared_statements(user_count = 1000, rounds = 2000):
+    """Per-query latency of the login and friends queries sent as SQL text vs run as prepared statements"""
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn.autocommit = True
+    # The same single connection the service runs on
+    cursor = main.cursor = conn.cursor()
+    main.check_db_tables()
+    statements.prepare_all(cursor)
+
+    user_ids = []
+    for i in range(user_count):
+        cursor.execute(main.ADD_USER, (f"prepared{i}", "password"))
+        user_ids.append(cursor.fetchone()[0])
+
+    cases = [
+        ("user_by_name", lambda i: (main.USER_BY_NAME, (f"prepared{i % user_count}",))),
+        ("get_friends", lambda i: (main.GET_FRIENDS, (user_ids[i % user_count],))),
+        ("add_friend", lambda i: (main.ADD_FRIEND, (i, user_ids[i % user_count])))
+    ]
+    for name, case in cases:
+        start = time.perf_counter()
+        for i in range(rounds):
+            cursor.execute(*case(i))
+            if cursor.description is not None:
+                cursor.fetchall()
+        plain = (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            statements.execute(cursor, *case(i))
+            if cursor.description is not None:
+                cursor.fetchall()
+        prepared = (time.perf_counter() - start) / rounds
+
+        print(f"{name}: {plain * 1e6:.0f}us as text, {prepared * 1e6:.0f}us prepared, "
+              f"{(1 - prepared / plain) * 100:.0f}% less")
+
+    # Both ways found the same user and added the same friends
+    cursor.execute(main.USER_BY_NAME, ("prepared0",))
+    expected = cursor.fetchall()
+    statements.execute(cursor, main.USER_BY_NAME, ("prepared0",))
+    assert cursor.fetchall() == expected
+    statements.execute(cursor, main.GET_FRIENDS, (user_ids[0],))
+    assert cursor.fetchone()[0] == [i for i in range(rounds) if i % user_count == 0] * 2
+    cursor.execute("DELETE FROM user_info WHERE id = ANY(%s)", (user_ids,))
+    conn.close()
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
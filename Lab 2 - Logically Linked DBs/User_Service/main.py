@@ -10,6 +10,7 @@ from time import sleep
 from concurrent import futures
 from prometheus_client import start_http_server, Counter
 
+import statements
 import user_routes_pb2 as pb2
 import user_routes_pb2_grpc as pb2_grpc
 import health_pb2 as hpb2
@@ -18,6 +19,13 @@ import health_pb2_grpc as hpb2_grpc
 
 request_counter = Counter("user_service_total_requests", "Total requests to the User Service")
 
+# Prepared once on the service's connection, see statements.py
+USER_BY_NAME = statements.prepared("user_by_name", "SELECT username, password FROM user_info WHERE username=%s")
+USER_BY_ID = statements.prepared("user_by_id", "SELECT username FROM user_info WHERE id=%s")
+ADD_USER = statements.prepared("add_user", "INSERT INTO user_info (username, password) VALUES (%s, %s) RETURNING id")
+GET_FRIENDS = statements.prepared("get_friends", "SELECT friends FROM user_info WHERE id=%s")
+ADD_FRIEND = statements.prepared("add_friend", "UPDATE user_info SET friends = array_append(friends, %s) WHERE id = %s")
+
 def registerSelf():
     response = requests.post(f"{SERVICE_DISCOVERY_URL}/register", json = {f"user-service": INSTANCE_ID})
 
@@ -66,14 +74,12 @@ class UserService(pb2_grpc.UserRoutesServicer):
         """
         result = {}
         
-        query = "SELECT username, password FROM user_info WHERE username=%s"
-        cursor.execute(query, (request.username,))
+        statements.execute(cursor, USER_BY_NAME, (request.username,))
         target_user = cursor.fetchone()
 
         if request.newAccount:
             if target_user is None:
-                query = "INSERT INTO user_info (username, password) VALUES (%s, %s) RETURNING id"
-                cursor.execute(query, (request.username, request.password))
+                statements.execute(cursor, ADD_USER, (request.username, request.password))
                 logger.info("User Added!")
 
                 new_id = cursor.fetchone()[0]
@@ -98,8 +104,7 @@ class UserService(pb2_grpc.UserRoutesServicer):
         return pb2.LoginConfirm(**result)
     
     def checkProfile(self, request, context):
-        query = "SELECT username FROM user_info WHERE id=%s"
-        cursor.execute(query, (request.userID,))
+        statements.execute(cursor, USER_BY_ID, (request.userID,))
         target_user = cursor.fetchone()
 
         if target_user:
@@ -111,16 +116,12 @@ class UserService(pb2_grpc.UserRoutesServicer):
 
     def sendFriendRequest(self, request, context):
         if request.srcID != request.destID:
-            query = "SELECT friends FROM user_info WHERE id=%s"
-            cursor.execute(query, (request.destID,))
+            statements.execute(cursor, GET_FRIENDS, (request.destID,))
             target_user = cursor.fetchone()
 
             if target_user:
                 if request.srcID not in target_user[0]:
-                    query = "UPDATE user_info \
-                        SET friends = array_append(friends, %s) \
-                        WHERE id = %s"
-                    cursor.execute(query, (request.srcID, request.destID))
+                    statements.execute(cursor, ADD_FRIEND, (request.srcID, request.destID))
                     result = {"status": 200}
                 else:
                     result = {"status": 400}
@@ -187,6 +188,7 @@ if __name__ == '__main__':
     conn.autocommit = True
     cursor = conn.cursor()
     check_db_tables()
+    statements.prepare_all(cursor)
 
     registerSelf()
     # Deregister self if service is shut down
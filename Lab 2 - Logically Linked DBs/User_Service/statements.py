@@ -0,0 +1,35 @@
+"""Server-side prepared statements for the hot queries
+
+The User Service runs every query on the one connection it opens at
+startup, so registered queries are PREPAREd on it once, by prepare_all(),
+and run with EXECUTE by name from then on.
+"""
+
+# SQL text -> (PREPARE statement, EXECUTE statement)
+_statements = {}
+
+
+def prepared(name, sql):
+    """Registers `sql` to be run as the prepared statement `name`, returns the SQL unchanged
+
+    Its %s placeholders become $1, $2... in order, their types are left for Postgres to infer.
+    """
+    count = sql.count("%s")
+    body = sql.replace("%s", "{}").format(*[f"${i + 1}" for i in range(count)])
+    run = f"EXECUTE {name}"
+    if count:
+        run += f" ({', '.join(['%s'] * count)})"
+    _statements[sql] = (f"PREPARE {name} AS {body}", run)
+    return sql
+
+
+def prepare_all(cursor):
+    """Prepares every registered statement on the cursor's connection, once its tables exist"""
+    for prepare, run in _statements.values():
+        cursor.execute(prepare)
+
+
+def execute(cursor, sql, params = None):
+    """Runs `sql`, by name if it's a registered statement"""
+    statement = _statements.get(sql)
+    cursor.execute(statement[1] if statement is not None else sql, params)